@@ -3,29 +3,16 @@ Plot of all EONET (Earth Observatory Natural Event Tracker) events data in the l
 
 API: https://eonet.gsfc.nasa.gov/docs/v2.1/events
 (There is also an Category-API.)
+The data is cached in ./eonet-data (s. eonet_fetcher.py).
 """
 
-import requests
-import json
 import plotly.express as px
+from eonet_fetcher import fetch
 
-limit = -1  # All events in period
 days = 365  # last year
-file_name = 'events_eonet.json'
 
-try:
-    # Read data
-    with open(file_name) as f:
-        events_data = f.readall()
-except Exception:
-    # Request data
-    url = f'https://eonet.gsfc.nasa.gov/api/v2.1/events?limit={limit}&days={days}'
-    r = requests.get(url)
-    # Parse data
-    events_data = r.json()
-    # Save data
-    with open(file_name, 'w') as f:
-        f.write(json.dumps(events_data, indent=4))
+# Fetch data (only the days since the last run are requested, s. eonet_fetcher.py)
+events_data, _ = fetch(days)
 
 # Extract coordinates from geoJSON and event title
 longitudes, latitudes = [], []
@@ -0,0 +1,375 @@
+"""
+Fetching EONET (Earth Observatory Natural Event Tracker) events and categories with a local cache.
+
+API: https://eonet.gsfc.nasa.gov/docs/v2.1
+
+The events and the categories are requested concurrently (asyncio, the blocking requests run in threads sharing one pooled requests.Session). Failed requests (connection errors, timeouts, 429 and 5xx responses) are retried with exponential backoff.
+The response of the events is streamed: the 'events' array is parsed event by event (s. json_stream.py), geometries outside [-180, 180] x [-90, 90] are dropped on the fly (some coordinates of EONET are switched) and every event is appended as one compact line to the cache, ie. memory doesn't depend on the number of requested days.
+
+Cache (<cache_dir>):
+    eonet_events.jsonl          One event per line (compact JSON)
+    eonet_events_meta.json      Other members of the response (title, ...), newest event date, start of the covered period and time of the last sync
+    categoryIDs_data_eonet.json Categories
+The cache is synced incrementally: only the days since the newest stored event are requested, updated events replace their stored version (by id), ie. the full year is downloaded only once. The whole period is requested again if it starts before the period the cache covers (f.i. 365 days after a sync of 30 days).
+
+Usage:
+    from eonet_fetcher import fetch
+    events_data, categories_data = fetch(days=365)
+
+    python eonet_fetcher.py [--days 365] [--cache-dir ./eonet-data] [--base-url http://localhost:8000/api/v2.1] [--refresh]
+"""
+
+import os
+import json
+import math
+import time
+import asyncio
+import argparse
+import requests
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+from requests.adapters import HTTPAdapter
+from json_stream import iter_array
+
+EONET_API = 'https://eonet.gsfc.nasa.gov/api/v2.1'
+EVENTS_FILE = 'eonet_events.jsonl'
+META_FILE = 'eonet_events_meta.json'
+CATEGORIES_FILE = 'categoryIDs_data_eonet.json'
+# Cache of former versions (one pretty-printed JSON document), migrated on first use
+LEGACY_EVENTS_FILE = 'eonet_data.json'
+# Responses worth another try
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Bytes per chunk of a streamed response
+CHUNK_SIZE = 2**16
+
+
+class RetryableHTTPError(requests.HTTPError):
+    """Response with a status of RETRY_STATUS."""
+
+
+# Errors worth another try
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, RetryableHTTPError)
+
+
+def parse_date(date: str) -> datetime:
+    """Timezone aware (UTC) datetime of an ISO date like '2023-08-01T00:00:00Z'."""
+    date = datetime.fromisoformat(date.replace('Z', '+00:00'))
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def event_date(event: dict) -> datetime:
+    """Date of the newest geometry of an event (timezone aware, UTC)."""
+    return max(parse_date(geometry['date']) for geometry in event['geometries'])
+
+
+def valid_coordinates(geometry: dict) -> bool:
+    """Check consitency of the coordinates of a geometry (Point or Polygon).
+
+    Some coordinates are obvious switched and easily to filter but there is
+    also an iclandic volcano in the indian ocean.
+    """
+    coordinates = geometry['coordinates']
+    points = [coordinates] if geometry['type'] == 'Point' else [point for ring in coordinates for point in ring]
+    return all(-180 <= point[0] <= 180 and -90 <= point[1] <= 90 for point in points)
+
+
+def validate_event(event: dict) -> dict:
+    """Drop the geometries with invalid coordinates (s. valid_coordinates()), None if no geometry is left."""
+    event['geometries'] = [geometry for geometry in event['geometries'] if valid_coordinates(geometry)]
+    return event if event['geometries'] else None
+
+
+def read_json(path: str) -> dict:
+    """Read a JSON file, None if it doesn't exist or is corrupt (f.i. an interrupted write of a former version)."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_json(path: str,
+               data: dict) -> None:
+    """Write a JSON file atomically, ie. readers never see partial files."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp_path, path)
+
+
+def read_chunks(path: str,
+                size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a file block by block."""
+    with open(path, 'rb') as f:
+        while chunk := f.read(size):
+            yield chunk
+
+
+class EonetFetcher():
+    """Asynchronous client of the EONET API with a local, incrementally synced cache."""
+
+    def __init__(self,
+                 cache_dir: str = './eonet-data',
+                 base_url: str = EONET_API,
+                 max_retries: int = 4,
+                 backoff: float = 0.5,
+                 timeout: float = 60.,
+                 pool_size: int = 8):
+        """
+        :cache_dir: Directory of the cached events and categories (created if missing).
+        :base_url: URL of the API, f.i. of a local stub server for testing.
+        :max_retries: Number of retries of a failed request.
+        :backoff: Delay in seconds before the first retry, doubled for every further one.
+        :timeout: Timeout of a request in seconds.
+        :pool_size: Number of pooled connections per host.
+
+        """
+        self.cache_dir = cache_dir
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.events_path = os.path.join(cache_dir, EVENTS_FILE)
+        self.meta_path = os.path.join(cache_dir, META_FILE)
+        self.categories_path = os.path.join(cache_dir, CATEGORIES_FILE)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self,
+             path: str,
+             params: dict = None,
+             stream: bool = False) -> requests.Response:
+        """Request an endpoint of the API (blocking), raises RetryableHTTPError for responses worth another try."""
+        r = self.session.get(f'{self.base_url}/{path}', params=params, timeout=self.timeout, stream=stream)
+        if r.status_code in RETRY_STATUS:
+            error = RetryableHTTPError(f'{r.status_code} for {r.url}', response=r)
+            # Honor the delay requested by the server (in seconds)
+            retry_after = r.headers.get('Retry-After', '')
+            error.retry_after = float(retry_after) if retry_after.isdigit() else None
+            r.close()
+            raise error
+        r.raise_for_status()
+        return r
+
+    def _retrying(self, function, *args):
+        """Call :function: (blocking), retried with exponential backoff on RETRY_ERRORS."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return function(*args)
+            except RETRY_ERRORS as e:
+                error = e
+                delay = getattr(e, 'retry_after', None) or self.backoff * 2**attempt
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        raise error
+
+    async def get_json(self,
+                       path: str,
+                       params: dict = None) -> dict:
+        """Request an endpoint of the API, retried with exponential backoff.
+
+        :path: Endpoint relative to :base_url:, f.i. 'categories'.
+        :params: Query parameters.
+        :returns: The parsed response
+
+        """
+        return await asyncio.to_thread(self._retrying, lambda: self._get(path, params).json())
+
+    def _ingest(self,
+                events: Iterator[dict],
+                header: dict,
+                since: datetime = None) -> dict:
+        """Merge :events: into the cache (streamed), the stored versions of updated events are replaced.
+
+        :events: Events (f.i. parsed incrementally from a response), validated on the fly.
+        :header: Other members of the response, complete after :events: is exhausted.
+        :since: Start of the requested period (up to now), extends the period covered by the cache. None if unknown (f.i. the legacy cache).
+        :returns: Meta data of the cache
+
+        """
+        new_path = f'{self.events_path}.new'
+        new_ids = set()
+        newest = None
+        with open(new_path, 'w') as f:
+            for event in events:
+                event = validate_event(event)
+                if event is None:
+                    continue
+                new_ids.add(event['id'])
+                date = event_date(event)
+                newest = date if newest is None or date > newest else newest
+                f.write(json.dumps(event, separators=(',', ':')))
+                f.write('\n')
+        # Stored events which weren't updated followed by the new ones
+        tmp_path = f'{self.events_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            if os.path.exists(self.events_path):
+                with open(self.events_path) as stored:
+                    for line in stored:
+                        if json.loads(line)['id'] not in new_ids:
+                            f.write(line)
+            with open(new_path) as new:
+                for line in new:
+                    f.write(line)
+        os.replace(tmp_path, self.events_path)
+        os.remove(new_path)
+
+        meta = read_json(self.meta_path) or {}
+        if meta.get('newest'):
+            newest = max(filter(None, (newest, parse_date(meta['newest']))))
+        if since is not None:
+            # The requested period joins the covered one if it starts before the last sync
+            if meta.get('covered_since') and meta.get('synced') and since <= parse_date(meta['synced']):
+                since = min(since, parse_date(meta['covered_since']))
+            meta['covered_since'] = since.isoformat()
+        meta.update(header=header,
+                    newest=newest.isoformat() if newest else None,
+                    synced=datetime.now(timezone.utc).isoformat())
+        write_json(self.meta_path, meta)
+        return meta
+
+    def _ingest_response(self, params: dict) -> dict:
+        """Stream the events of a request into the cache (blocking)."""
+        since = datetime.now(timezone.utc) - timedelta(days=params['days']) if 'days' in params else None
+        with self._get('events', params, stream=True) as r:
+            header = {}
+            return self._ingest(iter_array(r.iter_content(CHUNK_SIZE), 'events', header), header, since)
+
+    def _migrate_legacy_cache(self) -> None:
+        """Convert the cache of former versions (one JSON document) into the cache of lines."""
+        legacy_path = os.path.join(self.cache_dir, LEGACY_EVENTS_FILE)
+        if os.path.exists(self.events_path) or not os.path.exists(legacy_path):
+            return
+        header = {}
+        try:
+            self._ingest(iter_array(read_chunks(legacy_path), 'events', header), header)
+        except (json.JSONDecodeError, KeyError):  # Corrupt, f.i. an interrupted write
+            for path in (self.events_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        os.remove(legacy_path)
+
+    def iter_events(self,
+                    days: int = None) -> Iterator[dict]:
+        """Stream the cached events.
+
+        :days: Only events of the last :days: days, all if None.
+        :returns: Iterator over the events
+
+        """
+        start = None if days is None else datetime.now(timezone.utc) - timedelta(days=days)
+        if not os.path.exists(self.events_path):
+            return
+        with open(self.events_path) as f:
+            for line in f:
+                event = json.loads(line)
+                if start is None or event_date(event) >= start:
+                    yield event
+
+    def load_cache(self,
+                   days: int = None) -> tuple[dict, dict]:
+        """Cached events (of the last :days: days) and categories, None for each that isn't cached."""
+        self._migrate_legacy_cache()
+        meta = read_json(self.meta_path)
+        events_data = None if meta is None else {**meta['header'], 'events': list(self.iter_events(days))}
+        return events_data, read_json(self.categories_path)
+
+    def days_to_sync(self,
+                     meta: dict,
+                     days: int) -> int:
+        """Number of days to request: those since the newest cached event (including its day), at most :days:.
+
+        All :days: if the period starts before the period covered by the cache (or it is unknown).
+
+        """
+        if not meta or not meta.get('newest') or not meta.get('covered_since'):
+            return days
+        now = datetime.now(timezone.utc)
+        if parse_date(meta['covered_since']) > now - timedelta(days=days):
+            return days
+        since = (now - parse_date(meta['newest'])).total_seconds() / 86400
+        return max(1, min(days, math.ceil(since) + 1))
+
+    async def sync(self,
+                   days: int = 365,
+                   refresh: bool = False) -> tuple[dict, dict]:
+        """Sync the cache with the API and return the events and categories.
+
+        :days: Period of the events (in days before today), the cache keeps older events as well.
+        :refresh: Ignore the cache and request the whole period.
+        :returns: Events data ({'events': [...], ...}) of the period and categories data ({'categories': [...], ...}) like returned by the API
+
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if refresh:
+            for path in (self.events_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._migrate_legacy_cache()
+        sync_days = self.days_to_sync(read_json(self.meta_path), days)
+        # Events and categories concurrently
+        _, categories_data = await asyncio.gather(
+            asyncio.to_thread(self._retrying, self._ingest_response, {'limit': -1, 'days': sync_days}),
+            self.get_json('categories'))
+        if categories_data != read_json(self.categories_path):
+            write_json(self.categories_path, categories_data)
+        return self.load_cache(days)
+
+
+def fetch(days: int = 365,
+          cache_dir: str = './eonet-data',
+          base_url: str = EONET_API,
+          refresh: bool = False,
+          offline: bool = False) -> tuple[dict, dict]:
+    """Synchronous entry point: sync the cache and return the events and categories.
+
+    :days: Period of the events (in days before today).
+    :cache_dir: Directory of the cached events and categories.
+    :base_url: URL of the API.
+    :refresh: Ignore the cache and request the whole period.
+    :offline: Only read the cache, nothing is requested. Raises FileNotFoundError if nothing is cached.
+    :returns: Events data and categories data like returned by the API (use EonetFetcher.iter_events() to stream the events instead)
+
+    """
+    with EonetFetcher(cache_dir, base_url) as fetcher:
+        if offline:
+            events_data, categories_data = fetcher.load_cache(days)
+            if events_data is None or categories_data is None:
+                raise FileNotFoundError(f"No cached EONET data in '{cache_dir}'.")
+            return events_data, categories_data
+        return asyncio.run(fetcher.sync(days, refresh))
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser('eonet_fetcher')
+    p.add_argument('--days',
+                   help='Period of the events in days before today.',
+                   default=365,
+                   type=int)
+    p.add_argument('--cache-dir',
+                   help='Directory of the cached events and categories.',
+                   default='./eonet-data',
+                   type=str)
+    p.add_argument('--base-url',
+                   help='URL of the API, f.i. of a local stub server.',
+                   default=EONET_API,
+                   type=str)
+    p.add_argument('--refresh',
+                   help='Ignore the cache and request the whole period.',
+                   action='store_true')
+    args = p.parse_args()
+
+    events_data, categories_data = fetch(args.days, args.cache_dir, args.base_url, args.refresh)
+    print(f"{len(events_data['events'])} events, {len(categories_data['categories'])} categories:\n\t{args.cache_dir}")
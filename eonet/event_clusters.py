@@ -0,0 +1,244 @@
+"""
+Spatiotemporal clustering of EONET geometries (s. event_store.py), f.i. the observations of a storm or a wildfire complex.
+
+Two geometries are neighbors if they belong to the same category, are at most <radius_km> apart (haversine distance) and at most <max_gap_days> days. A cluster is a connected group of neighbors, ie. a storm track forms one cluster even if its ends are far apart.
+
+Neighbors are found without comparing all pairs: the geometries are put into a grid of cells (3D unit vectors in cells of the chord length of <radius_km>, time in cells of <max_gap_days>, category), only geometries of adjacent cells are candidates (binary search on the sorted cell keys) and their distances are calculated vectorized. The clusters are the connected components of the neighbor pairs (label propagation with pointer jumping).
+
+Usage:
+    labels = cluster_geometries(store, radius_km=100, max_gap_days=3)
+    tracks = cluster_tracks(store, labels)
+
+    python event_clusters.py [--radius-km 100] [--max-gap-days 3] [--min-size 2] [--cache-dir ./eonet-data] [--out tracks.geojson]
+"""
+
+import os
+import json
+import argparse
+import itertools
+import numpy as np
+import numpy.typing as npt
+from event_store import EventStore
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine(lon1: npt.NDArray,
+              lat1: npt.NDArray,
+              lon2: npt.NDArray,
+              lat2: npt.NDArray) -> npt.NDArray:
+    """Great circle distance in km of coordinates in degrees (element wise)."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.)))
+
+
+def _cell_keys(store: EventStore,
+               indices: npt.NDArray,
+               radius_km: float,
+               max_gap_days: float) -> tuple[npt.NDArray, npt.NDArray]:
+    """Key of the grid cell of every geometry and the key offsets of the adjacent cells."""
+    lon, lat = np.radians(store.lon[indices]), np.radians(store.lat[indices])
+    xyz = np.stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)), axis=1)
+    # Geometries within :radius_km: are within the chord of the arc in 3D
+    chord = 2 * np.sin(radius_km / EARTH_RADIUS_KM / 2)
+    # +1: Margin, ie. adjacent cells never wrap around
+    cells = [(xyz[:, i] + 1) // chord + 1 for i in range(3)]
+    sizes = [int(2 // chord) + 3] * 3
+    seconds = store.time[indices].astype(np.int64)
+    # Times are whole seconds, ie. cells shorter than a second aren't needed
+    gap_seconds = max(int(max_gap_days * 86400), 1)
+    times = (seconds - seconds.min()) // gap_seconds + 1 if len(seconds) else seconds
+    cells.append(times)
+    sizes.append(int(times.max()) + 2 if len(times) else 1)
+    cells.append(store.geometry_category[indices])
+    sizes.append(len(store.category_id))
+    if np.prod(np.array(sizes, dtype=np.float64)) >= 2**62:
+        raise ValueError(f'Radius {radius_km} km and gap {max_gap_days} days result in too many cells.')
+    # Mixed radix key (z, y, x, time, category) & offset of a neighbor cell in every dimension
+    keys = np.zeros(len(indices), dtype=np.int64)
+    strides = []
+    stride = 1
+    for cell, size in zip(cells, sizes):
+        keys += cell.astype(np.int64) * stride
+        strides.append(stride)
+        stride *= size
+    # Adjacent cells in space and time, same category
+    offsets = np.array([np.dot(delta, strides[:4]) for delta in itertools.product((-1, 0, 1), repeat=4)],
+                       dtype=np.int64)
+    return keys, offsets
+
+
+def neighbor_pairs(store: EventStore,
+                   indices: npt.NDArray,
+                   radius_km: float,
+                   max_gap_days: float,
+                   block_size: int = 2**16) -> tuple[npt.NDArray, npt.NDArray]:
+    """Pairs of neighbors (positions in :indices:, first < second).
+
+    :store: The events.
+    :indices: Geometries to cluster.
+    :radius_km: Maximal distance of neighbors.
+    :max_gap_days: Maximal time between neighbors.
+    :block_size: Number of geometries whose candidates are evaluated at once, bounds the memory.
+    :returns: Arrays of the first and second geometry of every pair
+
+    """
+    if not radius_km > 0:
+        raise ValueError(f'The radius has to be positive, got {radius_km} km.')
+    if not max_gap_days > 0:
+        raise ValueError(f'The maximal gap has to be positive, got {max_gap_days} days.')
+    keys, offsets = _cell_keys(store, indices, radius_km, max_gap_days)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    lon, lat = store.lon[indices], store.lat[indices]
+    seconds = store.time[indices].astype(np.int64)
+    firsts, seconds_ = [], []
+    for start in range(0, len(indices), block_size):
+        block = np.arange(start, min(start + block_size, len(indices)))
+        for offset in offsets:
+            neighbor_keys = keys[block] + offset
+            begin = np.searchsorted(sorted_keys, neighbor_keys, side='left')
+            counts = np.searchsorted(sorted_keys, neighbor_keys, side='right') - begin
+            if not counts.any():
+                continue
+            # Expand the ranges of candidates into pairs
+            first = np.repeat(block, counts)
+            ends = np.cumsum(counts)
+            second = order[np.arange(ends[-1]) - np.repeat(ends - counts, counts) + np.repeat(begin, counts)]
+            candidate = first < second
+            first, second = first[candidate], second[candidate]
+            close = haversine(lon[first], lat[first], lon[second], lat[second]) <= radius_km
+            close &= np.abs(seconds[first] - seconds[second]) <= max_gap_days * 86400
+            firsts.append(first[close])
+            seconds_.append(second[close])
+    if not firsts:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(firsts), np.concatenate(seconds_)
+
+
+def connected_components(n: int,
+                         first: npt.NDArray,
+                         second: npt.NDArray) -> npt.NDArray:
+    """Label of the connected component of every node (0, 1, ...) given the edges (first, second)."""
+    labels = np.arange(n)
+    while True:
+        # Every node takes the smallest label of its edges ...
+        smallest = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, smallest)
+        np.minimum.at(updated, second, smallest)
+        # ... and the label of its label (pointer jumping)
+        while True:
+            jumped = updated[updated]
+            if np.array_equal(jumped, updated):
+                break
+            updated = jumped
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def cluster_geometries(store: EventStore,
+                       indices: npt.NDArray = None,
+                       radius_km: float = 100.,
+                       max_gap_days: float = 3.) -> npt.NDArray:
+    """Cluster id of every geometry.
+
+    :store: The events.
+    :indices: Geometries to cluster (s. EventStore.query()), all if None.
+    :radius_km: Maximal distance of neighbors.
+    :max_gap_days: Maximal time between neighbors.
+    :returns: Cluster ids (0, 1, ...) of the geometries at :indices:, geometries without neighbors form clusters of one
+
+    """
+    if indices is None:
+        indices = np.arange(len(store))
+    first, second = neighbor_pairs(store, indices, radius_km, max_gap_days)
+    return connected_components(len(indices), first, second)
+
+
+def cluster_tracks(store: EventStore,
+                   labels: npt.NDArray,
+                   indices: npt.NDArray = None,
+                   min_size: int = 2) -> list[dict]:
+    """Track (polyline in chronological order) and summary of every cluster.
+
+    :store: The events.
+    :labels: Cluster ids of the geometries at :indices: (s. cluster_geometries()).
+    :indices: Clustered geometries, all if None.
+    :min_size: Smallest number of geometries of a returned cluster.
+    :returns: Per cluster: 'cluster', 'category', 'size', 'events' (ids), 'start', 'end', 'lon' and 'lat' (the polyline)
+
+    """
+    if indices is None:
+        indices = np.arange(len(store))
+    # Indices are chronological, a stable sort by cluster keeps the order within a cluster
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    boundaries = np.flatnonzero(np.diff(sorted_labels)) + 1
+    tracks = []
+    for label, members in zip(sorted_labels[np.r_[0, boundaries]] if len(labels) else [],
+                              np.split(indices[order], boundaries)):
+        if len(members) < min_size:
+            continue
+        events = store.event[members]
+        tracks.append({'cluster': int(label),
+                       'category': str(store.category_title[store.category[events[0]]]),
+                       'size': len(members),
+                       'events': [str(event_id) for event_id in store.event_id[np.unique(events)]],
+                       'start': str(store.time[members[0]]),
+                       'end': str(store.time[members[-1]]),
+                       'lon': store.lon[members],
+                       'lat': store.lat[members]})
+    return tracks
+
+
+def tracks_to_geojson(tracks: list[dict]) -> dict:
+    """GeoJSON FeatureCollection of the tracks (LineStrings, Points for clusters at one position)."""
+    features = []
+    for track in tracks:
+        coordinates = np.column_stack((track['lon'], track['lat'])).tolist()
+        geometry = {'type': 'LineString', 'coordinates': coordinates} if len(coordinates) > 1 else \
+            {'type': 'Point', 'coordinates': coordinates[0]}
+        properties = {key: value for key, value in track.items() if key not in ('lon', 'lat')}
+        features.append({'type': 'Feature', 'geometry': geometry, 'properties': properties})
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser('event_clusters')
+    p.add_argument('--radius-km',
+                   help='Maximal distance of neighboring geometries.',
+                   default=100.,
+                   type=float)
+    p.add_argument('--max-gap-days',
+                   help='Maximal time between neighboring geometries.',
+                   default=3.,
+                   type=float)
+    p.add_argument('--min-size',
+                   help='Smallest number of geometries of a reported cluster.',
+                   default=2,
+                   type=int)
+    p.add_argument('--cache-dir',
+                   help="Directory containing 'events.npz' (s. event_store.py).",
+                   default='./eonet-data',
+                   type=str)
+    p.add_argument('--out',
+                   help='Save the tracks as GeoJSON.',
+                   type=str)
+    args = p.parse_args()
+    if not (args.radius_km > 0 and args.max_gap_days > 0):
+        p.error('--radius-km and --max-gap-days have to be positive')
+
+    store = EventStore.load(os.path.join(args.cache_dir, 'events.npz'))
+    labels = cluster_geometries(store, radius_km=args.radius_km, max_gap_days=args.max_gap_days)
+    tracks = cluster_tracks(store, labels, min_size=args.min_size)
+    print(f'{labels.max() + 1 if len(labels) else 0} clusters, {len(tracks)} with at least {args.min_size} geometries.')
+    for track in sorted(tracks, key=lambda track: track['size'], reverse=True)[:10]:
+        print(f"\t{track['size']:5} {track['category']}: {track['start']} - {track['end']} ({len(track['events'])} events)")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(tracks_to_geojson(tracks), f)
+        print(f'Created:\n\t{args.out}')
@@ -0,0 +1,160 @@
+"""
+Rendering EONET events (s. event_store.py) as interactive map without plotting every raw point.
+
+Two modes:
+  - 'bins': The geometries are aggregated into grid cells whose size depends on the zoom level (10° at zoom 0, halved per level). Every category is one trace of the occupied cells, the marker size grows with the count and the hover text lists the counts of all categories of the cell.
+  - 'points': The geometries are decimated to at most <max_points> (the newest geometry per category and cell of 0.1°, then evenly spaced) and drawn with WebGL (plotly's Scattermap).
+Hover texts are built for all points/cells at once with NumPy's string functions (title, category and date of every point).
+
+Usage:
+    fig = event_figure(store, store.query(start='2023-01-01'), mode='bins', zoom=2)
+    fig.show()
+"""
+
+import numpy as np
+import numpy.typing as npt
+import plotly.graph_objects as go
+from event_store import EventStore
+
+# Colors of the categories (in the order of the API)
+COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#ff6600',
+          '#e377c2', '#7f7f7f', '#bcbd22', '#17becf', '#7f0000', '#003300',
+          '#000033']
+
+
+def cell_size(zoom: int) -> float:
+    """Edge length of the cells in degrees at :zoom: (10° at zoom 0, halved per level)."""
+    return 10. / 2**zoom
+
+
+def hover_texts(store: EventStore,
+                indices: npt.NDArray) -> npt.NDArray:
+    """Hover text '<title> [<category>] <date>' of every geometry at :indices:."""
+    events = store.event[indices]
+    texts = np.char.add(store.title[events], ' [')
+    texts = np.char.add(texts, store.category_title[store.category[events]])
+    texts = np.char.add(texts, '] ')
+    return np.char.add(texts, np.datetime_as_string(store.time[indices], unit='D'))
+
+
+def grid_bins(store: EventStore,
+              indices: npt.NDArray,
+              size: float) -> dict[str, npt.NDArray]:
+    """Count the geometries per grid cell and category.
+
+    :store: The events.
+    :indices: Geometries to count (s. EventStore.query()).
+    :size: Edge length of the cells in degrees, s. cell_size().
+    :returns: Columns 'lon', 'lat' (centers of the occupied cells), 'count' and 'category_counts' (cells x categories)
+
+    """
+    n_cols = int(np.ceil(360 / size))
+    cols = np.clip(((store.lon[indices] + 180) // size).astype(np.int64), 0, n_cols - 1)
+    rows = np.clip(((store.lat[indices] + 90) // size).astype(np.int64), 0, int(np.ceil(180 / size)) - 1)
+    cells, inverse = np.unique(rows * n_cols + cols, return_inverse=True)
+    n_categories = len(store.category_id)
+    category_counts = np.bincount(inverse * n_categories + store.geometry_category[indices],
+                                  minlength=len(cells) * n_categories).reshape(len(cells), n_categories)
+    return {'lon': (cells % n_cols + .5) * size - 180,
+            'lat': np.minimum((cells // n_cols + .5) * size - 90, 90),
+            'count': category_counts.sum(axis=1),
+            'category_counts': category_counts}
+
+
+def bin_hover_texts(store: EventStore,
+                    bins: dict[str, npt.NDArray]) -> npt.NDArray:
+    """Hover text of every cell: total count and the counts of its categories."""
+    texts = np.char.add(bins['count'].astype(str), ' events')
+    for code, title in enumerate(store.category_title):
+        counts = bins['category_counts'][:, code]
+        line = np.char.add(f'<br>{title}: ', counts.astype(str))
+        texts = np.char.add(texts, np.where(counts > 0, line, ''))
+    return texts
+
+
+def decimate(store: EventStore,
+             indices: npt.NDArray,
+             max_points: int,
+             size: float = .1) -> npt.NDArray:
+    """Reduce :indices: to at most :max_points: geometries keeping the spatial coverage.
+
+    First only the newest geometry per category and cell (of :size: degrees) is kept, then evenly spaced ones.
+
+    :returns: Indices (ascending)
+
+    """
+    if len(indices) <= max_points:
+        return indices
+    n_cols = int(np.ceil(360 / size))
+    cols = ((store.lon[indices] + 180) // size).astype(np.int64)
+    rows = ((store.lat[indices] + 90) // size).astype(np.int64)
+    keys = (rows * n_cols + cols) * len(store.category_id) + store.geometry_category[indices]
+    # Indices are chronological, np.unique() keeps the first occurrence, ie. of the reversed indices the newest
+    _, first = np.unique(keys[::-1], return_index=True)
+    indices = np.sort(indices[::-1][first])
+    if len(indices) > max_points:
+        indices = indices[np.linspace(0, len(indices) - 1, max_points).astype(np.int64)]
+    return indices
+
+
+def event_figure(store: EventStore,
+                 indices: npt.NDArray = None,
+                 mode: str = 'points',
+                 zoom: int = 0,
+                 max_points: int = 20000,
+                 colors: list[str] = COLORS) -> go.Figure:
+    """Map of the events, one trace per category (toggled via the legend).
+
+    :store: The events.
+    :indices: Geometries to draw (s. EventStore.query()), all if None.
+    :mode: 'bins' (aggregated per cell) or 'points' (decimated).
+    :zoom: Zoom level of the map, determines the cell size in mode 'bins'.
+    :max_points: Upper bound of the points drawn in mode 'points'.
+    :colors: Colors of the categories (cycled).
+    :returns: The figure
+
+    """
+    if indices is None:
+        indices = np.arange(len(store))
+    fig = go.Figure()
+    if mode == 'bins':
+        bins = grid_bins(store, indices, cell_size(zoom))
+        texts = bin_hover_texts(store, bins)
+        for code, title in enumerate(store.category_title):
+            counts = bins['category_counts'][:, code]
+            occupied = counts > 0
+            if not occupied.any():
+                continue
+            fig.add_trace(go.Scattermap(
+                lon=bins['lon'][occupied],
+                lat=bins['lat'][occupied],
+                mode='markers',
+                marker={'color': colors[code % len(colors)],
+                        'size': 6 + 4 * np.sqrt(counts[occupied]),
+                        'opacity': .6},
+                hovertext=texts[occupied],
+                hoverinfo='text',
+                name=f'{title} ({counts.sum()})',
+            ))
+    elif mode == 'points':
+        indices = decimate(store, indices, max_points)
+        texts = hover_texts(store, indices)
+        categories = store.geometry_category[indices]
+        for code, title in enumerate(store.category_title):
+            selected = categories == code
+            if not selected.any():
+                continue
+            fig.add_trace(go.Scattermap(
+                lon=store.lon[indices[selected]],
+                lat=store.lat[indices[selected]],
+                mode='markers',
+                marker={'color': colors[code % len(colors)],
+                        'size': 8},
+                hovertext=texts[selected],
+                hoverinfo='text',
+                name=title,
+            ))
+    else:
+        raise ValueError(f"Unknown mode '{mode}', use 'bins' or 'points'.")
+    fig.update_layout(map={'style': 'open-street-map', 'zoom': zoom})
+    return fig
@@ -0,0 +1,282 @@
+"""
+Columnar store of EONET events: one NumPy array per attribute instead of one Python object per event.
+
+Tables (all arrays of the same table have the same length):
+  - geometries: event (index into the events), time (datetime64[s], UTC), lon, lat (Polygons: mean of the outer ring) and kind (0 Point, 1 Polygon). Every geometry of an event is kept, f.i. the track of a storm. Sorted by time.
+  - events: event_id, title and category (index into the categories, the first category of the event)
+  - categories: category_id (EONET id) and category_title
+Geometries with coordinates outside [-180, 180] x [-90, 90] are dropped (some coordinates of EONET are switched).
+
+Queries by time range are binary searches on the sorted times, queries by bounding box use a grid index: the geometries are ordered by the cell (<cell_size> degrees) they are in, so every row of cells of a bounding box is one slice. The store is saved as uncompressed NumPy archive ('.npz') and loaded without parsing JSON.
+
+Usage:
+    store = EventStore.from_events(events_data, categories_data)
+    store.save('./eonet-data/events.npz')
+    store = EventStore.load('./eonet-data/events.npz')
+    for record in store.records(store.query(bbox=(5, 45, 15, 55), start='2023-01-01', categories=[8])):
+        print(record.title, record.time, record.lon, record.lat)
+
+    python event_store.py [--days 365] [--cache-dir ./eonet-data]  # Fetch (s. eonet_fetcher.py) and save as '<cache_dir>/events.npz'
+"""
+
+import os
+import asyncio
+import argparse
+import numpy as np
+import numpy.typing as npt
+from eonet_fetcher import EonetFetcher, read_json
+
+GEOMETRY_COLUMNS = ('event', 'time', 'lon', 'lat', 'kind')
+EVENT_COLUMNS = ('event_id', 'title', 'category')
+CATEGORY_COLUMNS = ('category_id', 'category_title')
+# Values of the column 'kind'
+POINT, POLYGON = 0, 1
+
+
+def geometry_coordinates(geometry: dict) -> tuple[float, float]:
+    """Coordinates (lon, lat) of a GeoJSON geometry of EONET, the mean of the outer ring for Polygons."""
+    if geometry['type'] == 'Point':
+        lon, lat = geometry['coordinates'][:2]
+        return lon, lat
+    ring = np.asarray(geometry['coordinates'][0], dtype=np.float64)
+    if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]  # Closing vertex
+    lon, lat = ring[:, :2].mean(axis=0)
+    return float(lon), float(lat)
+
+
+def parse_time(time) -> np.datetime64:
+    """datetime64[s] (UTC) of an ISO date like '2023-08-01T00:00:00Z', '2023-08-01' or a datetime64."""
+    if isinstance(time, str):
+        time = time.rstrip('Z').split('+')[0]
+    return np.datetime64(time, 's')
+
+
+class EventRecord():
+    """View of one geometry of the store (and its event), no data is copied."""
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: 'EventStore', index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def event(self) -> int:
+        return int(self.store.event[self.index])
+
+    @property
+    def id(self) -> str:
+        return str(self.store.event_id[self.event])
+
+    @property
+    def title(self) -> str:
+        return str(self.store.title[self.event])
+
+    @property
+    def category_id(self) -> int:
+        return int(self.store.category_id[self.store.category[self.event]])
+
+    @property
+    def category(self) -> str:
+        return str(self.store.category_title[self.store.category[self.event]])
+
+    @property
+    def time(self) -> np.datetime64:
+        return self.store.time[self.index]
+
+    @property
+    def lon(self) -> float:
+        return float(self.store.lon[self.index])
+
+    @property
+    def lat(self) -> float:
+        return float(self.store.lat[self.index])
+
+    def __repr__(self):
+        return f'EventRecord({self.id!r}, {self.title!r}, {self.category!r}, {self.time}, {self.lon}, {self.lat})'
+
+
+class EventStore():
+    """Columnar EONET events with a temporal and a spatial (grid) index."""
+
+    def __init__(self,
+                 columns: dict[str, npt.NDArray],
+                 cell_size: float = 1.):
+        """
+        :columns: Arrays of the tables (s. GEOMETRY_COLUMNS, EVENT_COLUMNS, CATEGORY_COLUMNS), the geometries sorted by time.
+        :cell_size: Edge length of the cells of the grid index in degrees.
+
+        """
+        for name in (*GEOMETRY_COLUMNS, *EVENT_COLUMNS, *CATEGORY_COLUMNS):
+            setattr(self, name, columns[name])
+        # Category of every geometry, avoids indirections in queries
+        self.geometry_category = self.category[self.event] if len(self.event) else np.zeros(0, dtype=np.int16)
+        self.cell_size = cell_size
+        self.__build_grid()
+
+    def __build_grid(self) -> None:
+        self.grid_shape = (int(np.ceil(180 / self.cell_size)), int(np.ceil(360 / self.cell_size)))
+        cells = self.__cells(self.lon, self.lat)
+        # Geometries ordered by cell & start of every cell in this order
+        self.grid_order = np.argsort(cells, kind='stable').astype(np.int32)
+        n_cells = self.grid_shape[0] * self.grid_shape[1]
+        self.cell_starts = np.searchsorted(cells[self.grid_order], np.arange(n_cells + 1)).astype(np.int32)
+
+    def __cells(self, lon: npt.NDArray, lat: npt.NDArray) -> npt.NDArray:
+        rows, cols = self.__rows(lat), self.__cols(lon)
+        return rows * self.grid_shape[1] + cols
+
+    def __rows(self, lat) -> npt.NDArray:
+        return np.clip(((np.asarray(lat) + 90) // self.cell_size).astype(np.int64), 0, self.grid_shape[0] - 1)
+
+    def __cols(self, lon) -> npt.NDArray:
+        return np.clip(((np.asarray(lon) + 180) // self.cell_size).astype(np.int64), 0, self.grid_shape[1] - 1)
+
+    @classmethod
+    def from_events(cls,
+                    events_data: dict,
+                    categories_data: dict = None,
+                    cell_size: float = 1.) -> 'EventStore':
+        """Build the store from the responses of the API (s. eonet_fetcher.fetch()).
+
+        :events_data: Events data ({'events': [...]}), the events can be an iterator (f.i. EonetFetcher.iter_events()).
+        :categories_data: Categories data ({'categories': [...]}), the categories of the events are used if None.
+        :cell_size: Edge length of the cells of the grid index in degrees.
+        :returns: The store
+
+        """
+        categories = {}  # EONET id -> title, keeps the order of the API
+        if categories_data is not None:
+            categories.update((category['id'], category['title']) for category in categories_data['categories'])
+        event_ids, titles, event_categories = [], [], []
+        events, times, lons, lats, kinds = [], [], [], [], []
+        for event in events_data['events']:
+            category = event['categories'][0]
+            categories.setdefault(category['id'], category['title'])
+            n_geometries = len(lons)
+            for geometry in event['geometries']:
+                lon, lat = geometry_coordinates(geometry)
+                # Check consitency (s. eonet.py)
+                if -180 <= lon <= 180 and -90 <= lat <= 90:
+                    events.append(len(event_ids))
+                    times.append(parse_time(geometry['date']))
+                    lons.append(lon)
+                    lats.append(lat)
+                    kinds.append(POINT if geometry['type'] == 'Point' else POLYGON)
+            if len(lons) > n_geometries:
+                event_ids.append(event['id'])
+                titles.append(event['title'])
+                event_categories.append(category['id'])
+        category_ids = np.fromiter(categories, dtype=np.int16, count=len(categories))
+        code = {category_id: i for i, category_id in enumerate(categories)}
+        columns = {'event': np.array(events, dtype=np.int32),
+                   'time': np.array(times, dtype='datetime64[s]'),
+                   'lon': np.array(lons, dtype=np.float64),
+                   'lat': np.array(lats, dtype=np.float64),
+                   'kind': np.array(kinds, dtype=np.uint8),
+                   'event_id': np.array(event_ids, dtype=str),
+                   'title': np.array(titles, dtype=str),
+                   'category': np.array([code[i] for i in event_categories], dtype=np.int16),
+                   'category_id': category_ids,
+                   'category_title': np.array(list(categories.values()), dtype=str)}
+        order = np.argsort(columns['time'], kind='stable')
+        for name in GEOMETRY_COLUMNS:
+            columns[name] = columns[name][order]
+        return cls(columns, cell_size)
+
+    def save(self, path: str) -> None:
+        """Save the store as uncompressed NumPy archive (f.i. './eonet-data/events.npz')."""
+        columns = {name: getattr(self, name) for name in (*GEOMETRY_COLUMNS, *EVENT_COLUMNS, *CATEGORY_COLUMNS)}
+        np.savez(path, cell_size=self.cell_size, **columns)
+
+    @classmethod
+    def load(cls, path: str) -> 'EventStore':
+        """Load a store saved by save()."""
+        with np.load(path, allow_pickle=False) as archive:
+            columns = {name: archive[name] for name in archive.files}
+        return cls(columns, float(columns.pop('cell_size')))
+
+    def __len__(self) -> int:
+        """Number of geometries."""
+        return len(self.event)
+
+    def __getitem__(self, index: int) -> EventRecord:
+        return EventRecord(self, int(index))
+
+    def records(self, indices: npt.NDArray = None):
+        """Views of the geometries at :indices: (f.i. returned by query()), all if None."""
+        if indices is None:
+            indices = range(len(self))
+        return (EventRecord(self, int(i)) for i in indices)
+
+    def category_codes(self, category_ids) -> npt.NDArray:
+        """Codes (indices into the categories) of EONET category ids, f.i. 8 (Wildfires)."""
+        return np.flatnonzero(np.isin(self.category_id, category_ids))
+
+    def __bbox_candidates(self,
+                          west: float,
+                          south: float,
+                          east: float,
+                          north: float) -> npt.NDArray:
+        """Geometries in the cells overlapping the bounding box (a superset of the result)."""
+        rows = range(int(self.__rows(south)), int(self.__rows(north)) + 1)
+        if west <= east:
+            col_ranges = [(self.__cols(west), self.__cols(east))]
+        else:  # Crossing the antimeridian
+            col_ranges = [(self.__cols(west), self.grid_shape[1] - 1), (0, self.__cols(east))]
+        # Cells of a row are consecutive, ie. one slice per row (and range of columns)
+        slices = [self.grid_order[self.cell_starts[row * self.grid_shape[1] + first]:
+                                  self.cell_starts[row * self.grid_shape[1] + last + 1]]
+                  for row in rows for first, last in col_ranges]
+        return np.sort(np.concatenate(slices)) if slices else np.zeros(0, dtype=np.int32)
+
+    def query(self,
+              bbox: tuple[float, float, float, float] = None,
+              start=None,
+              end=None,
+              categories=None) -> npt.NDArray:
+        """Geometries matching all given conditions.
+
+        :bbox: Bounding box (west, south, east, north) in degrees, west > east crosses the antimeridian.
+        :start: First time (inclusive), f.i. '2023-01-01'.
+        :end: Last time (exclusive), f.i. '2024-01-01'.
+        :categories: EONET category ids, f.i. [8, 12] (Wildfires, Volcanoes).
+        :returns: Indices of the geometries (ascending, ie. chronologically), s. records()
+
+        """
+        first = 0 if start is None else int(np.searchsorted(self.time, parse_time(start), side='left'))
+        last = len(self) if end is None else int(np.searchsorted(self.time, parse_time(end), side='left'))
+        if bbox is not None:
+            west, south, east, north = bbox
+            indices = self.__bbox_candidates(west, south, east, north)
+            indices = indices[(indices >= first) & (indices < last)]
+            lon, lat = self.lon[indices], self.lat[indices]
+            inside_lon = (lon >= west) & (lon <= east) if west <= east else (lon >= west) | (lon <= east)
+            indices = indices[inside_lon & (lat >= south) & (lat <= north)]
+        else:
+            indices = np.arange(first, last)
+        if categories is not None:
+            indices = indices[np.isin(self.geometry_category[indices], self.category_codes(categories))]
+        return indices
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser('event_store')
+    p.add_argument('--days',
+                   help='Period of the events in days before today.',
+                   default=365,
+                   type=int)
+    p.add_argument('--cache-dir',
+                   help='Directory of the cached events and categories.',
+                   default='./eonet-data',
+                   type=str)
+    args = p.parse_args()
+
+    with EonetFetcher(args.cache_dir) as fetcher:
+        asyncio.run(fetcher.sync(args.days))
+        # Stream the events from the cache instead of loading all at once
+        store = EventStore.from_events({'events': fetcher.iter_events(args.days)}, read_json(fetcher.categories_path))
+    path = os.path.join(args.cache_dir, 'events.npz')
+    store.save(path)
+    print(f'{len(store.event_id)} events, {len(store)} geometries:\n\t{path}')
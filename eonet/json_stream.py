@@ -0,0 +1,103 @@
+"""
+Incremental parsing of a JSON object with one large array, f.i. the 'events' of an EONET response.
+
+The document arrives in chunks (f.i. requests' iter_content() or a file read block by block) and the items of the array are yielded one by one as soon as they are complete (json.JSONDecoder.raw_decode()), ie. memory depends on the size of an item, not on the size of the document. The other members of the object (f.i. 'title') are collected into a dictionary.
+
+Usage:
+    header = {}
+    for event in iter_array(r.iter_content(2**16), 'events', header):
+        ...
+"""
+
+import json
+import codecs
+from typing import Iterable, Iterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+# Characters following a complete value
+_DELIMITERS = tuple(_WHITESPACE + ',:]}')
+
+
+class _Buffer():
+    """Text of the chunks not consumed yet."""
+
+    def __init__(self, chunks: Iterable):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def read_more(self) -> bool:
+        """Append the next chunk, drops the consumed text. False if there is none."""
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                chunk = self.utf8.decode(chunk)
+            if chunk:
+                self.text = self.text[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.exhausted = True
+        return False
+
+    def skip(self, characters: str = '') -> str:
+        """Skip whitespace and :characters:, returns the next character ('' at the end)."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE + characters:
+                self.pos += 1
+            if self.pos < len(self.text) or not self.read_more():
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, character: str) -> None:
+        if self.skip() != character:
+            raise json.JSONDecodeError(f'Expecting {character!r}', self.text, self.pos)
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value, reading chunks until it is complete."""
+        self.skip()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number followed by nothing (or f.i. '0.') might continue in the next chunk
+                if self.text[end:end + 1] in _DELIMITERS or self.exhausted or not self.read_more():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+
+
+def iter_array(chunks: Iterable,
+               key: str,
+               header: dict = None) -> Iterator:
+    """Yield the items of the array :key: of a JSON object, parsed incrementally.
+
+    :chunks: Chunks (bytes in UTF-8 or str) of the JSON document.
+    :key: Member of the top level object holding the array, f.i. 'events'.
+    :header: Dictionary the other members of the object are stored in (complete after the iteration).
+    :returns: Iterator over the items
+
+    """
+    if header is None:
+        header = {}
+    buffer = _Buffer(chunks)
+    buffer.expect('{')
+    found = False
+    while buffer.skip(',') not in ('}', ''):
+        name = buffer.value()
+        buffer.expect(':')
+        if name == key:
+            found = True
+            buffer.expect('[')
+            while buffer.skip(',') != ']':
+                if buffer.pos >= len(buffer.text):
+                    raise json.JSONDecodeError(f"Unterminated array '{key}'", buffer.text, buffer.pos)
+                yield buffer.value()
+            buffer.pos += 1
+        else:
+            header[name] = buffer.value()
+    buffer.expect('}')
+    if not found:
+        raise KeyError(f"No array '{key}' in the JSON object.")
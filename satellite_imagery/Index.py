@@ -1,4 +1,8 @@
 import os
+import copy
+import itertools
+import threading
+import multiprocessing.util
 import rasterio
 import numpy as np
 import numpy.typing as npt
@@ -6,23 +10,100 @@ import matplotlib.image
 import matplotlib.pyplot as plt
 from matplotlib.cm import ScalarMappable
 from matplotlib.colors import LinearSegmentedColormap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from rasterio.plot import show
+from rasterio.windows import Window
 from embed_geometry import embed_geometry
+from read_write_functions import find_band_files, create_out_dir, split_windows, open_geotiff
+from normalized_difference import normalized_difference
+from band_cache import band_cache
+from masks import rasterize_mask
+from colorize import colormap_lut, quantize, colorize
+from spectral_indices import LANDSAT8_BANDS, LANDSAT8_REFLECTANCE, compile_indices, product_name
+from instrumentation import stage, traced
+
+# Dataset handles of the worker threads/processes of Index.stream()
+_worker_datasets = threading.local()
+# K=Stream & V=All handles opened for the stream in this process, s. _close_worker_datasets()
+_stream_datasets: dict[int, list] = {}
+_stream_datasets_lock = threading.Lock()
+# Identifies a call of Index.stream(), ie. concurrent streams don't share handles
+_stream_ids = itertools.count()
+
+
+def _worker_dataset(path: str, stream_id: int):
+    """Opens :path: once per worker thread and stream and returns the cached handle afterwards.
+
+    The handles are closed by _close_worker_datasets() when the stream finishes (threads) or the worker process exits.
+
+    """
+    if not hasattr(_worker_datasets, 'handles'):
+        _worker_datasets.handles = {}
+    key = (stream_id, path)
+    if key not in _worker_datasets.handles:
+        _worker_datasets.handles[key] = rasterio.open(path)
+        with _stream_datasets_lock:
+            _stream_datasets.setdefault(stream_id, []).append(_worker_datasets.handles[key])
+    return _worker_datasets.handles[key]
+
+
+def _close_worker_datasets(stream_id: int = None) -> None:
+    """Close the handles of the workers of the stream :stream_id: (of all streams if None) opened in this process."""
+    with _stream_datasets_lock:
+        stream_ids = list(_stream_datasets) if stream_id is None else [stream_id]
+        for stream_id in stream_ids:
+            for src in _stream_datasets.pop(stream_id, []):
+                src.close()
+
+
+def _init_worker_process() -> None:
+    # atexit handlers don't run in the processes of a pool, its finalizers do
+    multiprocessing.util.Finalize(None, _close_worker_datasets, exitpriority=0)
 
 
 class Index:
     def __init__(self,
                  band_order: tuple[str, ...],
-                 img_dir: str):
+                 img_dir: str,
+                 streaming: bool = False,
+                 dtype: npt.DTypeLike = np.float32):
         self.band_order = band_order
         self.img_dir = img_dir
         self.index_name = type(self).__name__
-        bands, self.geotiff_meta = self.__read_bands()
-        # Dict with K=Band & V=NPArray
-        self.bands = {band: bands[i] for i, band in enumerate(self.band_order)}
+        # Paths to the TIFF-files of the bands in the order of :band_order:
+        self.band_files = find_band_files(self.img_dir, self.band_order)
+        # In streaming mode bands are read block by block in stream(), ie.
+        # the whole scene is never held in memory.
+        self.streaming = streaming
+        # Precision of the bands and the index, float32 halves the memory
+        # (traffic) compared to float64 (s. normalized_difference.py for
+        # the error bound)
+        self.dtype = np.dtype(dtype)
+        if self.streaming:
+            self.bands = None  # Windows are read in stream()
+            self.geotiff_meta = self.__read_meta()
+        else:
+            bands, self.geotiff_meta = self.__read_bands()
+            # Dict with K=Band & V=NPArray
+            self.bands = {band: bands[i] for i, band in enumerate(self.band_order)}
         # Array holding the values of the index
         self.index: npt.NDArray = None  # Set in calculate()
 
+    def __read_meta(self) -> dict:
+        """Reads the meta data of the bands and adjusts it for the single channel index image.
+
+        :returns: Meta data of the first band with updated count, dtype and nodata value
+
+        """
+        with rasterio.open(self.band_files[0]) as band:
+            out_meta = band.meta.copy()
+        out_meta.update(count=len(self.band_order),
+                        dtype=rasterio.uint8,
+                        nodata=0)
+        return out_meta
+
+    @traced('index.read_bands')
     def __read_bands(self):
         """Reads the bands specified in :band_order: into an array (keeping the order).
 
@@ -30,116 +111,250 @@ class Index:
         :returns: Tuple containing an array containing all bands as they were defined in :band_order: and the corresponding meta data
 
         """
-        out_meta = None
-        nmb_bands = len(self.band_order)
-        bands = None  # image dimensions have to be red from metadata
-        files = (os.path.join(self.img_dir, file)
-                 for file in os.listdir(self.img_dir))
-        for file in files:
-            # Skip <out>-directory, ie. only iterate over TIFF-files
-            if file.endswith(('.tif', '.TIF')):
-                band = rasterio.open(file)
-                # Initialize band array (especially with image dimensions)
-                if bands is None:
-                    out_meta = band.meta.copy()
-                    bands = np.empty((nmb_bands,
-                                      out_meta['height'],
-                                      out_meta['width']))
-                # Fill band array with band values
-                for i, b in enumerate(self.band_order):
-                    if b in file:
-                        bands[i] = band.read(1)
-                        break
-                band.close()
-        # Update meta data
-        out_meta.update(count=nmb_bands,
-                        dtype=rasterio.uint8,
-                        nodata=0)
+        out_meta = self.__read_meta()
+        bands = np.empty((len(self.band_order),
+                          out_meta['height'],
+                          out_meta['width']),
+                         dtype=self.dtype)
+        # Fill band array with band values (decoded bands are shared via the cache)
+        for i, file in enumerate(self.band_files):
+            bands[i] = band_cache.read(file)
         return bands, out_meta
 
+    def _iter_windows(self, tile_size: int = None):
+        """Iterates over the windows of the bands (s. split_windows()).
+
+        Values are converted to <dtype> like in __read_bands(), hence calculate() yields the same values as on the whole arrays.
+
+        :tile_size: Passed to split_windows().
+        :returns: Generator of tuples containing the window and a dict with K=Band & V=NPArray of the band values inside the window
+
+        """
+        sources = [rasterio.open(file) for file in self.band_files]
+        try:
+            for window in split_windows(self.band_files[0], tile_size):
+                bands = {band: src.read(1, window=window).astype(self.dtype)
+                         for band, file, src in zip(self.band_order, self.band_files, sources)}
+                yield window, bands
+        finally:
+            for src in sources:
+                src.close()
+
+    def _calculate_bands(self,
+                         bands: dict[str, npt.NDArray],
+                         min: float,
+                         max: float,
+                         scene_statistics: dict) -> npt.NDArray:
+        """Calculates the index of the :bands: of one window.
+
+        Works on a shallow copy, so the bands and the index of the instance stay untouched (and threads don't share them).
+
+        :returns: The scaled index as uint8 array
+
+        """
+        tile = copy.copy(self)
+        tile.bands = bands
+        tile.calculate(min, max, **scene_statistics)
+        return (tile.index * 255).astype('uint8')
+
+    def _calculate_window(self,
+                          window: Window,
+                          min: float,
+                          max: float,
+                          scene_statistics: dict) -> tuple[Window, npt.NDArray]:
+        """Calculates the index of one window, executed by the workers of stream().
+
+        Dataset handles must not be shared between threads or processes, hence every worker opens the band files once itself (s. _worker_dataset()).
+
+        :returns: Tuple of the window and the scaled index as uint8 array
+
+        """
+        bands = {band: _worker_dataset(file, self._stream_id).read(1, window=window).astype(self.dtype)
+                 for band, file in zip(self.band_order, self.band_files)}
+        return window, self._calculate_bands(bands, min, max, scene_statistics)
+
+    def _scene_statistics(self) -> dict:
+        """Statistics of the whole scene calculate() depends on, f.i. the maximum of the index.
+
+        Subclasses whose calculate() uses such statistics override this method. They are passed as keyword arguments to calculate() in stream() to keep the results identical to the whole-array calculation.
+
+        :returns: Dict of keyword arguments for calculate()
+
+        """
+        return {}
+
+    def stream(self,
+               min: float = 0.,
+               max: float = 1.,
+               out_path: str = None,
+               workers: int = 1,
+               tile_size: int = None,
+               executor: str = 'thread',
+               cog: bool = False,
+               compress: str = 'deflate') -> str:
+        """Calculate the index window by window and write it directly into a single channel GeoTIFF.
+
+        Peak memory depends on the block size of the bands (or :tile_size:) and not on the size of the scene. The written GeoTIFF is identical to the 'sc_'-GeoTIFF of generate_plots(), no matter how many workers are used. The bands and the index of the instance aren't changed.
+
+        :min: Lower bound of the index, passed to calculate().
+        :max: Upper bound of the index, passed to calculate().
+        :out_path: Path of the GeoTIFF, defaults to '<img_dir>/out/sc_<index_name>.geotiff'.
+        :workers: Number of workers calculating windows in parallel (at least 1). 1 calculates in the calling thread.
+        :tile_size: Edge length of the tiles in pixels, defaults to the internal blocks of the bands.
+        :executor: 'thread' (numpy and rasterio release the GIL) or 'process'.
+        :cog: Write a Cloud-Optimized GeoTIFF (tiled, compressed, with overviews), s. open_geotiff().
+        :compress: Compression of the COG: 'deflate', 'zstd' or 'lzw'.
+        :returns: Path of the written GeoTIFF
+
+        """
+        if workers < 1:
+            raise ValueError(f'At least one worker is needed, got {workers}.')
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor '{executor}', use 'thread' or 'process'.")
+        if out_path is None:
+            out_dir = self.__create_out_dir()
+            out_path = os.path.join(out_dir, f"sc_{self.index_name}.geotiff")
+        with stage('index.scene_statistics', index=self.index_name):
+            scene_statistics = self._scene_statistics()
+        meta = self.geotiff_meta.copy()
+        meta.update(count=1)
+        with stage('index.stream', index=self.index_name, workers=workers), \
+                open_geotiff(out_path, meta, cog, compress) as img:
+            if workers == 1:
+                for window, bands in self._iter_windows(tile_size):
+                    sc_index = self._calculate_bands(bands, min, max, scene_statistics)
+                    with stage('index.write_window'):
+                        img.write(sc_index, 1, window=window)
+            else:
+                self.__stream_parallel(img, min, max, scene_statistics,
+                                       workers, tile_size, executor)
+        return out_path
+
+    def __stream_parallel(self,
+                          img,
+                          min: float,
+                          max: float,
+                          scene_statistics: dict,
+                          workers: int,
+                          tile_size: int,
+                          executor: str) -> None:
+        """Distributes the windows onto a pool of workers and writes the results into :img: in order.
+
+        At most 2 * :workers: windows are in flight, so memory stays bounded. The dataset handles of the workers are closed when all windows are written (threads) or the workers exit (processes).
+
+        """
+        # Send a copy without (whole scene) bands to the workers, otherwise
+        # they'd be pickled for every window in process mode.
+        worker = copy.copy(self)
+        worker.bands, worker.index = None, None
+        worker._stream_id = next(_stream_ids)
+        if executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=workers)
+        else:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker_process)
+        try:
+            with pool:
+                pending = deque()
+                for window in split_windows(self.band_files[0], tile_size):
+                    pending.append(pool.submit(worker._calculate_window,
+                                               window, min, max, scene_statistics))
+                    if len(pending) >= 2 * workers:
+                        window, sc_index = pending.popleft().result()
+                        img.write(sc_index, 1, window=window)
+                while pending:
+                    window, sc_index = pending.popleft().result()
+                    img.write(sc_index, 1, window=window)
+        finally:
+            # Handles opened by the threads (nothing to do for processes)
+            _close_worker_datasets(worker._stream_id)
+
     def __create_out_dir(self) -> str:
         """Create the output directory':bands_dir:/out' for the produced image.
 
         :bands_dir: The directory to create an 'out' dir in. Usually, the image for processing are suited in :bands_dir:.
 
         :returns: Path of the created directory"""
-        out_dir = f'{self.img_dir}/out'
-        try:
-            os.mkdir(out_dir)
-            print(f'Created:\n\t{out_dir}')
-        except FileExistsError:  # Error occurs when <out_dir> exists; this is nothing to worry about
-            pass
-        return out_dir
+        return create_out_dir(self.img_dir)
 
     def generate_plots(self,
                        colors: list[str, ...],
                        shape_mask_dir: str,
                        shape_mask_name: str,
                        boundary: bool = False,
-                       embedded_geom: str = None) -> None:
+                       embedded_geom: str = None,
+                       cog: bool = False,
+                       compress: str = 'deflate') -> None:
         """Superlevel function to create all plots.
 
         :colors: List of colors defining a Colormap.
         :boundary: Embed the boundary of the area of interest into the plot.
-        :shape_mask_dir: Directory containing the shape (.shp) and and mask ('.npy') of the area of interest.
-        :shape_mask_name: Name of the shapefile and mask without their extension (because they differ, .shp & .npy respectively).
+        :shape_mask_dir: Directory containing the shape (.shp) of the area of interest.
+        :shape_mask_name: Name of the shapefile without its extension. The mask is rasterized from it onto the grid of the index (s. masks.rasterize_mask()).
         :embedded_geom: TODO
+        :cog: Write the 'sc_'-GeoTIFF as Cloud-Optimized GeoTIFF (tiled, compressed, with overviews), s. open_geotiff().
+        :compress: Compression of the COG: 'deflate', 'zstd' or 'lzw'.
         :returns: None
 
         """
-        # Apply colormap; Result is a RGBA array
+        # Apply colormap via lookup table; Result is a uint8 RGBA array
+        # with the alpha channel replaced by the mask
         color_map = LinearSegmentedColormap.from_list("", colors)
-        cmap_index = color_map(self.index)
-
-        # Replace alpha channel by mask
-        mask_name = f"{shape_mask_name}.npy"
-        mask = np.load(os.path.join(shape_mask_dir, mask_name))
-        cmap_index[:, :, 3] = mask
+        shape_file = os.path.join(shape_mask_dir, f"{shape_mask_name}.shp")
+        with stage('index.mask', index=self.index_name):
+            mask = rasterize_mask(shape_file,
+                                  self.geotiff_meta['transform'],
+                                  self.index.shape,
+                                  self.geotiff_meta['crs'])
+        with stage('index.colorize', index=self.index_name):
+            cmap_index = colorize(quantize(self.index), colormap_lut(color_map), mask)
 
         """Save images."""
         # Create output directory for produced images
         out_dir = self.__create_out_dir()
 
         """Save different configurations and formats"""
-        fig, ax = plt.subplots()
-        x, y = cmap_index.shape[0], cmap_index.shape[1]
-        # Set the desired figure size in inches
-        x, y = y / 100 * 2, x / 100 * 2
-        fig.set_size_inches(x, y)
-        fig.tight_layout()
-        ax.axis('off')
-        # Place raster on axes
-        # rasterio needs (height, width, bands) order
-        show(cmap_index.transpose(2, 0, 1),
-             transform=self.geotiff_meta['transform'],
-             ax=ax)
-        # Embed boundary (if wished)
-        if boundary:
-            geom_file = os.path.join(shape_mask_dir, f"{embedded_geom}.shp")
-            embed_geometry(geom_file, ax)
-        # Save without transparencs
-        path_to_image = os.path.join(out_dir, f"{self.index_name}")
-        # TODO: Kann nicht invertiert werden und sieht mit Ferblegende blöd aus :(. Aber ohne tight_layout() habe ich kein SCHÖNES Bild mit transparentem Hintergrund, da ich die Matrix später per matplot.image speichere und die Matrix die Geometrie nicht enthält. <01-09-2023>
-        #   Idee: Rand hinzufügen
-        fig.savefig(path_to_image, facecolor='none')
-
-        # Save with colorbar legend
-        # Add colorbar
-        cbar = plt.colorbar(ScalarMappable(cmap=color_map), ax=ax)
-        cbar.ax.tick_params(labelsize=30)
-        # Save legend
-        path_to_image = os.path.join(out_dir, f"legend_{self.index_name}.png")
-        fig.savefig(path_to_image)
+        with stage('index.render', index=self.index_name):
+            fig, ax = plt.subplots()
+            x, y = cmap_index.shape[0], cmap_index.shape[1]
+            # Set the desired figure size in inches
+            x, y = y / 100 * 2, x / 100 * 2
+            fig.set_size_inches(x, y)
+            fig.tight_layout()
+            ax.axis('off')
+            # Place raster on axes
+            # rasterio needs (height, width, bands) order
+            show(cmap_index.transpose(2, 0, 1),
+                 transform=self.geotiff_meta['transform'],
+                 ax=ax)
+            # Embed boundary (if wished)
+            if boundary:
+                geom_file = os.path.join(shape_mask_dir, f"{embedded_geom}.shp")
+                embed_geometry(geom_file, ax)
+            # Save without transparencs
+            path_to_image = os.path.join(out_dir, f"{self.index_name}")
+            # TODO: Kann nicht invertiert werden und sieht mit Ferblegende blöd aus :(. Aber ohne tight_layout() habe ich kein SCHÖNES Bild mit transparentem Hintergrund, da ich die Matrix später per matplot.image speichere und die Matrix die Geometrie nicht enthält. <01-09-2023>
+            #   Idee: Rand hinzufügen
+            fig.savefig(path_to_image, facecolor='none')
+
+            # Save with colorbar legend
+            # Add colorbar
+            cbar = plt.colorbar(ScalarMappable(cmap=color_map), ax=ax)
+            cbar.ax.tick_params(labelsize=30)
+            # Save legend
+            path_to_image = os.path.join(out_dir, f"legend_{self.index_name}.png")
+            fig.savefig(path_to_image)
 
         # Saving with transparency outside area of interest
         path_to_image = os.path.join(out_dir, f"cmap_{self.index_name}.png")
-        matplotlib.image.imsave(path_to_image, cmap_index)
+        with stage('index.write_png', index=self.index_name):
+            matplotlib.image.imsave(path_to_image, cmap_index)
 
         # One channel index image as geotiff
         path_to_image = os.path.join(out_dir, f"sc_{self.index_name}.geotiff")
         meta = self.geotiff_meta.copy()
         meta.update(count=1)
-        with rasterio.open(path_to_image, 'w', **meta) as img:
+        with stage('index.write_geotiff', index=self.index_name), \
+                open_geotiff(path_to_image, meta, cog, compress) as img:
             sc_index = (self.index * 255).astype('uint8')
             img.write(sc_index, 1)
         # save_sc_geotiff(self.index, self.geotiff_meta, path_to_image)
@@ -151,15 +366,17 @@ class NDVI(Index):
 
     def __init__(self,
                  band_order: tuple[str, ...],
-                 img_dir: str):
-        Index.__init__(self, band_order, img_dir)
+                 img_dir: str,
+                 streaming: bool = False,
+                 dtype: npt.DTypeLike = np.float32):
+        Index.__init__(self, band_order, img_dir, streaming, dtype)
 
+    @traced('index.calculate')
     def calculate(self, min: float = 0., max: float = 1.):
         b4red = self.bands[self.band_order[0]]
         b5nearID = self.bands[self.band_order[1]]
-        ndvi = np.divide(b5nearID - b4red,
-                         b5nearID + b4red + np.finfo(float).eps)
-        self.index = np.clip(ndvi, min, max)
+        ndvi = normalized_difference(b5nearID, b4red)
+        self.index = np.clip(ndvi, min, max, out=ndvi)
 
 
 class NDWI(Index):
@@ -168,12 +385,61 @@ class NDWI(Index):
 
     def __init__(self,
                  band_order: tuple[str, ...],
-                 img_dir: str):
-        Index.__init__(self, band_order, img_dir)
+                 img_dir: str,
+                 streaming: bool = False,
+                 dtype: npt.DTypeLike = np.float32):
+        Index.__init__(self, band_order, img_dir, streaming, dtype)
 
-    def calculate(self, min: float = 0., max: float = 1.):
+    def __ndwi(self):
         b3green = self.bands[self.band_order[0]]
         b5nearIR = self.bands[self.band_order[1]]
-        ndwi = np.divide(b3green - b5nearIR,
-                         b3green + b5nearIR + np.finfo(float).eps)
-        self.index = np.clip(ndwi, min, ndwi.max()) / ndwi.max() * 10
+        return normalized_difference(b3green, b5nearIR)
+
+    def _scene_statistics(self) -> dict:
+        # The NDWI is scaled by its maximum over the whole scene
+        ndwi_max = -np.inf
+        # Shallow copy, the bands of the instance stay untouched
+        tile = copy.copy(self)
+        for _, tile.bands in tile._iter_windows():
+            ndwi_max = np.maximum(ndwi_max, tile.__ndwi().max())
+        return {'ndwi_max': ndwi_max}
+
+    @traced('index.calculate')
+    def calculate(self, min: float = 0., max: float = 1., ndwi_max: float = None):
+        ndwi = self.__ndwi()
+        if ndwi_max is None:
+            ndwi_max = ndwi.max()
+        np.clip(ndwi, min, ndwi_max, out=ndwi)
+        ndwi /= ndwi_max
+        ndwi *= 10
+        self.index = ndwi
+
+
+class SpectralIndex(Index):
+
+    """Index declared as band algebra expression in the registry of spectral_indices.py, f.i. SpectralIndex('EVI', img_dir).
+
+    The DN values are converted into surface reflectance (Landsat 8/9 Collection 2 Level-2 by default), pass reflectance=None to calculate on the DN values (refused for EVI, SAVI and other indices with additive constants).
+    The files are named after product_name(), f.i. 'sc_NDVI_SR.geotiff'.
+
+    """
+
+    def __init__(self,
+                 index_name: str,
+                 img_dir: str,
+                 streaming: bool = False,
+                 dtype: npt.DTypeLike = np.float32,
+                 sensor_bands: dict[str, str] = LANDSAT8_BANDS,
+                 reflectance: tuple[float, float] = LANDSAT8_REFLECTANCE):
+        self.program = compile_indices((index_name,), reflectance)
+        band_order = tuple(sensor_bands[band] for band in self.program.bands)
+        Index.__init__(self, band_order, img_dir, streaming, dtype)
+        self.index_name = product_name(index_name, reflectance)
+
+    @traced('index.calculate')
+    def calculate(self, min: float = 0., max: float = 1.):
+        # Symbolic band names are expected by the program
+        bands = {symbolic: self.bands[band]
+                 for symbolic, band in zip(self.program.bands, self.band_order)}
+        index = self.program(bands, self.dtype)[self.program.names[0]]
+        self.index = np.clip(index, min, max, out=index)
@@ -15,12 +15,20 @@ maps the range [7000, 16000] onto [0, 255] (by specifying a <min> and <max> argu
   7000m + t = 0,
   16000m + t = 255
       => m = 255/(16000-7000), t = 7000*m
+
+Since the bands are [u]int16 (or uint8), the mapping is precomputed for all 65536
+(or 256) values as a table of uint8 (the same formula, ie. bit identical) and every
+band is mapped by a single lookup (take()), row block by row block. No float temporaries
+of the size of the image are needed. <min> and <max> can be set per band or derived from
+percentiles of a sampled histogram (percentile_limits()), f.i. the 2nd and 98th percentile.
     '''
 
+import functools
 import numpy as np
+import numpy.typing as npt
 
 
-def adjust_values(data, min, max):
+def _linear_stretch(data, min, max):
     # Leave <nodata>-values untouched
     # Map range min-max onto 0-255.
     #   =>  make <min> the smallest value in the image
@@ -32,3 +40,107 @@ def adjust_values(data, min, max):
     t = min * 255 / (max - min)
     tmp = tmp * m - t  # The actual mapping
     return tmp.astype('uint8')  # Convert values to uint8 according to metadata
+
+
+@functools.lru_cache(maxsize=64)
+def stretch_lut(min, max, dtype: str = 'uint16') -> npt.NDArray:
+    """Table of the mapped value (uint8) of every value of an integer data type of at most 16 bit.
+
+    :min: Value mapped onto 0.
+    :max: Value mapped onto 255.
+    :dtype: Data type of the bands, f.i. 'uint16'.
+    :returns: uint8 array of 65536 (or 256) entries, indexed by the value (int16/int8: by the value viewed as unsigned)
+
+    """
+    dtype = np.dtype(dtype)
+    info = np.iinfo(dtype)
+    values = np.arange(info.min, info.max + 1).astype(dtype)
+    # Order the table by the unsigned view of the values, ie. it can be indexed by the raw bits
+    values = values[np.argsort(values.view(f'u{dtype.itemsize}'))]
+    lut = _linear_stretch(values, min, max)
+    lut.flags.writeable = False
+    return lut
+
+
+def adjust_values(data: npt.NDArray,
+                  min,
+                  max,
+                  out: npt.NDArray = None,
+                  rows: int = 256) -> npt.NDArray:
+    """Map the values in [min, max] linearly onto [0, 255] (values outside are clipped).
+
+    :data: Band (height, width) or bands (bands, height, width).
+    :min: Value mapped onto 0, one per band or the same for all bands.
+    :max: Value mapped onto 255, one per band or the same for all bands.
+    :out: uint8 array of the shape of :data: to write the result into, f.i. a window of a larger array.
+    :rows: Number of rows mapped at once, bounds the temporaries (take() converts the indices to intp).
+    :returns: uint8 array of the shape of :data:
+
+    """
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+    if data.ndim == 2:
+        return adjust_values(data[np.newaxis], min, max, out[np.newaxis], rows)[0]
+    mins = np.broadcast_to(min, len(data))
+    maxs = np.broadcast_to(max, len(data))
+    lookup = data.dtype.kind in 'ui' and data.dtype.itemsize <= 2
+    for band, band_out, band_min, band_max in zip(data, out, mins, maxs):
+        band_min, band_max = band_min.item(), band_max.item()
+        if lookup:
+            lut = stretch_lut(band_min, band_max, data.dtype.str)
+            band = band.view(f'u{data.dtype.itemsize}')
+        for start in range(0, band.shape[0], rows):
+            block = band[start:start + rows]
+            if lookup:
+                lut.take(block, out=band_out[start:start + rows])
+            else:
+                band_out[start:start + rows] = _linear_stretch(block, band_min, band_max)
+    return out
+
+
+def sampled_histogram(data: npt.NDArray,
+                      step: int = 4,
+                      nodata: int = 0) -> npt.NDArray:
+    """Histogram of every <step>-th row and column of a [u]int16 (or uint8) band.
+
+    :data: Band (height, width) or bands (bands, height, width).
+    :step: Sampling step, ie. 1/step**2 of the pixels are counted.
+    :nodata: Value not counted (Landsat's fill value is 0), None counts all values.
+    :returns: int64 array of shape ([bands,] 65536) (or 256), indexed like stretch_lut()
+
+    """
+    sample = data[..., ::step, ::step]
+    n_values = 2**(8 * data.dtype.itemsize)
+    unsigned = sample.view(f'u{data.dtype.itemsize}')
+    histograms = np.stack([np.bincount(band.ravel(), minlength=n_values)
+                           for band in unsigned.reshape(-1, *unsigned.shape[-2:])])
+    if nodata is not None:
+        histograms[:, np.array(nodata, dtype=data.dtype).view(f'u{data.dtype.itemsize}')] = 0
+    return histograms.reshape(*data.shape[:-2], n_values)
+
+
+def percentile_limits(data: npt.NDArray,
+                      lower: float = 2.,
+                      upper: float = 98.,
+                      step: int = 4,
+                      nodata: int = 0) -> tuple[npt.NDArray, npt.NDArray]:
+    """Stretch limits of every band: the :lower: and :upper: percentile of a sampled histogram.
+
+    :data: Band (height, width) or bands (bands, height, width) of an unsigned integer type, f.i. uint16.
+    :lower: Percentile mapped onto 0.
+    :upper: Percentile mapped onto 255.
+    :step: Sampling step, s. sampled_histogram().
+    :nodata: Value ignored, s. sampled_histogram().
+    :returns: Arrays of the mins and maxs (one per band), pass them to adjust_values()
+
+    """
+    if data.dtype.kind != 'u':
+        raise ValueError(f"Percentile limits need an unsigned integer type, not {data.dtype}.")
+    histograms = np.atleast_2d(sampled_histogram(data, step, nodata))
+    cumulative = histograms.cumsum(axis=1)
+    total = cumulative[:, -1:]
+    mins = (cumulative < total * lower / 100).sum(axis=1)
+    maxs = (cumulative < total * upper / 100).sum(axis=1)
+    # Avoid a division by zero for constant bands
+    maxs = np.maximum(maxs, mins + 1)
+    return mins, maxs
@@ -0,0 +1,171 @@
+"""
+Cache of decoded bands shared by all modules reading raster data.
+
+Decoding (large, compressed) GeoTIFFs is expensive and the same scenes are read again and again (the whole bands of Index and index_over_time.py). Decoded bands are kept in two tiers:
+  1. In memory, evicted least recently used when the byte budget is exceeded.
+  2. Optionally on disk as uncompressed .npy files which are memory-mapped when read again.
+Entries are keyed by the path and modification time of the file, the band and the window, ie. a changed file is decoded again.
+Only whole bands are cached by default. Windows of streamed calculations are read once, caching them would fill the budget with the whole scene (use `cache=True` for windows read repeatedly). Hence the windowed readers (Index.stream(), make_rgb.py, isolate_shape.py, time_series.py, ...) read directly from the files.
+
+Usage:
+    from band_cache import band_cache
+    band_cache.max_bytes = 2 * 2**30  # Budget of the memory tier
+    band_cache.disk_dir = '/tmp/band_cache'  # Enable disk tier
+    data = band_cache.read(path)
+    print(band_cache.stats())
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import rasterio
+import numpy as np
+import numpy.typing as npt
+from rasterio.windows import Window
+
+
+class BandCache:
+
+    """LRU cache of decoded bands with an optional memory-mapped disk tier."""
+
+    def __init__(self,
+                 max_bytes: int = 512 * 2**20,
+                 disk_dir: str = None):
+        """
+        :max_bytes: Byte budget of the memory tier. Bands larger than the budget aren't kept in memory.
+        :disk_dir: Directory of the disk tier, None disables it.
+
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        # K=Key & V=NPArray, least recently used first
+        self.__entries: OrderedDict[tuple, npt.NDArray] = OrderedDict()
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(path: str,
+            band: int = 1,
+            window: Window = None) -> tuple:
+        """Key of a band (window) of a file.
+
+        :returns: Tuple of absolute path, modification time, band and window offsets and size
+
+        """
+        if window is not None:
+            window = (int(window.col_off), int(window.row_off),
+                      int(window.width), int(window.height))
+        return (os.path.abspath(path), os.stat(path).st_mtime_ns, band, window)
+
+    def read(self,
+             path: str,
+             band: int = 1,
+             window: Window = None,
+             src=None,
+             cache: bool = None) -> npt.NDArray:
+        """Read a band (window) of a file, decoded only if it is in neither tier.
+
+        The returned array is shared with the cache and therefore read only, copy it (f.i. with astype()) to modify it.
+
+        :path: Path to the raster file.
+        :band: Number of the band in the file (starting at 1).
+        :window: Window to read, None reads the whole band.
+        :src: Already opened dataset of :path:, avoids opening the file on a miss.
+        :cache: Look up and keep the data in the cache, defaults to True for whole bands and False for windows.
+        :returns: Array of the band (window) in the data type of the file
+
+        """
+        if cache is None:
+            cache = window is None
+        if not cache:
+            if src is None:
+                with rasterio.open(path) as src:
+                    return src.read(band, window=window)
+            return src.read(band, window=window)
+        key = self.key(path, band, window)
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__entries[key]
+        data = self.__read_disk(key)
+        if data is not None:
+            with self.__lock:
+                self.disk_hits += 1
+        else:
+            if src is None:
+                with rasterio.open(path) as src:
+                    data = src.read(band, window=window)
+            else:
+                data = src.read(band, window=window)
+            with self.__lock:
+                self.misses += 1
+            self.__write_disk(key, data)
+        data.flags.writeable = False
+        self.__insert(key, data)
+        return data
+
+    def __disk_path(self, key: tuple) -> str:
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.disk_dir, f'{name}.npy')
+
+    def __read_disk(self, key: tuple) -> npt.NDArray:
+        if self.disk_dir is None or not os.path.exists(self.__disk_path(key)):
+            return None
+        return np.load(self.__disk_path(key), mmap_mode='r')
+
+    def __write_disk(self, key: tuple, data: npt.NDArray) -> None:
+        if self.disk_dir is None:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        path = self.__disk_path(key)
+        # Write to a temporary file first, so readers never see partial files
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp_path, path)
+
+    def __insert(self, key: tuple, data: npt.NDArray) -> None:
+        if data.nbytes > self.max_bytes:
+            return
+        with self.__lock:
+            if key in self.__entries:
+                return
+            self.__entries[key] = data
+            self.__bytes += data.nbytes
+            while self.__bytes > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries of the memory tier (the disk tier is kept)."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self) -> dict:
+        """Statistics to size the cache.
+
+        :returns: Dict of hits (memory, disk), misses, evictions, hit rate, number of entries and bytes in memory
+
+        """
+        with self.__lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0.,
+                    'entries': len(self.__entries),
+                    'bytes': self.__bytes,
+                    'max_bytes': self.max_bytes}
+
+
+# Cache shared by all modules of the process
+band_cache = BandCache()
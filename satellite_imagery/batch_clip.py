@@ -0,0 +1,180 @@
+"""
+Crops every feature of a geometry file (shapefile/GeoJSON) from many GeoTIFFs in one run, f.i. every band of every scene to every district of Munich.
+
+The geometry file is parsed once. Per GeoTIFF and feature only the window overlapping the feature is read (like isolate_shape.py, ie. rasterio.mask.mask() with crop=True and filled=False). The GeoTIFFs are distributed onto a process pool.
+
+Output (per GeoTIFF and feature):
+    <out_dir>/<feature>/<file_prefix>_<image_name>      The cropped GeoTIFF
+    <out_dir>/<feature>/<file_prefix>_<image_stem>.npy  Its mask (bit-packed, load it with masks.load_mask())
+<out_dir> defaults to '<directory of the GeoTIFF>/geometries' (like isolate_shape.py), <feature> is the value of the field <name_field> or the number of the feature.
+
+Usage:
+    python batch_clip.py <Shapefile/GeoJSON> <GeoTIFF or glob> [<GeoTIFF or glob> ...]
+    python batch_clip.py munich-districts.geojson './USGS/image_working_dir/*/LC08_*_B[2-5].TIF' --name-field name
+"""
+
+import os
+import re
+import glob
+import argparse
+import rasterio
+import geopandas as gpd
+from concurrent.futures import ProcessPoolExecutor
+from rasterio.crs import CRS
+from rasterio.mask import raster_geometry_mask
+from masks import save_mask
+
+
+def expand_globs(patterns: tuple[str, ...]) -> list[str]:
+    """Expand glob patterns (f.i. './USGS/*/LC08_*_B4.TIF') into a sorted list of unique paths.
+
+    :patterns: Paths or glob patterns.
+    :returns: Sorted paths
+
+    """
+    paths = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern)
+        if not matches:
+            raise FileNotFoundError(f"No GeoTIFF matches '{pattern}'.")
+        paths.update(matches)
+    return sorted(paths)
+
+
+def feature_names(gdf: gpd.GeoDataFrame,
+                  name_field: str = None) -> list[str]:
+    """Names of the features, used as directory names.
+
+    :gdf: The features.
+    :name_field: Field holding the name of the features, f.i. 'name'. If None or missing, the features are numbered.
+    :returns: Unique names, characters not suitable for paths are replaced by '_'
+
+    """
+    if name_field is None or name_field not in gdf.columns:
+        width = len(str(len(gdf) - 1))
+        return [f'feature_{i:0{width}}' for i in range(len(gdf))]
+    names = [re.sub(r'[^\w.-]+', '_', str(value)).strip('_') or '_' for value in gdf[name_field]]
+    # Append the number of the feature to duplicates
+    counts = {name: names.count(name) for name in names}
+    return [name if counts[name] == 1 else f'{name}_{i}' for i, name in enumerate(names)]
+
+
+def clip_geotiff(geotiff: str,
+                 names: list[str],
+                 geometries: gpd.GeoSeries,
+                 out_dir: str = None,
+                 file_prefix: str = 'masked') -> list[tuple[str, str, str]]:
+    """Crop every geometry from a GeoTIFF, only the windows overlapping the geometries are read.
+
+    :geotiff: Path to the GeoTIFF.
+    :names: Names of the geometries (s. feature_names()).
+    :geometries: The geometries, transformed into the CRS of :geotiff: if necessary.
+    :out_dir: Directory for the outputs, defaults to '<directory of :geotiff:>/geometries'.
+    :file_prefix: Prefix of the cropped GeoTIFFs and masks.
+    :returns: (name, cropped GeoTIFF, mask) per geometry overlapping :geotiff:
+
+    """
+    src_img_dir, image_name = os.path.split(geotiff)
+    image_stem = os.path.splitext(image_name)[0]
+    if out_dir is None:
+        out_dir = os.path.join(src_img_dir, 'geometries')
+    written = []
+    with rasterio.open(geotiff) as src:
+        if src.crs is not None and geometries.crs is not None and CRS.from_user_input(geometries.crs) != src.crs:
+            geometries = geometries.to_crs(src.crs)
+        meta = src.meta.copy()
+        for name, geometry in zip(names, geometries):
+            try:
+                # Mask (True outside the geometry) & transform of the window overlapping the geometry
+                shape_mask, transform, window = raster_geometry_mask(src, [geometry], crop=True)
+            except ValueError:  # Geometry doesn't overlap the GeoTIFF
+                continue
+            out_image = src.read(window=window, masked=True)
+            out_image.mask = out_image.mask | shape_mask
+
+            feature_dir = os.path.join(out_dir, name)
+            os.makedirs(feature_dir, exist_ok=True)
+            meta.update({"driver": "GTiff",
+                         "height": out_image.shape[1],
+                         "width": out_image.shape[2],
+                         "transform": transform})
+            out_image_name = os.path.join(feature_dir, f"{file_prefix}_{image_name}")
+            with rasterio.open(out_image_name, "w", **meta) as dest:
+                dest.write(out_image)
+            mask_path = os.path.join(feature_dir, f"{file_prefix}_{image_stem}.npy")
+            save_mask(mask_path, ~shape_mask)
+            written.append((name, out_image_name, mask_path))
+    return written
+
+
+def clip_geotiffs(geometry_file: str,
+                  geotiffs: list[str],
+                  out_dir: str = None,
+                  file_prefix: str = 'masked',
+                  name_field: str = 'name',
+                  workers: int = None) -> list[tuple[str, str, str]]:
+    """Crop every feature of :geometry_file: from every GeoTIFF, the GeoTIFFs are processed in parallel.
+
+    :geometry_file: Shapefile/GeoJSON with one or more features, parsed once.
+    :geotiffs: Paths to the GeoTIFFs (s. expand_globs()).
+    :out_dir: Directory for the outputs, defaults to '<directory of the GeoTIFF>/geometries'.
+    :file_prefix: Prefix of the cropped GeoTIFFs and masks.
+    :name_field: Field holding the name of the features, s. feature_names().
+    :workers: Number of processes, defaults to the number of CPUs. 1 runs in this process.
+    :returns: (name, cropped GeoTIFF, mask) per GeoTIFF and overlapping feature, empty without GeoTIFFs
+
+    """
+    if not geotiffs:
+        return []
+    if out_dir is not None:
+        image_names = [os.path.basename(geotiff) for geotiff in geotiffs]
+        if len(set(image_names)) != len(image_names):
+            raise ValueError(f"GeoTIFFs with the same name would overwrite each other in '{out_dir}', omit the out_dir.")
+    gdf = gpd.read_file(geometry_file)
+    names = feature_names(gdf, name_field)
+    geometries = gdf.geometry
+    workers = workers or os.cpu_count()
+    n = len(geotiffs)
+    args = ([names] * n, [geometries] * n, [out_dir] * n, [file_prefix] * n)
+    if workers == 1:
+        results = map(clip_geotiff, geotiffs, *args)
+    else:
+        executor = ProcessPoolExecutor(max_workers=min(workers, n))
+        results = executor.map(clip_geotiff, geotiffs, *args)
+    try:
+        return [item for written in results for item in written]
+    finally:
+        if workers != 1:
+            executor.shutdown()
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser("batch_clip")
+    p.add_argument("geometry_file",
+                   help="Shapefile/GeoJSON containing the geometries to crop, f.i. the districts of Munich.",
+                   type=str)
+    p.add_argument("geotiffs",
+                   help="GeoTIFFs or glob patterns (quote them), f.i. './USGS/image_working_dir/*/LC08_*_B4.TIF'.",
+                   nargs='+',
+                   type=str)
+    p.add_argument("--out-dir",
+                   help="Directory for the outputs, defaults to '<directory of the GeoTIFF>/geometries'.",
+                   type=str)
+    p.add_argument("--prefix",
+                   help="Prefix for the cropped images and masks, f.i. 'buffered'.",
+                   default='masked',
+                   type=str)
+    p.add_argument("--name-field",
+                   help="Field holding the name of the features (used as directory name), the features are numbered if missing.",
+                   default='name',
+                   type=str)
+    p.add_argument("--workers",
+                   help="Number of processes, defaults to the number of CPUs.",
+                   type=int)
+    args = p.parse_args()
+
+    geotiffs = expand_globs(args.geotiffs)
+    written = clip_geotiffs(args.geometry_file, geotiffs, args.out_dir, args.prefix, args.name_field, args.workers)
+    for name, out_image_name, mask_path in written:
+        print(f'Created:\n\t{out_image_name}\n\t{mask_path}')
+    print(f'Cropped {len(written)} images ({len(geotiffs)} GeoTIFFs).')
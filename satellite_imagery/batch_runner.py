@@ -0,0 +1,561 @@
+"""
+Runs the whole workflow (clip, calculate indices, compare over time) for many scenes and areas of interest from one job spec instead of hand-run scripts with hard-coded paths.
+
+The job spec (JSON) lists scenes x AOIs x indices x products:
+    {
+        "out_dir": "./batch",
+        "scenes": ["./USGS/image_working_dir/ndvi_2022-*"],
+        "aois": {"munich": "./shapes_and_masks/munich/munich-bbox.shp"},
+        "indices": ["NDVI", "NDWI"],
+        "products": ["differences", "statistics"],
+        "workers": 4,
+        "memory_limit_mb": 8000,
+        "check": "mtime"
+    }
+Relative paths are relative to the spec, scenes can be glob patterns. The date of a scene is taken from its path (YYYY-MM-DD, s. time_series.date_from_path()). Optional: "reflectance" (default true, false calculates on the DN values), "cog", "compress", "composite" and "percentiles" (of the RGB composite) and "baseline" (dates of the anomaly).
+
+Products (the products they depend on are added to the task graph):
+  - clip: The bands needed per scene and AOI (s. batch_clip.py) -> <out_dir>/<aoi>/<scene>/masked_<band file>
+  - index: All indices of a clipped scene in one sweep (s. calculate_indizes.py) -> <out_dir>/<aoi>/<scene>/out/sc_<index>_SR.geotiff (s. spectral_indices.product_name())
+  - differences: Consecutive dates per AOI and index (s. time_series.py) -> <out_dir>/<aoi>/differences_<index>/
+  - statistics: Per pixel statistics over time -> <out_dir>/<aoi>/statistics_<index>.geotiff
+  - zonal_statistics: Statistics per feature of the AOI (s. zonal_statistics.py) -> <out_dir>/<aoi>/zonal_statistics_<index>.csv
+  - rgb: Composite of a clipped scene (s. make_rgb.py) -> <out_dir>/<aoi>/<scene>/out/combined_<bands>.tif
+
+Tasks run in a process pool as soon as their dependencies are done. Besides the number of workers, the sum of the estimated peak memory of the running tasks is kept below the limit (the estimate is the decoded size of the largest input raster times a factor per product, s. MEMORY_FACTORS). The signatures of the inputs and outputs of every finished task are stored in '<out_dir>/batch_manifest.json': A task is skipped if its parameters and inputs are unchanged and its outputs still exist, ie. adding a scene only runs the tasks of the new scene and the time series of its AOIs. "check": "mtime" compares size and modification time, "hash" additionally the content (SHA-1) of files whose size or modification time differ, ie. a rewritten but identical file doesn't trigger its dependents.
+
+Usage:
+    python batch_runner.py job.json [--workers 4] [--memory-limit 8000] [--check hash] [--force] [--dry-run]
+"""
+
+import os
+import glob
+import json
+import hashlib
+import argparse
+import rasterio
+import numpy as np
+import geopandas as gpd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from batch_clip import clip_geotiff
+from calculate_indizes import calculate_indices
+from make_rgb import COMPOSITES, make_composite
+from read_write_functions import find_band_files
+from spectral_indices import LANDSAT8_BANDS, LANDSAT8_REFLECTANCE, compile_indices, product_name
+from time_series import date_from_path, pairwise_differences, temporal_statistics
+from zonal_statistics import zonal_statistics_table
+
+PRODUCTS = ('clip', 'index', 'differences', 'statistics', 'zonal_statistics', 'rgb')
+# Products a product is calculated from
+REQUIRES = {'clip': (),
+            'index': ('clip',),
+            'differences': ('index',),
+            'statistics': ('index',),
+            'zonal_statistics': ('index',),
+            'rgb': ('clip',)}
+# Peak memory of a task relative to the decoded size of its largest input raster (windowed tasks need less than a whole raster)
+MEMORY_FACTORS = {'clip': 2.,
+                  'index': .5,
+                  'differences': .5,
+                  'statistics': .5,
+                  'zonal_statistics': 8.,
+                  'rgb': .5}
+# Memory of a worker process without data (interpreter & libraries)
+BASE_MEMORY_MB = 200
+MANIFEST_FILE = 'batch_manifest.json'
+CLIP_PREFIX = 'masked'
+# Files a shapefile consists of
+SHAPEFILE_SIDECARS = ('.shx', '.dbf', '.prj', '.cpg')
+
+
+def _resolve(path: str, base_dir: str) -> str:
+    return os.path.normpath(os.path.join(base_dir, os.path.expanduser(path)))
+
+
+def load_spec(path: str) -> dict:
+    """Read and validate a job spec, paths are resolved relative to its directory.
+
+    Raises a ValueError for an invalid spec and a FileNotFoundError listing every scene which lacks a band of the requested products.
+
+    :path: Path of the job spec (JSON).
+    :returns: The spec with defaults filled in, 'scenes' as sorted list of directories and 'products' including the products they depend on
+
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(path))
+    missing = [key for key in ('out_dir', 'scenes', 'aois', 'products') if key not in spec]
+    if missing:
+        raise ValueError(f"Job spec '{path}' lacks {missing}.")
+    spec.setdefault('indices', [])
+    spec.setdefault('workers', os.cpu_count())
+    spec.setdefault('memory_limit_mb', None)
+    spec.setdefault('check', 'mtime')
+    spec.setdefault('reflectance', True)
+    spec.setdefault('cog', False)
+    spec.setdefault('compress', 'deflate')
+    spec.setdefault('composite', 'true_color')
+    spec.setdefault('percentiles', None)
+    spec.setdefault('baseline', None)
+    spec['out_dir'] = _resolve(spec['out_dir'], base_dir)
+    scenes = set()
+    for pattern in spec['scenes']:
+        matches = [match for match in glob.glob(_resolve(pattern, base_dir)) if os.path.isdir(match)]
+        if not matches:
+            raise FileNotFoundError(f"No scene directory matches '{pattern}'.")
+        scenes.update(matches)
+    spec['scenes'] = sorted(scenes)
+    names = [os.path.basename(scene) for scene in spec['scenes']]
+    if len(set(names)) != len(names):
+        raise ValueError('Scene directories must have unique names, they are used as output directories.')
+    if not spec['aois']:
+        raise ValueError('The job spec needs at least one AOI.')
+    spec['aois'] = {name: _resolve(aoi, base_dir) for name, aoi in spec['aois'].items()}
+    unknown = set(spec['products']) - set(PRODUCTS)
+    if unknown:
+        raise ValueError(f'Unknown products {sorted(unknown)}, available are {PRODUCTS}.')
+    products = set()
+    pending = list(spec['products'])
+    while pending:
+        product = pending.pop()
+        products.add(product)
+        pending.extend(REQUIRES[product])
+    spec['products'] = [product for product in PRODUCTS if product in products]
+    if 'index' in products and not spec['indices']:
+        raise ValueError(f"The products {spec['products']} need 'indices'.")
+    if spec['check'] not in ('mtime', 'hash'):
+        raise ValueError(f"Unknown check '{spec['check']}', use 'mtime' or 'hash'.")
+    composite = spec['composite']
+    if isinstance(composite, str) and composite not in COMPOSITES:
+        raise ValueError(f"Unknown composite '{composite}', available are {list(COMPOSITES)} or a list of three bands.")
+    if not isinstance(composite, str) and len(composite) != 3:
+        raise ValueError(f'A composite needs three bands (red, green, blue), got {composite}.')
+    # Every scene has to provide the bands of all requested products
+    needed_by = _needed_bands(spec)
+    errors = []
+    for scene in spec['scenes']:
+        for band in _missing_bands(scene, tuple(needed_by)):
+            errors.append(f"'{scene}' lacks {band} (needed by {', '.join(needed_by[band])})")
+    if errors:
+        raise FileNotFoundError('Missing bands:\n\t' + '\n\t'.join(errors))
+    return spec
+
+
+def _needed_bands(spec: dict) -> dict[str, list[str]]:
+    """Bands read by the products of a spec.
+
+    :returns: Dict with K=Band & V=Indices and composite needing it
+
+    """
+    reflectance = LANDSAT8_REFLECTANCE if spec['reflectance'] else None
+    needed_by = {}
+    if 'index' in spec['products']:
+        for name in spec['indices']:
+            for band in compile_indices((name,), reflectance).bands:
+                needed_by.setdefault(LANDSAT8_BANDS[band], []).append(name)
+    if 'rgb' in spec['products']:
+        composite = spec['composite']
+        for band in _composite_bands(composite):
+            needed_by.setdefault(band, []).append(composite if isinstance(composite, str) else 'composite')
+    return needed_by
+
+
+def _composite_bands(composite: str | list[str]) -> list[str]:
+    return list(COMPOSITES[composite] if isinstance(composite, str) else composite)
+
+
+def _missing_bands(scene: str, bands: tuple[str, ...]) -> list[str]:
+    """Bands without a TIFF-file in :scene: (s. find_band_files())."""
+    files = [file for file in os.listdir(scene) if file.endswith(('.tif', '.TIF'))]
+    return [band for band in bands if not any(band in file for file in files)]
+
+
+def geometry_files(path: str) -> list[str]:
+    """The files of a shapefile (.shp and its sidecars) or a GeoJSON."""
+    stem, extension = os.path.splitext(path)
+    if extension.lower() != '.shp':
+        return [path]
+    return [path] + [stem + sidecar for sidecar in SHAPEFILE_SIDECARS if os.path.exists(stem + sidecar)]
+
+
+class Task():
+    """One node of the task graph.
+
+    :id: Unique id, '<product>/<aoi>/<scene or index>'.
+    :product: Product calculated by the task (s. PRODUCTS), selects the function in run_task().
+    :params: Keyword arguments of the function (JSON serializable), part of the signature of the task.
+    :inputs: Files read by the task.
+    :outputs: Files written by the task.
+    :deps: Ids of the tasks writing the inputs.
+
+    """
+
+    def __init__(self,
+                 id: str,
+                 product: str,
+                 params: dict,
+                 inputs: list[str],
+                 outputs: list[str],
+                 deps: list[str] = ()):
+        self.id = id
+        self.product = product
+        self.params = params
+        self.inputs = inputs
+        self.outputs = outputs
+        self.deps = list(deps)
+
+    def params_hash(self) -> str:
+        return hashlib.sha1(json.dumps([self.product, self.params], sort_keys=True).encode()).hexdigest()
+
+
+def build_graph(spec: dict) -> dict[str, Task]:
+    """Create the tasks of a job spec (s. load_spec()).
+
+    :returns: Dict with K=Id & V=Task, dependencies precede their dependents
+
+    """
+    products = spec['products']
+    out_dir = spec['out_dir']
+    reflectance = LANDSAT8_REFLECTANCE if spec['reflectance'] else None
+    program = compile_indices(tuple(spec['indices']), reflectance) if 'index' in products else None
+    index_bands = [LANDSAT8_BANDS[band] for band in program.bands] if program is not None else []
+    rgb_bands = _composite_bands(spec['composite']) if 'rgb' in products else []
+    bands = list(dict.fromkeys(index_bands + rgb_bands))
+    time_series = {'differences', 'statistics', 'zonal_statistics'} & set(products)
+    scenes = spec['scenes']
+    if time_series:
+        # Chronological, the dates are needed by the time series
+        scenes = sorted(scenes, key=date_from_path)
+
+    graph = {}
+    for aoi_name, aoi in spec['aois'].items():
+        aoi_dir = os.path.join(out_dir, aoi_name)
+        sc_geotiffs = {name: [] for name in spec['indices']}
+        index_ids = []
+        for scene in scenes:
+            scene_name = os.path.basename(scene)
+            clip_dir = os.path.join(aoi_dir, scene_name)
+            band_files = list(find_band_files(scene, tuple(bands)))
+            clipped = {band: os.path.join(clip_dir, f'{CLIP_PREFIX}_{os.path.basename(band_file)}')
+                       for band, band_file in zip(bands, band_files)}
+            masks = [os.path.splitext(path)[0] + '.npy' for path in clipped.values()]
+            clip_id = f'clip/{aoi_name}/{scene_name}'
+            graph[clip_id] = Task(clip_id, 'clip',
+                                  {'band_files': band_files, 'aoi': aoi, 'out_dir': aoi_dir, 'name': scene_name},
+                                  band_files + geometry_files(aoi),
+                                  list(clipped.values()) + masks)
+            if 'index' in products:
+                out_paths = {name: os.path.join(clip_dir, 'out', f'sc_{product_name(name, reflectance)}.geotiff')
+                             for name in spec['indices']}
+                index_id = f'index/{aoi_name}/{scene_name}'
+                graph[index_id] = Task(index_id, 'index',
+                                       {'img_dir': clip_dir, 'index_names': spec['indices'], 'reflectance': reflectance,
+                                        'cog': spec['cog'], 'compress': spec['compress']},
+                                       [clipped[band] for band in index_bands],
+                                       list(out_paths.values()),
+                                       [clip_id])
+                index_ids.append(index_id)
+                for name, path in out_paths.items():
+                    sc_geotiffs[name].append(path)
+            if 'rgb' in products:
+                rgb_id = f'rgb/{aoi_name}/{scene_name}'
+                out_path = os.path.join(clip_dir, 'out', f"combined_{'_'.join(rgb_bands)}.tif")
+                graph[rgb_id] = Task(rgb_id, 'rgb',
+                                     {'band_dir': clip_dir, 'bands': rgb_bands, 'percentiles': spec['percentiles'],
+                                      'out_path': out_path, 'cog': spec['cog'], 'compress': spec['compress']},
+                                     [clipped[band] for band in rgb_bands],
+                                     [out_path],
+                                     [clip_id])
+
+        for name, paths in sc_geotiffs.items():
+            if 'differences' in products and len(paths) > 1:
+                differences_dir = os.path.join(aoi_dir, f'differences_{name}')
+                dates = [date_from_path(path) for path in paths]
+                outputs = [os.path.join(differences_dir, f'difference_{date1}_{date2}.geotiff')
+                           for date1, date2 in zip(dates, dates[1:])]
+                task_id = f'differences/{aoi_name}/{name}'
+                graph[task_id] = Task(task_id, 'differences',
+                                      {'paths': paths, 'out_dir': differences_dir, 'cog': spec['cog']},
+                                      paths, outputs, index_ids)
+            if 'statistics' in products:
+                out_path = os.path.join(aoi_dir, f'statistics_{name}.geotiff')
+                task_id = f'statistics/{aoi_name}/{name}'
+                graph[task_id] = Task(task_id, 'statistics',
+                                      {'paths': paths, 'out_path': out_path, 'baseline': spec['baseline'],
+                                       'cog': spec['cog']},
+                                      paths, [out_path], index_ids)
+            if 'zonal_statistics' in products:
+                out_path = os.path.join(aoi_dir, f'zonal_statistics_{name}.csv')
+                task_id = f'zonal_statistics/{aoi_name}/{name}'
+                graph[task_id] = Task(task_id, 'zonal_statistics',
+                                      {'geometry_file': aoi, 'geotiffs': paths, 'out_path': out_path},
+                                      paths + geometry_files(aoi), [out_path], index_ids)
+    return graph
+
+
+"""Functions of the products, executed by the workers."""
+
+
+def _clip(band_files: list[str], aoi: str, out_dir: str, name: str) -> None:
+    # All features of the AOI form one area (like isolate_shape.py)
+    gdf = gpd.read_file(aoi)
+    geometries = gpd.GeoSeries([gdf.geometry.union_all()], crs=gdf.crs)
+    for band_file in band_files:
+        if not clip_geotiff(band_file, [name], geometries, out_dir, CLIP_PREFIX):
+            raise ValueError(f"The AOI '{aoi}' doesn't overlap '{band_file}'.")
+
+
+def _index(img_dir: str, index_names: list[str], reflectance: list[float], cog: bool, compress: str) -> None:
+    calculate_indices(img_dir, tuple(index_names), reflectance=reflectance, cog=cog, compress=compress)
+
+
+def _differences(paths: list[str], out_dir: str, cog: bool) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    pairwise_differences(paths, out_dir, cog=cog)
+
+
+def _statistics(paths: list[str], out_path: str, baseline: list[str], cog: bool) -> None:
+    temporal_statistics(paths, out_path, baseline, cog=cog)
+
+
+def _zonal_statistics(geometry_file: str, geotiffs: list[str], out_path: str) -> None:
+    # The 'sc_'-GeoTIFFs hold <index * 255>, their nodata value 0 is a valid index value
+    # and the AOI the scenes are clipped to is the union of the zones
+    zonal_statistics_table(geometry_file, geotiffs, out_path, scale=255, mask_nodata=False)
+
+
+def _rgb(band_dir: str, bands: list[str], percentiles: list[float], out_path: str, cog: bool, compress: str) -> None:
+    make_composite(band_dir, tuple(bands), percentiles=percentiles, out_path=out_path, cog=cog, compress=compress)
+
+
+PRODUCT_FUNCTIONS = {'clip': _clip,
+                     'index': _index,
+                     'differences': _differences,
+                     'statistics': _statistics,
+                     'zonal_statistics': _zonal_statistics,
+                     'rgb': _rgb}
+
+
+def run_task(product: str, params: dict) -> None:
+    PRODUCT_FUNCTIONS[product](**params)
+
+
+def estimate_memory_mb(task: Task) -> float:
+    """Estimated peak memory of :task: (s. MEMORY_FACTORS), inputs which aren't (readable) rasters are ignored."""
+    largest = 0
+    for path in task.inputs:
+        try:
+            with rasterio.open(path) as src:
+                largest = max(largest, src.width * src.height * src.count * np.dtype(src.dtypes[0]).itemsize)
+        except (rasterio.errors.RasterioIOError, TypeError):
+            continue
+    return BASE_MEMORY_MB + MEMORY_FACTORS[task.product] * largest / 2**20
+
+
+def physical_memory_mb() -> float:
+    """Physical memory of the machine, None if unknown."""
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class Manifest():
+    """Signatures of the inputs and outputs of the finished tasks, saved in '<out_dir>/batch_manifest.json'.
+
+    A signature is [size, mtime, SHA-1], the SHA-1 is only calculated with :check: 'hash' (and only if size or mtime differ).
+
+    """
+
+    def __init__(self, path: str, check: str = 'mtime'):
+        self.path = path
+        self.check = check
+        self.tasks = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.tasks = json.load(f)['tasks']
+        # Hashes calculated in this run, K=(path, size, mtime)
+        self._hashes = {}
+
+    @staticmethod
+    def stamp(path: str) -> list[int]:
+        """[size, mtime] of :path:, None if it is missing."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def sha1(self, path: str, stamp: list[int]) -> str:
+        key = (path, *stamp)
+        if key not in self._hashes:
+            digest = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2**20), b''):
+                    digest.update(block)
+            self._hashes[key] = digest.hexdigest()
+        return self._hashes[key]
+
+    def unchanged(self, path: str, signature: list) -> bool:
+        """True if :path: still matches :signature: (same size and mtime or, with check 'hash', the same content)."""
+        stamp = self.stamp(path)
+        if stamp is None:
+            return False
+        if stamp == signature[:2]:
+            return True
+        return self.check == 'hash' and signature[2] is not None and self.sha1(path, stamp) == signature[2]
+
+    def is_current(self, task: Task) -> bool:
+        """True if :task: ran with the same parameters and inputs and its outputs are unchanged."""
+        entry = self.tasks.get(task.id)
+        if entry is None or entry['params'] != task.params_hash():
+            return False
+        if sorted(entry['inputs']) != sorted(task.inputs) or sorted(entry['outputs']) != sorted(task.outputs):
+            return False
+        return all(self.unchanged(path, signature)
+                   for files in (entry['inputs'], entry['outputs'])
+                   for path, signature in files.items())
+
+    def record(self, task: Task) -> None:
+        """Store the signatures of the inputs and outputs of :task:."""
+        entry = self.tasks.get(task.id, {})
+        former = {**entry.get('inputs', {}), **entry.get('outputs', {})}
+
+        def signature(path):
+            stamp = self.stamp(path)
+            if self.check == 'hash':
+                return [*stamp, self.sha1(path, stamp)]
+            # Keep the hash of an unchanged file
+            sha1 = former[path][2] if path in former and former[path][:2] == stamp else None
+            return [*stamp, sha1]
+        self.tasks[task.id] = {'params': task.params_hash(),
+                               'inputs': {path: signature(path) for path in task.inputs},
+                               'outputs': {path: signature(path) for path in task.outputs}}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'tasks': self.tasks}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def run_graph(graph: dict[str, Task],
+              manifest: Manifest,
+              workers: int = None,
+              memory_limit_mb: float = None,
+              force: bool = False,
+              dry_run: bool = False) -> dict[str, str]:
+    """Run the tasks in a process pool, dependencies first, skipping tasks whose inputs are unchanged.
+
+    :graph: The tasks (s. build_graph()).
+    :manifest: Signatures of former runs, updated after every finished task.
+    :workers: Number of processes, defaults to the number of CPUs.
+    :memory_limit_mb: Upper bound of the summed estimates of the running tasks (s. estimate_memory_mb()), defaults to 75 % of the physical memory. A task exceeding it alone runs alone.
+    :force: Run all tasks.
+    :dry_run: Only print what would run.
+    :returns: Dict with K=Id & V=Status ('done', 'skipped', 'failed', 'blocked' (a dependency failed) or 'would run')
+
+    """
+    workers = workers or os.cpu_count()
+    if memory_limit_mb is None:
+        memory = physical_memory_mb()
+        memory_limit_mb = .75 * memory if memory is not None else float('inf')
+    status = {}
+    remaining = {task_id: set(task.deps) for task_id, task in graph.items()}
+    dependents = {task_id: [] for task_id in graph}
+    for task_id, task in graph.items():
+        for dep in task.deps:
+            dependents[dep].append(task_id)
+    ready = deque(task_id for task_id, deps in remaining.items() if not deps)
+    running = {}  # Future -> (task, estimated memory)
+
+    def finish(task: Task, state: str, message: str = '') -> None:
+        status[task.id] = state
+        print(f'[{len(status)}/{len(graph)}] {state:9} {task.id}{message}')
+        for dependent in dependents[task.id]:
+            remaining[dependent].discard(task.id)
+            if not remaining[dependent]:
+                ready.append(dependent)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while ready or running:
+            deferred = deque()
+            while ready:
+                task = graph[ready.popleft()]
+                states = {status[dep] for dep in task.deps}
+                if states & {'failed', 'blocked'}:
+                    finish(task, 'blocked')
+                elif not force and 'would run' not in states and manifest.is_current(task):
+                    if not dry_run:
+                        # Refresh the mtimes of files rewritten with the same content (check 'hash')
+                        manifest.record(task)
+                    finish(task, 'skipped')
+                elif dry_run:
+                    finish(task, 'would run')
+                else:
+                    memory = estimate_memory_mb(task)
+                    used = sum(estimate for _, estimate in running.values())
+                    if len(running) >= workers or (running and used + memory > memory_limit_mb):
+                        deferred.append(task.id)
+                        continue
+                    running[pool.submit(run_task, task.product, task.params)] = (task, memory)
+            ready.extend(deferred)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, _ = running.pop(future)
+                try:
+                    future.result()
+                    missing = [path for path in task.outputs if not os.path.exists(path)]
+                    if missing:
+                        raise FileNotFoundError(f'Outputs missing: {missing}')
+                except Exception as e:
+                    finish(task, 'failed', f': {type(e).__name__}: {e}')
+                    continue
+                manifest.record(task)
+                manifest.save()
+                finish(task, 'done')
+    if not dry_run:
+        manifest.save()
+    return status
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser('batch_runner')
+    p.add_argument('spec',
+                   help='Job spec (JSON) listing scenes, AOIs, indices and products.',
+                   type=str)
+    p.add_argument('--workers',
+                   help='Number of processes, overrides the spec.',
+                   type=int)
+    p.add_argument('--memory-limit',
+                   help='Upper bound of the estimated memory of the running tasks in MB, overrides the spec.',
+                   type=float)
+    p.add_argument('--check',
+                   help='Compare the inputs by size and modification time or by content, overrides the spec.',
+                   choices=('mtime', 'hash'),
+                   type=str)
+    p.add_argument('--force',
+                   help='Run all tasks, even those whose inputs are unchanged.',
+                   action='store_true')
+    p.add_argument('--dry-run',
+                   help='Only print which tasks would run.',
+                   action='store_true')
+    args = p.parse_args()
+
+    spec = load_spec(args.spec)
+    graph = build_graph(spec)
+    manifest = Manifest(os.path.join(spec['out_dir'], MANIFEST_FILE), args.check or spec['check'])
+    status = run_graph(graph,
+                       manifest,
+                       args.workers or spec['workers'],
+                       args.memory_limit or spec['memory_limit_mb'],
+                       args.force,
+                       args.dry_run)
+    counts = {state: list(status.values()).count(state) for state in dict.fromkeys(status.values())}
+    print(', '.join(f'{count} {state}' for state, count in counts.items()))
+    if 'failed' in counts or 'blocked' in counts:
+        raise SystemExit(1)
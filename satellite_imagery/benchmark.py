@@ -0,0 +1,338 @@
+"""
+Benchmarks of the hot paths with synthetic data, ie. no downloaded scene is needed.
+
+A workspace with synthetic uint16 bands (Landsat 8 names, configurable size, tiling and compression), 'sc_'-GeoTIFFs of several dates and an area of interest (shapefile with <500 vertices) is generated first. Every case runs in a fresh process (cold caches), the setup (f.i. reading the bands before timing calculate()) isn't measured. Per run the wall time, CPU time, peak of the traced allocations (tracemalloc, includes NumPy arrays) and the peak RSS of the process are recorded.
+
+The results are written as JSON together with the parameters, the commit and the versions of the libraries. `--compare <old JSON>` prints the ratios to a former run, f.i. of another commit.
+
+Usage:
+    python benchmark.py [--size 2048] [--tile-size 256] [--compress deflate] [--repeat 3] [--cases read_bands ndvi ...] [--out benchmark.json] [--compare <JSON>]
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import shutil
+import platform
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import multiprocessing
+import rasterio
+import numpy as np
+import numpy.typing as npt
+import geopandas as gpd
+from shapely.geometry import Polygon
+from rasterio.transform import from_origin
+from concurrent.futures import ProcessPoolExecutor
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Grid of the synthetic scenes (UTM 32N, 30 m like Landsat 8 around Munich)
+CRS = 'EPSG:32632'
+ORIGIN = (680000., 5350000.)
+RESOLUTION = 30.
+DATES = ('2022-05-15', '2022-05-31', '2022-07-18')
+BANDS = ('B3', 'B4', 'B5')
+
+
+def synthetic_band(size: int,
+                   seed: int,
+                   low: int = 7000,
+                   high: int = 16000) -> npt.NDArray:
+    """Smooth random field plus noise in [low, high] as uint16 (compresses like real bands, unlike white noise)."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.random((size // 64 + 2, size // 64 + 2))
+    field = np.repeat(np.repeat(coarse, 64, axis=0), 64, axis=1)[:size, :size]
+    field = field * (high - low - 400) + low + 200 + rng.normal(0, 60, (size, size))
+    return np.clip(field, low, high).astype(np.uint16)
+
+
+def write_band(path: str,
+               data: npt.NDArray,
+               tile_size: int = None,
+               compress: str = None) -> str:
+    """Write a single channel GeoTIFF on the synthetic grid, tiled if :tile_size: and compressed if :compress:."""
+    profile = {'driver': 'GTiff',
+               'height': data.shape[0],
+               'width': data.shape[1],
+               'count': 1,
+               'dtype': data.dtype.name,
+               'crs': CRS,
+               'transform': from_origin(*ORIGIN, RESOLUTION, RESOLUTION),
+               'nodata': 0}
+    if tile_size:
+        profile.update(tiled=True, blockxsize=tile_size, blockysize=tile_size)
+    if compress and compress != 'none':
+        profile.update(compress=compress)
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data, 1)
+    return path
+
+
+def synthetic_aoi(path: str,
+                  size: int,
+                  n_vertices: int = 499,
+                  seed: int = 0) -> str:
+    """Write a star shaped polygon with :n_vertices: covering roughly half of the scene as shapefile."""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, n_vertices - 1, endpoint=False)
+    radii = size * RESOLUTION * (.3 + .1 * rng.random(n_vertices - 1))
+    center_x = ORIGIN[0] + size * RESOLUTION / 2
+    center_y = ORIGIN[1] - size * RESOLUTION / 2
+    polygon = Polygon(zip(center_x + radii * np.cos(angles), center_y + radii * np.sin(angles)))
+    gpd.GeoDataFrame({'name': ['aoi']}, geometry=[polygon], crs=CRS).to_file(path)
+    return path
+
+
+def create_workspace(root: str,
+                     size: int = 2048,
+                     tile_size: int = 256,
+                     compress: str = 'deflate') -> dict:
+    """Generate the synthetic data of the benchmarks.
+
+    Layout (like the working directories of the scripts):
+        <root>/USGS/image_working_dir/ndvi_<date>/LC08_SYNTHETIC_<date>_<band>.TIF
+        <root>/USGS/image_working_dir/ndvi_<date>/out/sc_NDVI.geotiff
+        <root>/shapes_and_masks/munich/munich-bbox.shp (the area of interest, also as munich-ds.shp)
+
+    :root: Directory of the workspace.
+    :size: Width and height of the scenes in pixels.
+    :tile_size: Edge length of the internal tiles, None for strips.
+    :compress: Compression of the GeoTIFFs, f.i. 'deflate', 'lzw', 'zstd' or 'none'.
+    :returns: Paths of the workspace: 'root', 'scenes', 'sc_geotiffs', 'aoi_dir', 'aoi'
+
+    """
+    scenes, sc_geotiffs = [], []
+    for i, date in enumerate(DATES):
+        scene_dir = os.path.join(root, 'USGS', 'image_working_dir', f'ndvi_{date}')
+        os.makedirs(os.path.join(scene_dir, 'out'), exist_ok=True)
+        for j, band in enumerate(BANDS):
+            write_band(os.path.join(scene_dir, f'LC08_SYNTHETIC_{date}_{band}.TIF'),
+                       synthetic_band(size, 10 * i + j), tile_size, compress)
+        index = (synthetic_band(size, 100 + i, 1, 255)).astype(np.uint8)
+        sc_geotiffs.append(write_band(os.path.join(scene_dir, 'out', 'sc_NDVI.geotiff'),
+                                      index, tile_size, compress))
+        scenes.append(scene_dir)
+    aoi_dir = os.path.join(root, 'shapes_and_masks', 'munich')
+    os.makedirs(aoi_dir, exist_ok=True)
+    aoi = synthetic_aoi(os.path.join(aoi_dir, 'munich-bbox.shp'), size)
+    # index_over_time.py embeds this boundary
+    synthetic_aoi(os.path.join(aoi_dir, 'munich-ds.shp'), size)
+    return {'root': root, 'scenes': scenes, 'sc_geotiffs': sc_geotiffs, 'aoi_dir': aoi_dir, 'aoi': aoi}
+
+
+def _run_script(script: str,
+                argv: list[str]):
+    """Callable running :script: like 'python <script> <argv>' in the current process."""
+    def run():
+        sys.argv = [script, *argv]
+        # Scripts may end with SystemExit (f.i. index_over_time.py --no-plot)
+        with contextlib.redirect_stdout(open(os.devnull, 'w')), contextlib.suppress(SystemExit):
+            runpy.run_path(os.path.join(SCRIPT_DIR, script), run_name='__main__')
+    return run
+
+
+"""Cases: Set up (not measured) and return the callable to measure."""
+
+
+def case_read_bands(workspace: dict):
+    from Index import NDVI
+    index = NDVI(('B4', 'B5'), workspace['scenes'][0], streaming=True)
+    return index._Index__read_bands
+
+
+def case_ndvi(workspace: dict):
+    from Index import NDVI
+    index = NDVI(('B4', 'B5'), workspace['scenes'][0])
+    return index.calculate
+
+
+def case_ndwi(workspace: dict):
+    from Index import NDWI
+    index = NDWI(('B3', 'B5'), workspace['scenes'][0])
+    return index.calculate
+
+
+def case_generate_plots(workspace: dict):
+    from Index import NDVI
+    index = NDVI(('B4', 'B5'), workspace['scenes'][0])
+    index.calculate()
+
+    def run():
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            index.generate_plots(['red', 'yellow', 'green'], workspace['aoi_dir'], 'munich-bbox')
+    return run
+
+
+def case_adjust_values(workspace: dict):
+    from adjust_values import adjust_values
+    from band_cache import band_cache
+    from read_write_functions import find_band_files
+    band = band_cache.read(find_band_files(workspace['scenes'][0], ('B4',))[0])
+    return lambda: adjust_values(band, 7000, 16000)
+
+
+def case_isolate_shape(workspace: dict):
+    geotiff = workspace['sc_geotiffs'][0]
+    mask_path = os.path.join(workspace['root'], 'mask.npy')
+    return _run_script('isolate_shape.py', [geotiff, workspace['aoi'], 'masked', mask_path])
+
+
+def case_index_over_time(workspace: dict):
+    return _run_script('index_over_time.py', [*workspace['sc_geotiffs'], '--aoi', workspace['aoi']])
+
+
+def case_index_differences(workspace: dict):
+    out_dir = os.path.join(workspace['root'], 'differences')
+    return _run_script('index_over_time.py',
+                       [*workspace['sc_geotiffs'], '--aoi', workspace['aoi'], '--differences', out_dir, '--no-plot'])
+
+
+CASES = {'read_bands': case_read_bands,
+         'ndvi': case_ndvi,
+         'ndwi': case_ndwi,
+         'generate_plots': case_generate_plots,
+         'adjust_values': case_adjust_values,
+         'isolate_shape': case_isolate_shape,
+         'index_over_time': case_index_over_time,
+         'index_differences': case_index_differences}
+
+
+def measure(case: str,
+            workspace: dict) -> dict:
+    """Run :case: once in the current process, executed by a fresh worker process per run (s. run_benchmarks())."""
+    import matplotlib
+    matplotlib.use('Agg')
+    if SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, SCRIPT_DIR)
+    import masks
+    # Scripts write relative to the working directory, rasterized masks aren't reused between runs
+    os.chdir(workspace['root'])
+    masks.mask_cache_dir = tempfile.mkdtemp(dir=workspace['root'])
+    run = CASES[case](workspace)
+    tracemalloc.start()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    run()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    return {'wall_s': wall,
+            'cpu_s': cpu,
+            'traced_peak_mb': traced_peak / 2**20,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_unit / 2**20}
+
+
+def run_benchmarks(workspace: dict,
+                   cases: list[str],
+                   repeat: int = 3) -> list[dict]:
+    """Run every case :repeat: times, each run in a fresh process.
+
+    :returns: Per case the measurements of all runs and the minimum/median of the wall time and the maximum of the memory
+
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for case in cases:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(measure, case, workspace).result())
+        wall = [run['wall_s'] for run in runs]
+        results.append({'case': case,
+                        'runs': runs,
+                        'wall_s_min': min(wall),
+                        'wall_s_median': float(np.median(wall)),
+                        'traced_peak_mb': max(run['traced_peak_mb'] for run in runs),
+                        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs)})
+        print(f"{case:18} {results[-1]['wall_s_median']:8.3f} s {results[-1]['traced_peak_mb']:8.1f} MB traced "
+              f"{results[-1]['peak_rss_mb']:8.1f} MB RSS")
+    return results
+
+
+def environment() -> dict:
+    """Commit and versions the results belong to."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'rasterio': rasterio.__version__,
+            'gdal': rasterio.__gdal_version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+
+def compare(results: list[dict],
+            baseline_path: str) -> None:
+    """Print the ratios of the median wall time and the traced peak to a former run (> 1: slower/more memory)."""
+    with open(baseline_path) as f:
+        baseline = {result['case']: result for result in json.load(f)['results']}
+    print(f'Compared to {baseline_path}:')
+    for result in results:
+        old = baseline.get(result['case'])
+        if old is None:
+            continue
+        print(f"{result['case']:18} time x{result['wall_s_median'] / old['wall_s_median']:6.2f} "
+              f"memory x{result['traced_peak_mb'] / max(old['traced_peak_mb'], 1e-9):6.2f}")
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser('benchmark')
+    p.add_argument('--size',
+                   help='Width and height of the synthetic scenes in pixels (a Landsat 8 scene is ~7700).',
+                   default=2048,
+                   type=int)
+    p.add_argument('--tile-size',
+                   help='Edge length of the internal tiles of the GeoTIFFs, 0 for strips.',
+                   default=256,
+                   type=int)
+    p.add_argument('--compress',
+                   help='Compression of the GeoTIFFs.',
+                   default='deflate',
+                   choices=('none', 'deflate', 'lzw', 'zstd'),
+                   type=str)
+    p.add_argument('--repeat',
+                   help='Runs per case.',
+                   default=3,
+                   type=int)
+    p.add_argument('--cases',
+                   help='Cases to run, defaults to all.',
+                   nargs='+',
+                   default=list(CASES),
+                   choices=list(CASES),
+                   type=str)
+    p.add_argument('--workspace',
+                   help='Directory for the synthetic data, a temporary directory (removed afterwards) if omitted.',
+                   type=str)
+    p.add_argument('--out',
+                   help='Path of the JSON with the results.',
+                   default='benchmark.json',
+                   type=str)
+    p.add_argument('--compare',
+                   help='JSON of a former run to compare with.',
+                   type=str)
+    args = p.parse_args()
+
+    root = os.path.abspath(args.workspace) if args.workspace else tempfile.mkdtemp(prefix='eo-benchmark-')
+    try:
+        workspace = create_workspace(root, args.size, args.tile_size or None, args.compress)
+        results = run_benchmarks(workspace, args.cases, args.repeat)
+    finally:
+        if args.workspace is None:
+            shutil.rmtree(root, ignore_errors=True)
+    parameters = {'size': args.size, 'tile_size': args.tile_size, 'compress': args.compress, 'repeat': args.repeat}
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(), 'parameters': parameters, 'results': results}, f, indent=2)
+    print(f'Created:\n\t{args.out}')
+    if args.compare:
+        compare(results, args.compare)
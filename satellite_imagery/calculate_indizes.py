@@ -1,25 +1,142 @@
+"""
+Calculates indices of a scene.
+
+Usage:
+    python calculate_indizes.py <scene_dir> <index> [<index> ...]
+        Batch: Calculates all indices (s. spectral_indices.py) in one sweep over the scene and saves them as '<scene_dir>/out/sc_<index>_SR.geotiff' (s. product_name()).
+    python calculate_indizes.py
+        Calculates and plots the NDVI/NDWI as configured below.
+"""
+
+import os
+import argparse
+import contextlib
+import rasterio
+import numpy as np
+import numpy.typing as npt
 from Index import NDVI, NDWI
+from read_write_functions import find_band_files, create_out_dir, split_windows, open_geotiff
+from spectral_indices import INDICES, LANDSAT8_BANDS, LANDSAT8_REFLECTANCE, compile_indices, product_name
+
+
+def calculate_indices(img_dir: str,
+                      index_names: tuple[str, ...],
+                      min: float = 0.,
+                      max: float = 1.,
+                      dtype: npt.DTypeLike = np.float32,
+                      sensor_bands: dict[str, str] = LANDSAT8_BANDS,
+                      reflectance: tuple[float, float] = LANDSAT8_REFLECTANCE,
+                      tile_size: int = None,
+                      cog: bool = False,
+                      compress: str = 'deflate') -> dict[str, str]:
+    """Calculate several indices of a scene in one sweep and save them as single channel GeoTIFFs.
+
+    Every band needed by any of the indices is opened and decoded exactly once. The indices are calculated window by window from the shared band values and all outputs are written in the same sweep, ie. peak memory depends on the window size only.
+    The GeoTIFFs equal the 'sc_'-GeoTIFFs of SpectralIndex(<index>, :img_dir:), ie. they are named 'sc_<index>_SR.geotiff' ('_DN' without :reflectance:, s. product_name()).
+
+    :img_dir: Directory containing one TIFF-file per band.
+    :index_names: Names of registered indices, f.i. ('NDVI', 'NDWI', 'EVI').
+    :min: Lower bound the indices are clipped to.
+    :max: Upper bound the indices are clipped to.
+    :dtype: Precision of the calculation.
+    :sensor_bands: Mapping of the symbolic band names onto the band names in the file names.
+    :reflectance: Scale and offset to convert the bands into reflectance (s. LANDSAT8_REFLECTANCE), None calculates on the DN values (refused for EVI and SAVI).
+    :tile_size: Edge length of the windows, defaults to the internal blocks of the bands.
+    :cog: Write Cloud-Optimized GeoTIFFs (tiled, compressed, with overviews), s. open_geotiff().
+    :compress: Compression of the COGs: 'deflate', 'zstd' or 'lzw'.
+    :returns: Dict with K=Name of the index & V=Path of its GeoTIFF
+
+    """
+    if not index_names:
+        raise ValueError('No index to calculate, pass at least one registered index.')
+    program = compile_indices(index_names, reflectance)
+    band_files = find_band_files(img_dir,
+                                 tuple(sensor_bands[band] for band in program.bands))
+    out_dir = create_out_dir(img_dir)
+    out_paths = {name: os.path.join(out_dir, f"sc_{product_name(name, reflectance)}.geotiff")
+                 for name in program.names}
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(rasterio.open(file)) for file in band_files]
+        meta = sources[0].meta.copy()
+        meta.update(count=1,
+                    dtype=rasterio.uint8,
+                    nodata=0)
+        images = {name: stack.enter_context(open_geotiff(path, meta, cog, compress))
+                  for name, path in out_paths.items()}
+        for window in split_windows(band_files[0], tile_size):
+            # The DN values are used as they are, the program casts while calculating
+            bands = {band: src.read(1, window=window)
+                     for band, src in zip(program.bands, sources)}
+            for name, index in program(bands, dtype).items():
+                np.clip(index, min, max, out=index)
+                images[name].write((index * 255).astype('uint8'), 1, window=window)
+    return out_paths
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(prog='calculate_indizes')
+    p.add_argument('scene_dir',
+                   help='Directory containing one TIFF-file per band. Without it, the NDVI/NDWI configured in the script are calculated and plotted.',
+                   nargs='?',
+                   type=str)
+    p.add_argument('indices',
+                   help=f'Indices to calculate, registered are {", ".join(INDICES)}.',
+                   nargs='*',
+                   type=str)
+    p.add_argument('--dn',
+                   help='Calculate on the DN values instead of the Landsat 8/9 surface reflectance (not possible for EVI and SAVI).',
+                   action='store_true')
+    p.add_argument('--cog',
+                   help='Save the indices as Cloud-Optimized GeoTIFFs (tiled, compressed, with overviews).',
+                   action='store_true')
+    p.add_argument('--compress',
+                   help='Compression of the Cloud-Optimized GeoTIFFs.',
+                   choices=('deflate', 'zstd', 'lzw'),
+                   default='deflate')
+    args = p.parse_args()
+
+    if args.scene_dir is not None:
+        if not args.indices:
+            p.error(f'the scene needs at least one index, registered are {", ".join(INDICES)}')
+        reflectance = None if args.dn else LANDSAT8_REFLECTANCE
+        out_paths = calculate_indices(args.scene_dir,
+                                      tuple(args.indices),
+                                      reflectance=reflectance,
+                                      cog=args.cog,
+                                      compress=args.compress)
+        print('Saved:', *out_paths.values(), sep='\n\t')
+        raise SystemExit
+
+    ndvi = True
+    ndwi = False
+    # Calculate the index block by block and only write the 'sc_'-GeoTIFF
+    # (no plots), needed for whole scenes which don't fit into memory
+    streaming = False
+    # Number of CPU cores calculating windows in parallel (streaming only)
+    workers = os.cpu_count()
+
+    """NDVI"""
+    if ndvi and streaming:
+        Ndvi = NDVI(('B4', 'B5'),
+                    './USGS/image_working_dir/ndvi_2022-07-18_bbox',
+                    streaming=True)
+        Ndvi.stream(workers=workers)
+    elif ndvi:
+        Ndvi = NDVI(('B4', 'B5'),
+                    './USGS/image_working_dir/ndvi_2022-07-18_bbox')
+        Ndvi.calculate()
+        Ndvi.generate_plots(('red', 'yellow', 'green'),
+                            './shapes_and_masks/munich/',
+                            'munich-bbox',
+                            True,
+                            'munich-ds')
 
-ndvi = True
-ndwi = False
-
-"""NDVI"""
-if ndvi:
-    Ndvi = NDVI(('B4', 'B5'),
-                './USGS/image_working_dir/ndvi_2022-07-18_bbox')
-    Ndvi.calculate()
-    Ndvi.generate_plots(('red', 'yellow', 'green'),
-                        './shapes_and_masks/munich/',
-                        'munich-bbox',
-                        True,
-                        'munich-ds')
-
-"""NDWI"""
-if ndwi:
-    Ndwi = NDWI(('B3', 'B5'),
-                './USGS/image_working_dir/ndwi_2022-05-15/')
-    Ndwi.calculate()
-    Ndwi.generate_plots(('yellow', 'blue'),
-                        False,
-                        './shapes_and_masks/munich/',
-                        'munich-ds')
+    """NDWI"""
+    if ndwi:
+        Ndwi = NDWI(('B3', 'B5'),
+                    './USGS/image_working_dir/ndwi_2022-05-15/')
+        Ndwi.calculate()
+        Ndwi.generate_plots(('yellow', 'blue'),
+                            False,
+                            './shapes_and_masks/munich/',
+                            'munich-ds')
@@ -0,0 +1,65 @@
+"""
+Applying a colormap via a lookup table (LUT).
+
+Applying a matplotlib Colormap to a float array yields a float64 RGBA array, ie. 32 bytes per pixel. Instead, the index is quantized to uint8 (like the 'sc_'-GeoTIFFs) and the colors are looked up in a table of the 256 uint8 RGBA colors of the Colormap with a single take(): 4 bytes per pixel.
+The color of a value x is the one of floor(x * 255) / 255, ie. it differs from Colormap(x) by at most one of the 256 steps of the Colormap.
+
+Usage:
+    color_map = LinearSegmentedColormap.from_list("", colors)
+    rgba = colorize(quantize(index), colormap_lut(color_map), mask)
+"""
+
+import numpy as np
+import numpy.typing as npt
+from matplotlib.colors import Colormap
+
+
+def colormap_lut(color_map: Colormap) -> npt.NDArray:
+    """Table of the colors of :color_map: for the values 0/255, 1/255, ..., 255/255.
+
+    :color_map: The matplotlib Colormap.
+    :returns: Array of shape (256, 4) with uint8 RGBA colors
+
+    """
+    return color_map(np.linspace(0, 1, 256), bytes=True)
+
+
+def quantize(index: npt.NDArray,
+             rows: int = 256) -> npt.NDArray:
+    """Map an index in [0, 1] onto uint8, values outside are clipped.
+
+    :index: Array of the index.
+    :rows: Number of rows processed at once, bounds the float temporaries.
+    :returns: uint8 array of the same shape, <index * 255> truncated
+
+    """
+    quantized = np.empty(index.shape, dtype=np.uint8)
+    for start in range(0, index.shape[0], rows):
+        block = np.clip(index[start:start + rows], 0., 1.)
+        block *= 255
+        quantized[start:start + rows] = block
+    return quantized
+
+
+def colorize(quantized: npt.NDArray,
+             lut: npt.NDArray,
+             mask: npt.NDArray = None,
+             rows: int = 64) -> npt.NDArray:
+    """Look up the colors of a quantized index.
+
+    :quantized: uint8 array, f.i. returned by quantize().
+    :lut: Table of 256 RGBA colors, s. colormap_lut().
+    :mask: Boolean array of the area of interest. If given, it replaces the alpha channel (in place), ie. pixels outside are transparent.
+    :rows: Number of rows looked up at once, take() converts the indices to intp (8 bytes per pixel).
+    :returns: uint8 RGBA array of shape (*quantized.shape, 4)
+
+    """
+    rgba = np.empty((*quantized.shape, 4), dtype=np.uint8)
+    # One RGBA color as one uint32, ie. a single lookup per pixel
+    lut_rgba = np.ascontiguousarray(lut, dtype=np.uint8).view(np.uint32).reshape(256)
+    rgba_pixels = rgba.view(np.uint32).reshape(quantized.shape)
+    for start in range(0, quantized.shape[0], rows):
+        lut_rgba.take(quantized[start:start + rows], out=rgba_pixels[start:start + rows])
+    if mask is not None:
+        np.multiply(mask, np.uint8(255), out=rgba[..., 3])
+    return rgba
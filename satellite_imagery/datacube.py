@@ -0,0 +1,246 @@
+"""
+Persistent store of single channel GeoTIFFs of the same area over time (a datacube), f.i. the 'sc_'-GeoTIFFs of the NDVI produced by Index.generate_plots().
+
+Layout of a cube directory:
+    cube.json       Grid (shape, transform, CRS), data type, chunk size and the index of dates
+    <date>.npy      One file per date, shape (chunk rows, chunk columns, chunk, chunk)
+The chunks of a date are stored one after the other, so reading a window of a memory-mapped date only touches the chunks overlapping the window. GeoTIFFs are decoded once when they are ingested; ingesting is incremental, dates already in the cube are skipped unless their GeoTIFF changed.
+
+Usage:
+    python datacube.py ingest <cube_dir> <GeoTIFF> [<GeoTIFF> ...]
+    python datacube.py difference <cube_dir> <date1> <date2> <out GeoTIFF>
+"""
+
+import os
+import json
+import argparse
+import rasterio
+import numpy as np
+import numpy.typing as npt
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.windows import Window
+from read_write_functions import open_geotiff
+from time_series import date_from_path, difference_dtype
+
+
+class DataCube:
+
+    """Chunked, memory-mapped time series of a single channel raster."""
+
+    def __init__(self, path: str):
+        """Open an existing cube (s. DataCube.create()).
+
+        :path: Directory of the cube.
+
+        """
+        self.path = path
+        with open(os.path.join(self.path, 'cube.json')) as f:
+            self.meta = json.load(f)
+        self.height, self.width = self.meta['height'], self.meta['width']
+        self.chunk = self.meta['chunk']
+        self.dtype = np.dtype(self.meta['dtype'])
+        # Number of chunk rows and columns
+        self.chunks = (-(-self.height // self.chunk), -(-self.width // self.chunk))
+        # K=Date & V=memory-mapped chunks of the date
+        self.__dates: dict[str, np.memmap] = {}
+
+    @classmethod
+    def create(cls,
+               path: str,
+               geotiff_meta: dict,
+               chunk: int = 256) -> 'DataCube':
+        """Create an empty cube for rasters of the grid of :geotiff_meta:.
+
+        :path: Directory of the cube, created if missing.
+        :geotiff_meta: Meta data of a GeoTIFF of the time series (rasterio's meta).
+        :chunk: Edge length of the chunks in pixels.
+        :returns: The opened cube
+
+        """
+        os.makedirs(path, exist_ok=True)
+        meta = {'height': geotiff_meta['height'],
+                'width': geotiff_meta['width'],
+                'dtype': str(np.dtype(geotiff_meta['dtype'])),
+                'nodata': geotiff_meta.get('nodata'),
+                'crs': geotiff_meta['crs'].to_wkt() if geotiff_meta['crs'] else None,
+                'transform': tuple(geotiff_meta['transform'])[:6],
+                'chunk': chunk,
+                'dates': {}}
+        cube = cls.__new__(cls)
+        cube.path = path
+        cube.meta = meta
+        cube.__save_meta()
+        return cls(path)
+
+    @classmethod
+    def open_or_create(cls,
+                       path: str,
+                       geotiff_path: str,
+                       chunk: int = 256) -> 'DataCube':
+        """Open the cube at :path: or create it for the grid of :geotiff_path:."""
+        if os.path.exists(os.path.join(path, 'cube.json')):
+            return cls(path)
+        with rasterio.open(geotiff_path) as src:
+            return cls.create(path, src.meta, chunk)
+
+    def __save_meta(self) -> None:
+        # Write to a temporary file first, so readers never see partial files
+        tmp_path = os.path.join(self.path, 'cube.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, 'cube.json'))
+
+    @property
+    def dates(self) -> list[str]:
+        """Dates (YYYY-MM-DD) in the cube, chronologically."""
+        return sorted(self.meta['dates'])
+
+    @property
+    def geotiff_meta(self) -> dict:
+        """Meta data of a single channel GeoTIFF of the grid of the cube."""
+        return {'driver': 'GTiff',
+                'height': self.height,
+                'width': self.width,
+                'count': 1,
+                'dtype': str(self.dtype),
+                'nodata': self.meta['nodata'],
+                'crs': CRS.from_wkt(self.meta['crs']) if self.meta['crs'] else None,
+                'transform': Affine(*self.meta['transform'])}
+
+    def ingest(self,
+               geotiff_path: str,
+               date: str = None) -> bool:
+        """Add a GeoTIFF to the cube.
+
+        :geotiff_path: Path to a single channel GeoTIFF on the grid (shape, transform, CRS) and of the data type of the cube.
+        :date: Date (YYYY-MM-DD) of the GeoTIFF, retrieved from :geotiff_path: if None.
+        :returns: False if the date was already ingested from the same unchanged file, True otherwise
+
+        """
+        if date is None:
+            date = date_from_path(geotiff_path)
+        source = {'path': os.path.abspath(geotiff_path),
+                  'mtime': os.stat(geotiff_path).st_mtime_ns}
+        if self.meta['dates'].get(date) == source:
+            return False
+        with rasterio.open(geotiff_path) as src:
+            if (src.height, src.width) != (self.height, self.width) or \
+                    tuple(src.transform)[:6] != tuple(self.meta['transform']):
+                raise ValueError(f"'{geotiff_path}' doesn't match the grid of the cube '{self.path}'.")
+            crs = CRS.from_wkt(self.meta['crs']) if self.meta['crs'] else None
+            if src.crs != crs:
+                raise ValueError(f"The CRS of '{geotiff_path}' ({src.crs}) differs from the one of the cube '{self.path}' ({crs}).")
+            if np.dtype(src.dtypes[0]) != self.dtype:
+                raise ValueError(f"'{geotiff_path}' is {src.dtypes[0]}, the cube '{self.path}' holds {self.dtype}.")
+            tmp_path = os.path.join(self.path, f'{date}.npy.tmp')
+            chunks = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype,
+                                               shape=(*self.chunks, self.chunk, self.chunk))
+            # Decode one row of chunks at a time
+            padded = np.zeros((self.chunk, self.chunks[1] * self.chunk), dtype=self.dtype)
+            for chunk_row in range(self.chunks[0]):
+                row = chunk_row * self.chunk
+                height = min(self.chunk, self.height - row)
+                padded[:] = 0
+                padded[:height, :self.width] = src.read(1, window=Window(0, row, self.width, height))
+                chunks[chunk_row] = padded.reshape(self.chunk, self.chunks[1], self.chunk).transpose(1, 0, 2)
+            chunks.flush()
+            del chunks
+        os.replace(tmp_path, os.path.join(self.path, f'{date}.npy'))
+        self.__dates.pop(date, None)
+        self.meta['dates'][date] = source
+        self.__save_meta()
+        return True
+
+    def __chunks(self, date: str) -> np.memmap:
+        if date not in self.meta['dates']:
+            raise KeyError(f"Date {date} isn't in the cube '{self.path}', available are {self.dates}.")
+        if date not in self.__dates:
+            self.__dates[date] = np.load(os.path.join(self.path, f'{date}.npy'), mmap_mode='r')
+        return self.__dates[date]
+
+    def read(self,
+             date: str,
+             window: Window = None) -> npt.NDArray:
+        """Read a window of one date, only the chunks overlapping the window are read.
+
+        :date: Date (YYYY-MM-DD).
+        :window: Window to read, None reads the whole raster.
+        :returns: Array of the window
+
+        """
+        if window is None:
+            window = Window(0, 0, self.width, self.height)
+        col, row = int(window.col_off), int(window.row_off)
+        width, height = int(window.width), int(window.height)
+        chunks = self.__chunks(date)
+        # Chunks overlapping the window
+        rows = slice(row // self.chunk, -(-(row + height) // self.chunk))
+        cols = slice(col // self.chunk, -(-(col + width) // self.chunk))
+        selected = chunks[rows, cols]
+        n_rows, n_cols = selected.shape[:2]
+        # (chunk rows, chunk cols, chunk, chunk) -> (rows, cols) of pixels
+        pixels = selected.transpose(0, 2, 1, 3).reshape(n_rows * self.chunk, n_cols * self.chunk)
+        row_offset, col_offset = row - rows.start * self.chunk, col - cols.start * self.chunk
+        return pixels[row_offset:row_offset + height, col_offset:col_offset + width]
+
+    def series(self,
+               window: Window = None,
+               dates: list[str] = None) -> npt.NDArray:
+        """Read the time series of a window.
+
+        :window: Window to read, None reads the whole raster.
+        :dates: Dates to read, defaults to all dates (chronologically).
+        :returns: Array of shape (dates, height, width)
+
+        """
+        if dates is None:
+            dates = self.dates
+        return np.stack([self.read(date, window) for date in dates])
+
+    def difference(self,
+                   date1: str,
+                   date2: str,
+                   window: Window = None) -> npt.NDArray:
+        """Difference of two dates (:date2: minus :date1:), s. difference_dtype().
+
+        :date1: Older date (YYYY-MM-DD).
+        :date2: Newer date (YYYY-MM-DD).
+        :window: Window to read, None reads the whole raster.
+        :returns: Array of the window, int16 for uint8 cubes, int32 for uint16 cubes, ...
+
+        """
+        difference = self.read(date2, window).astype(difference_dtype(self.dtype))
+        difference -= self.read(date1, window)
+        return difference
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(prog='datacube')
+    commands = p.add_subparsers(dest='command', required=True)
+    ingest = commands.add_parser('ingest',
+                                 help='Ingest GeoTIFFs (the date is retrieved from their path), the cube is created if missing.')
+    ingest.add_argument('cube_dir', type=str)
+    ingest.add_argument('paths', nargs='+', type=str)
+    difference = commands.add_parser('difference',
+                                     help='Save the difference of two dates (date2 minus date1) as GeoTIFF (int16 for uint8 cubes, int32 for uint16 cubes).')
+    difference.add_argument('cube_dir', type=str)
+    difference.add_argument('date1', type=str)
+    difference.add_argument('date2', type=str)
+    difference.add_argument('out_path', type=str)
+    args = p.parse_args()
+
+    if args.command == 'ingest':
+        cube = DataCube.open_or_create(args.cube_dir, args.paths[0])
+        for path in args.paths:
+            if cube.ingest(path):
+                print(f'Ingested:\n\t{path}')
+            else:
+                print(f'Skipped (unchanged):\n\t{path}')
+    else:
+        cube = DataCube(args.cube_dir)
+        meta = cube.geotiff_meta
+        meta.update(dtype=str(difference_dtype(cube.dtype)), nodata=None)
+        with open_geotiff(args.out_path, meta) as dst:
+            dst.write(cube.difference(args.date1, args.date2), 1)
+        print(f'Saved:\n\t{args.out_path}')
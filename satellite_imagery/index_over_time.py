@@ -1,5 +1,4 @@
 import os
-import re
 import argparse
 import rasterio
 import numpy as np
@@ -10,6 +9,13 @@ from matplotlib.colors import LinearSegmentedColormap
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from itertools import pairwise
 from embed_geometry import embed_geometry
+from band_cache import band_cache
+from masks import rasterize_mask
+from colorize import colormap_lut, colorize
+from datacube import DataCube
+from time_series import date_from_path, pairwise_differences, temporal_statistics
+import instrumentation
+from instrumentation import stage
 
 
 p = argparse.ArgumentParser(prog='index_over_time')
@@ -17,28 +23,70 @@ p.add_argument('paths',
                help='Paths to the directories containing the indices to calculate their differences. Should be submitted chronologically from oldest to newest.',
                nargs='+',
                type=str)
+p.add_argument('--aoi',
+               help='Shapefile/GeoJSON of the area of interest, the mask is rasterized from it (s. masks.rasterize_mask()).',
+               default='./shapes_and_masks/munich/munich-bbox.shp',
+               type=str)
+p.add_argument('--differences',
+               help='Directory to save the differences of consecutive dates as GeoTIFFs in (calculated window by window).',
+               type=str)
+p.add_argument('--statistics',
+               help='Path to save per pixel statistics over time (mean, min, max, slope, anomaly, count of valid dates) as GeoTIFF (calculated window by window).',
+               type=str)
+p.add_argument('--baseline',
+               help='Dates (YYYY-MM-DD) of the baseline of the anomaly, defaults to all dates.',
+               nargs='+',
+               type=str)
+p.add_argument('--cube',
+               help='Directory of a datacube (s. datacube.py). The GeoTIFFs are ingested incrementally and the plot reads the dates from the cube.',
+               type=str)
+p.add_argument('--no-plot',
+               help='Only save the GeoTIFFs, the plot needs every image as a whole.',
+               action='store_true')
+p.add_argument('--trace',
+               help='Append the timing and memory of the stages to this file (JSON lines, s. instrumentation.py).',
+               type=str)
 args = p.parse_args()
-
+if args.trace is not None:
+    instrumentation.enable(args.trace)
+
+"""Datacube"""
+cube = None
+if args.cube is not None:
+    cube = DataCube.open_or_create(args.cube, args.paths[0])
+    for geotiff_path in args.paths:
+        with stage('index_over_time.ingest', path=geotiff_path):
+            cube.ingest(geotiff_path)
+
+"""Streamed results"""
+if args.differences is not None:
+    os.makedirs(args.differences, exist_ok=True)
+    with stage('index_over_time.differences', dates=len(args.paths)):
+        out_paths = pairwise_differences(args.paths, args.differences)
+    print('Saved:', *out_paths, sep='\n\t')
+if args.statistics is not None:
+    with stage('index_over_time.statistics', dates=len(args.paths)):
+        out_path = temporal_statistics(args.paths, args.statistics, args.baseline)
+    print(f'Saved:\n\t{out_path}')
+if args.no_plot:
+    raise SystemExit
+
+# Images are read pair by pair in the plot loop (not all at once)
+geotiff_paths = list(reversed(args.paths))
 dates = []
-ndvis = []
 meta = None
 
 # Reversed order because iterating pairwise and
 # substracting "the latter from the former" is done
 # first. This guarantees consistency with enumerate().
-for geotiff_path in reversed(args.paths):
-    geotiff = rasterio.open(geotiff_path)
+for geotiff_path in geotiff_paths:
     # Save meta data, used for embedding the boundary of Munich
     if meta is None:
-        meta = geotiff.meta
-    data = geotiff.read(1).astype(np.uint16)
-    ndvis.append(data)
+        with rasterio.open(geotiff_path) as geotiff:
+            meta = geotiff.meta
 
     # Retrieve date from the geotiff_path
-    compounds = geotiff_path.split('_')
-    m = re.search(r'\d{4}-\d{2}-\d{2}', geotiff_path)
-    date = m.group(0)
-    dates.append(date)
+    dates.append(date_from_path(geotiff_path))
 
 
 """Configure plot in general"""
@@ -63,16 +111,33 @@ axs = tuple(fig.add_subplot(gs[0, i])
 
 
 """Plot difference"""
+# Mask of the area of interest, the same for all pairs
+with stage('index_over_time.mask'):
+    mask = rasterize_mask(args.aoi,
+                          meta['transform'],
+                          (meta['height'], meta['width']),
+                          meta['crs'])
 # Here becomes reversed iterating over args.paths important
-for i, data_pair in enumerate(pairwise(zip(ndvis, dates))):
+for i, data_pair in enumerate(pairwise(zip(geotiff_paths, dates))):
     """Calculate ndvi difference"""
     # numbering reflects chronologic order of the data
-    index2, date2 = data_pair[0]
-    index1, date1 = data_pair[1]
-    diff = index2 - index1
-    # Map [-255, 255] onto [0, 1]
-    diff = diff + 255
-    diff = diff / 510
+    path2, date2 = data_pair[0]
+    path1, date1 = data_pair[1]
+    with stage('index_over_time.read', dates=(date1, date2)):
+        if cube is None:
+            index2 = band_cache.read(path2).astype(np.uint16)
+            index1 = band_cache.read(path1)
+        else:
+            index2 = cube.read(date2).astype(np.uint16)
+            index1 = cube.read(date1)
+    # Map [-255, 255] onto [0, 1] and quantize it for the colormap, ie.
+    # (index2 - index1 + 255) / 510 * 255, done in integer math
+    # (index2 + 255 >= index1, so uint16 doesn't wrap)
+    with stage('index_over_time.difference', dates=(date1, date2)):
+        diff = index2 + 255
+        diff -= index1
+        diff //= 2
+        diff = diff.astype(np.uint8)
 
     """Difference may be negativ in the first place. Negative values imply
     decreased vegetation health. By mapping onto [0, 1] to apply the colormap
@@ -81,10 +146,9 @@ for i, data_pair in enumerate(pairwise(zip(ndvis, dates))):
 
     """Apply colormap and mask"""
     cmap = LinearSegmentedColormap.from_list("", ['red', "lightgray", 'green'])
-    cmap_diff = cmap(diff)
     # Replace alpha channel by mask to visually remove patches outside area of interest
-    mask = np.load('./shapes_and_masks/munich/munich-bbox.npy')
-    cmap_diff[:, :, 3] = mask
+    with stage('index_over_time.colorize', dates=(date1, date2)):
+        cmap_diff = colorize(diff, colormap_lut(cmap), mask)
 
     ax = axs[i]
     ax.axis('off')
@@ -92,13 +156,14 @@ for i, data_pair in enumerate(pairwise(zip(ndvis, dates))):
     # ax.imshow(cmap_diff) doesn't work because geographical information is lost
     # Rasterio preserves them.
     # => Adding further geo information like boundary with geopandas possible
-    show(cmap_diff.transpose(2, 0, 1),
-         transform=meta['transform'],
-         ax=ax)
-    # TODO: Add condition <08-09-2023>
-    if True:
-        geom_file = './shapes_and_masks/munich/munich-ds.shp'
-        embed_geometry(geom_file, ax)
+    with stage('index_over_time.render', dates=(date1, date2)):
+        show(cmap_diff.transpose(2, 0, 1),
+             transform=meta['transform'],
+             ax=ax)
+        # TODO: Add condition <08-09-2023>
+        if True:
+            geom_file = './shapes_and_masks/munich/munich-ds.shp'
+            embed_geometry(geom_file, ax)
 
 
 """Add a common colorbar for both matrices in the second row (horizontal)"""
@@ -130,7 +195,8 @@ except FileExistsError:
     pass
 dates_str = '_'.join(reversed(dates))
 path_to_image = os.path.join(out_dir, f'ndvi_difference_bbox_{dates_str}.png')
-plt.savefig(path_to_image)
+with stage('index_over_time.save'):
+    plt.savefig(path_to_image)
 
 
 # """Save as GeoTIFF to preserve geographical metadata"""
@@ -0,0 +1,231 @@
+"""
+Per stage timing and memory instrumentation of the processing pipeline (reading bands, index math, colormapping, rendering, writing GeoTIFFs).
+
+Stages are marked in the code with the context manager stage() or the decorator traced(). If tracing is enabled every stage appends one JSON line to the trace file:
+  - stage, parent (enclosing stage of the same thread), pid, start (Unix time) and the fields passed to the stage
+  - wall_s and cpu_s (CPU time of the thread)
+  - read_bytes and written_bytes: Bytes read/written by the process during the stage (Linux only, /proc/self/io, ie. all threads)
+  - rss_mb: Resident memory after the stage, peak_rss_mb: Peak of the process so far and peak_rss_increase_mb: How much the stage raised the peak (0 unless the stage needed more memory than all stages before)
+Tracing is enabled via the environment variable EO_TRACE=<trace file> or enable() (f.i. `--trace` of the scripts), processes of pools inherit it. If disabled, stage() returns a shared no-op object and traced() calls the function directly, ie. the overhead is one global lookup.
+
+Usage:
+    with stage('index.colorize', index='NDVI'):
+        ...
+
+    @traced('index.calculate')
+    def calculate(self, ...):
+        ...
+
+    EO_TRACE=trace.jsonl python make_rgb.py <band_dir>
+    python instrumentation.py trace.jsonl  # Summary per stage
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import functools
+import threading
+from collections import defaultdict
+
+TRACE_ENV = 'EO_TRACE'
+# ru_maxrss is in KiB on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_trace_path = os.environ.get(TRACE_ENV) or None
+# File descriptor of the trace file and the process it belongs to (reopened after a fork)
+_fd, _fd_pid = None, None
+_fd_lock = threading.Lock()
+# Stack of the open stages per thread
+_local = threading.local()
+
+
+def enable(path: str) -> None:
+    """Append the stages to :path: (JSON lines), also in processes started afterwards."""
+    global _trace_path
+    _trace_path = os.path.abspath(path)
+    os.environ[TRACE_ENV] = _trace_path
+
+
+def disable() -> None:
+    global _trace_path, _fd
+    _trace_path = None
+    os.environ.pop(TRACE_ENV, None)
+    with _fd_lock:
+        if _fd is not None:
+            os.close(_fd)
+            _fd = None
+
+
+def enabled() -> bool:
+    return _trace_path is not None
+
+
+def _io_counters() -> tuple[int, int]:
+    """Bytes read and written by the process (rchar/wchar of /proc/self/io), (0, 0) if unavailable."""
+    try:
+        with open('/proc/self/io', 'rb') as f:
+            counters = dict(line.split(b':') for line in f.read().splitlines())
+        return int(counters[b'rchar']), int(counters[b'wchar'])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _rss() -> int:
+    """Current resident memory of the process in bytes, 0 if unavailable."""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _peak_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+def _write(record: dict) -> None:
+    """Append :record: as one line, a single write() on an O_APPEND file keeps lines of several processes intact."""
+    global _fd, _fd_pid
+    line = (json.dumps(record) + '\n').encode()
+    with _fd_lock:
+        if _fd is None or _fd_pid != os.getpid():
+            _fd = os.open(_trace_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _fd_pid = os.getpid()
+        os.write(_fd, line)
+
+
+class Stage():
+    """Measures one execution of a stage, s. stage()."""
+
+    __slots__ = ('name', 'fields', '_start', '_wall', '_cpu', '_io', '_peak')
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+
+    def add(self, **fields) -> None:
+        """Add fields to the record, f.i. the number of pixels known inside the stage."""
+        self.fields.update(fields)
+
+    def __enter__(self) -> 'Stage':
+        if not hasattr(_local, 'stack'):
+            _local.stack = []
+        _local.stack.append(self.name)
+        self._start = time.time()
+        self._io = _io_counters()
+        self._peak = _peak_rss()
+        self._cpu = time.thread_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        read, written = _io_counters()
+        peak = _peak_rss()
+        _local.stack.pop()
+        record = {'stage': self.name,
+                  'parent': _local.stack[-1] if _local.stack else None,
+                  'pid': os.getpid(),
+                  'start': self._start,
+                  'wall_s': wall,
+                  'cpu_s': cpu,
+                  'read_bytes': read - self._io[0],
+                  'written_bytes': written - self._io[1],
+                  'rss_mb': _rss() / 2**20,
+                  'peak_rss_mb': peak / 2**20,
+                  'peak_rss_increase_mb': (peak - self._peak) / 2**20,
+                  **self.fields}
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _write(record)
+        return False
+
+
+class _NullStage():
+    """Returned by stage() if tracing is disabled."""
+
+    __slots__ = ()
+
+    def add(self, **fields) -> None:
+        pass
+
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name: str, **fields):
+    """Context manager measuring the enclosed code as stage :name: (f.i. 'index.calculate').
+
+    :name: Name of the stage, '<component>.<step>'.
+    :fields: Added to the record, f.i. index='NDVI'.
+    :returns: A Stage (fields can be added with add()) or a no-op object if tracing is disabled
+
+    """
+    if _trace_path is None:
+        return _NULL_STAGE
+    return Stage(name, fields)
+
+
+def traced(name: str):
+    """Decorator measuring every call of the function as stage :name: (s. stage()).
+
+    Whether tracing is enabled is checked per call, so functions decorated at import time are traced after enable().
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _trace_path is None:
+                return func(*args, **kwargs)
+            with Stage(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def summarize(trace_path: str) -> list[dict]:
+    """Aggregate a trace file per stage.
+
+    :trace_path: Path of the trace file.
+    :returns: Per stage (in order of the total wall time): 'stage', 'calls', 'wall_s', 'cpu_s', 'read_mb', 'written_mb', 'peak_rss_mb' (maximum) and 'peak_rss_increase_mb' (sum)
+
+    """
+    stages = defaultdict(lambda: defaultdict(float))
+    with open(trace_path) as f:
+        for line in f:
+            record = json.loads(line)
+            summary = stages[record['stage']]
+            summary['calls'] += 1
+            summary['wall_s'] += record['wall_s']
+            summary['cpu_s'] += record['cpu_s']
+            summary['read_mb'] += record['read_bytes'] / 2**20
+            summary['written_mb'] += record['written_bytes'] / 2**20
+            summary['peak_rss_mb'] = max(summary['peak_rss_mb'], record['peak_rss_mb'])
+            summary['peak_rss_increase_mb'] += record['peak_rss_increase_mb']
+    summaries = [{'stage': name, **summary} for name, summary in stages.items()]
+    return sorted(summaries, key=lambda summary: summary['wall_s'], reverse=True)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser('instrumentation')
+    p.add_argument('trace',
+                   help='Trace file (JSON lines) written with EO_TRACE=<trace file> or --trace.',
+                   type=str)
+    args = p.parse_args()
+
+    print(f"{'stage':32} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'read MB':>9} {'written MB':>10} {'peak RSS MB':>11} {'+peak MB':>9}")
+    for summary in summarize(args.trace):
+        print(f"{summary['stage']:32} {int(summary['calls']):6} {summary['wall_s']:9.3f} {summary['cpu_s']:9.3f} "
+              f"{summary['read_mb']:9.1f} {summary['written_mb']:10.1f} {summary['peak_rss_mb']:11.1f} "
+              f"{summary['peak_rss_increase_mb']:9.1f}")
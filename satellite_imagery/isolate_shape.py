@@ -2,7 +2,7 @@
 Corps a geometry saved as a shapefile from a GeoTIFF.
 
 Usage:
-    python isolate_shape.py <GeoTIFF> <Shapefile>
+    python isolate_shape.py <GeoTIFF> <Shapefile> [--trace trace.jsonl]
 
 """
 
@@ -11,7 +11,9 @@ from rasterio.mask import mask
 import rasterio
 import fiona
 import argparse
-import numpy as np
+from masks import save_mask
+import instrumentation
+from instrumentation import stage
 
 p = argparse.ArgumentParser("isolate_shape")
 p.add_argument("geotiff",
@@ -29,10 +31,15 @@ p.add_argument("mask_path",
                help="Path to save the mask resembling the geometry",
                nargs='?',
                type=str)
+p.add_argument("--trace",
+               help="Append the timing and memory of the stages to this file (JSON lines, s. instrumentation.py).",
+               type=str)
 args = p.parse_args()
+if args.trace is not None:
+    instrumentation.enable(args.trace)
 
 # Load geometry (of Munich)
-with fiona.open(args.shapefile) as shapefile:
+with stage('isolate_shape.read_geometry'), fiona.open(args.shapefile) as shapefile:
     geometry = [feature["geometry"] for feature in shapefile]
 
 # load the raster, mask it by the polygon and crop it
@@ -49,7 +56,7 @@ except FileExistsError:  # Error occurs when <out_dir> exists; this is nothing t
 #   displayed as black).
 #   This is not desirable because this value might occure within the shape
 #   and decreases accuracy.
-with rasterio.open(args.geotiff, 'r') as src:
+with stage('isolate_shape.mask'), rasterio.open(args.geotiff, 'r') as src:
     # out_image, out_transform = mask(src, geometry, crop=True)
     out_image, out_transform = mask(src, geometry, crop=True, filled=False)
 
@@ -64,12 +71,14 @@ out_meta.update({"driver": "GTiff",
 
 # <image_name> ends in .TIF, no extension needed
 out_image_name = os.path.join(out_dir, f"{args.file_prefix}_{image_name}")
-with rasterio.open(out_image_name, "w", **out_meta) as dest:
+with stage('isolate_shape.write'), rasterio.open(out_image_name, "w", **out_meta) as dest:
     dest.write(out_image)
 
 # Save the mask (for further calculations as in './ndvi.py')
 if args.mask_path is not None:
     out_mask = out_image.mask[0]
     # <~out_mask> inverts masks (I need it vice versa than provided by rasterio)
-    np.save(args.mask_path, ~out_mask)
+    # Saved bit-packed, load it with masks.load_mask()
+    with stage('isolate_shape.save_mask'):
+        save_mask(args.mask_path, ~out_mask)
     # show(source=out_image.data, alpha=a)
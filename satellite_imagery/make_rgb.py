@@ -1,28 +1,180 @@
 """
-Reads image of band {red, green, blue} in <args.band_dir> (i.e., all images have to be transfered there beforehand) and combines them to an RGB image. This saved under '<args.band_dir>/out/combined_bands.tif'.
+Reads the bands of a composite (f.i. {red, green, blue}) in <band_dir> (i.e., all images have to be transfered there beforehand) and combines them to an RGB image. This saved under '<band_dir>/out/combined_bands.tif' (true color) or '<band_dir>/out/combined_<band>_<band>_<band>.tif'.
+
+The bands are read, stretched (s. adjust_values.py) and written window by window into a tiled, compressed uint8 GeoTIFF, ie. the scene is never loaded as a whole. The stretch limits are either fixed (7000-16000 like the original template) or percentiles per band from a decimated read of the band (--percentiles 2 98). Any three bands can be combined (false color, SWIR, ...) and several scene directories are processed in parallel.
+
+Usage:
+    python make_rgb.py <band_dir> [<band_dir> ...] [--composite false_color | --bands B7 B5 B4] [--percentiles 2 98] [--trace trace.jsonl]
 """
 
-import rasterio
+import os
 import argparse
-from adjust_values import adjust_values
-from read_write_functions import bands_to_array, create_out_dir
+import rasterio
+import numpy as np
+import numpy.typing as npt
+from concurrent.futures import ProcessPoolExecutor
+from adjust_values import adjust_values, percentile_limits
+from read_write_functions import find_band_files, create_out_dir, open_geotiff, split_windows
+import instrumentation
+from instrumentation import stage
+
+# Landsat 8 band combinations (red, green, blue)
+COMPOSITES = {'true_color': ('B4', 'B3', 'B2'),
+              'false_color': ('B5', 'B4', 'B3'),  # Vegetation in red
+              'swir': ('B7', 'B5', 'B4'),  # Burned areas, geology
+              'agriculture': ('B6', 'B5', 'B2'),
+              'land_water': ('B5', 'B6', 'B4')}
+
+
+def stretch_limits(band_files: list[str],
+                   percentiles: tuple[float, float],
+                   sample_size: int = 1024) -> tuple[npt.NDArray, npt.NDArray]:
+    """Per band stretch limits from percentiles of a decimated read (uses overviews if present).
+
+    :band_files: Paths to the TIFF-files of the bands.
+    :percentiles: Lower and upper percentile, f.i. (2, 98).
+    :sample_size: Edge length (in pixels) of the longer side of the decimated read.
+    :returns: Arrays of the mins and maxs (one per band)
+
+    """
+    samples = []
+    for band_file in band_files:
+        with rasterio.open(band_file) as src:
+            factor = max(1, -(-max(src.height, src.width) // sample_size))
+            samples.append(src.read(1, out_shape=(-(-src.height // factor), -(-src.width // factor))))
+    lower, upper = percentiles
+    return percentile_limits(np.stack(samples), lower, upper, step=1)
+
+
+def make_composite(band_dir: str,
+                   bands: tuple[str, str, str] = COMPOSITES['true_color'],
+                   limits: tuple[float, float] = (7000, 16000),
+                   percentiles: tuple[float, float] = None,
+                   out_path: str = None,
+                   tile_size: int = 512,
+                   cog: bool = False,
+                   compress: str = 'deflate') -> str:
+    """Combine three bands to an RGB GeoTIFF (uint8) window by window.
+
+    :band_dir: Directory containing one TIFF-file per band.
+    :bands: Bands mapped onto red, green and blue, f.i. ('B5', 'B4', 'B3') (s. COMPOSITES).
+    :limits: Values mapped onto 0 and 255 (s. adjust_values()) for all bands. Ignored if :percentiles: is given.
+    :percentiles: Lower and upper percentile mapped onto 0 and 255, determined per band (s. stretch_limits()).
+    :out_path: Path of the composite, defaults to '<band_dir>/out/combined_bands.tif' (true color) or '<band_dir>/out/combined_<bands>.tif'.
+    :tile_size: Edge length of the windows and the tiles of the GeoTIFF, a positive multiple of 16 (required by GeoTIFF tiles).
+    :cog: Save the composite as Cloud-Optimized GeoTIFF (with overviews), s. open_geotiff().
+    :compress: Compression of the GeoTIFF, f.i. 'deflate', 'zstd' or 'lzw'.
+    :returns: Path of the composite
+
+    """
+    if tile_size <= 0 or tile_size % 16:
+        raise ValueError(f'The tile size has to be a positive multiple of 16, got {tile_size}.')
+    band_files = find_band_files(band_dir, bands)
+    if percentiles is not None:
+        with stage('make_rgb.limits', band_dir=band_dir):
+            mins, maxs = stretch_limits(band_files, percentiles)
+    else:
+        mins, maxs = limits
+    if out_path is None:
+        name = 'combined_bands' if tuple(bands) == COMPOSITES['true_color'] else f"combined_{'_'.join(bands)}"
+        out_path = os.path.join(create_out_dir(band_dir), f'{name}.tif')
+    # The composite only appears at :out_path: when it is complete, a failed
+    # run never leaves a truncated file behind
+    tmp_path = f'{out_path}.tmp.tif'
+
+    sources = [rasterio.open(band_file) for band_file in band_files]
+    try:
+        out_meta = sources[0].meta.copy()
+        out_meta.update(driver='GTiff', count=3, dtype=rasterio.uint8, nodata=None, photometric='RGB')
+        if not cog:
+            out_meta.update(tiled=True, blockxsize=tile_size, blockysize=tile_size, compress=compress)
+        # Includes the conversion into a COG when open_geotiff() is left
+        with stage('make_rgb.composite', band_dir=band_dir, cog=cog), \
+                open_geotiff(tmp_path, out_meta, cog, compress, blocksize=tile_size) as dst:
+            for window in split_windows(band_files[0], tile_size):
+                with stage('make_rgb.read'):
+                    data = np.stack([src.read(1, window=window) for src in sources])
+                with stage('make_rgb.stretch'):
+                    rgb = adjust_values(data, mins, maxs)
+                with stage('make_rgb.write'):
+                    dst.write(rgb, window=window)
+        os.replace(tmp_path, out_path)
+    finally:
+        for src in sources:
+            src.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return out_path
+
 
-# TODO: adjust band values individually to control the influence of a band <17-08-2023>
+def make_composites(band_dirs: list[str],
+                    workers: int = None,
+                    **kwargs) -> list[str]:
+    """Combine the bands of several scene directories in parallel (one process per directory).
 
-p = argparse.ArgumentParser("compose_bands")
-p.add_argument("band_dir",
-               help="Directory containing the images for composing.",
-               type=str)
-args = p.parse_args()
+    :band_dirs: Directories containing one TIFF-file per band.
+    :workers: Number of processes, defaults to the number of CPUs. 1 runs in this process.
+    :kwargs: Passed to make_composite() (except :out_path:).
+    :returns: Paths of the composites
 
-band_order = ('B4', 'B3', 'B2')
-bands, out_meta = bands_to_array(args.band_dir, band_order)
+    """
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(band_dirs) == 1:
+        return [make_composite(band_dir, **kwargs) for band_dir in band_dirs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(band_dirs))) as executor:
+        futures = [executor.submit(make_composite, band_dir, **kwargs) for band_dir in band_dirs]
+        return [future.result() for future in futures]
 
-bands = adjust_values(bands, 7000, 16000)
 
-# Create output directory to save the produced image in
-out_dir = create_out_dir(args.image_dir)
+if __name__ == '__main__':
+    p = argparse.ArgumentParser("compose_bands")
+    p.add_argument("band_dirs",
+                   help="Directories containing the images for composing (one composite per directory).",
+                   nargs='+',
+                   type=str)
+    bands = p.add_mutually_exclusive_group()
+    bands.add_argument("--composite",
+                       help="Predefined band combination.",
+                       choices=COMPOSITES,
+                       default='true_color')
+    bands.add_argument("--bands",
+                       help="Bands mapped onto red, green and blue, f.i. 'B7 B5 B4'.",
+                       nargs=3,
+                       type=str)
+    stretch = p.add_mutually_exclusive_group()
+    stretch.add_argument("--limits",
+                         help="Values mapped onto 0 and 255 for all bands.",
+                         nargs=2,
+                         default=(7000, 16000),
+                         type=int)
+    stretch.add_argument("--percentiles",
+                         help="Lower and upper percentile mapped onto 0 and 255, determined per band, f.i. '2 98'.",
+                         nargs=2,
+                         type=float)
+    p.add_argument("--workers",
+                   help="Number of processes, defaults to the number of CPUs.",
+                   type=int)
+    p.add_argument("--cog",
+                   help="Save the composite as Cloud-Optimized GeoTIFF (tiled, compressed, with overviews).",
+                   action='store_true')
+    p.add_argument("--compress",
+                   help="Compression of the composite.",
+                   default='deflate',
+                   choices=('deflate', 'zstd', 'lzw'),
+                   type=str)
+    p.add_argument("--trace",
+                   help="Append the timing and memory of the stages to this file (JSON lines, s. instrumentation.py).",
+                   type=str)
+    args = p.parse_args()
+    if args.trace is not None:
+        instrumentation.enable(args.trace)
 
-# save combined bands
-with rasterio.open(f'{out_dir}/combined_bands.tif', 'w', **out_meta) as m:
-    m.write(bands)
+    out_paths = make_composites(args.band_dirs,
+                                args.workers,
+                                bands=tuple(args.bands or COMPOSITES[args.composite]),
+                                limits=tuple(args.limits),
+                                percentiles=args.percentiles,
+                                cog=args.cog,
+                                compress=args.compress)
+    for out_path in out_paths:
+        print(f'Created:\n\t{out_path}')
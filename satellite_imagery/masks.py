@@ -0,0 +1,137 @@
+"""
+Saving and loading masks of areas of interest (boolean arrays, True inside the area).
+
+Masks are saved bit-packed along the rows (np.packbits), ie. 1 bit instead of 1 byte per pixel. Loaded masks are memory-mapped and cached for the whole process, so plotting several indices or image pairs touches the file only once. Masks saved unpacked by former versions of isolate_shape.py ('.npy' of bools) can still be loaded.
+
+Masks don't have to be cropped from a GeoTIFF (isolate_shape.py): rasterize_mask() rasterizes the geometries of a shapefile/GeoJSON directly onto the grid (transform and shape) of a raster without reading any pixel data. Rasterized masks are cached in <mask_cache_dir> by a hash of the geometries and the grid.
+
+Usage (pack masks saved by former versions):
+    python masks.py <mask.npy> [<mask.npy> ...]
+"""
+
+import os
+import hashlib
+import argparse
+import shapely
+import geopandas as gpd
+import numpy as np
+import numpy.typing as npt
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+
+# K=(Absolute path, modification time) & V=memory-mapped (packed) mask
+_masks: dict[tuple[str, int], np.memmap] = {}
+# K=(Absolute path, modification time, CRS) & V=geometries of the file
+_geometries: dict[tuple, npt.NDArray] = {}
+# Directory of the masks rasterized by rasterize_mask()
+mask_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'earth-observation', 'masks')
+
+
+def save_mask(path: str,
+              mask: npt.NDArray) -> None:
+    """Save a boolean mask bit-packed.
+
+    :path: Path of the mask, '.npy' is appended if missing (like np.save()).
+    :mask: 2D array, True inside the area of interest.
+    :returns: None
+
+    """
+    np.save(path, np.packbits(np.asarray(mask, dtype=bool), axis=-1))
+
+
+def load_mask(path: str,
+              shape: tuple[int, int]) -> npt.NDArray:
+    """Load a mask, cached and memory-mapped.
+
+    :path: Path of the mask ('.npy').
+    :shape: Shape (height, width) of the raster the mask belongs to. Needed to unpack the mask, it is also checked against the mask.
+    :returns: Boolean array of :shape:, True inside the area of interest
+
+    """
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    if key not in _masks:
+        _masks[key] = np.load(path, mmap_mode='r')
+    stored = _masks[key]
+    height, width = shape
+    if stored.dtype == bool:  # Unpacked mask
+        mask = stored
+    elif stored.shape == (height, (width + 7) // 8):
+        mask = np.unpackbits(stored, axis=-1, count=width).view(bool)
+    else:
+        mask = None
+    if mask is None or mask.shape != (height, width):
+        raise ValueError(f"Mask '{path}' doesn't fit a raster of shape {shape}.")
+    return mask
+
+
+def read_geometries(geometry_file: str,
+                    crs: CRS = None) -> npt.NDArray:
+    """Read (and cache) the geometries of a shapefile/GeoJSON.
+
+    :geometry_file: Path to the shapefile/GeoJSON.
+    :crs: CRS to transform the geometries into, f.i. the CRS of the raster. None keeps the CRS of the file.
+    :returns: Array of shapely geometries
+
+    """
+    crs_key = crs.to_wkt() if crs is not None else None
+    key = (os.path.abspath(geometry_file), os.stat(geometry_file).st_mtime_ns, crs_key)
+    if key not in _geometries:
+        gdf = gpd.read_file(geometry_file)
+        if crs is not None and gdf.crs is not None:
+            gdf = gdf.to_crs(crs)
+        _geometries[key] = gdf.geometry.values.to_numpy()
+    return _geometries[key]
+
+
+def rasterize_mask(geometry_file: str,
+                   transform: Affine,
+                   shape: tuple[int, int],
+                   crs: CRS = None,
+                   all_touched: bool = False) -> npt.NDArray:
+    """Mask of the geometries of a shapefile/GeoJSON on the grid of a raster, without reading the raster.
+
+    Equals the mask saved by isolate_shape.py for a GeoTIFF cropped to the geometries. The mask is cached in <mask_cache_dir> by a hash of the geometries and the grid, ie. it is rasterized once per geometry and grid.
+
+    :geometry_file: Path to the shapefile/GeoJSON.
+    :transform: Affine transform of the raster.
+    :shape: Shape (height, width) of the raster.
+    :crs: CRS of the raster, the geometries are transformed into it.
+    :all_touched: Include all pixels touched by the geometries, not only those whose center is within.
+    :returns: Boolean array of :shape:, True inside the geometries
+
+    """
+    geometries = read_geometries(geometry_file, crs)
+    digest = hashlib.sha1()
+    for geometry in shapely.to_wkb(geometries):
+        digest.update(geometry)
+    digest.update(repr((tuple(transform)[:6], tuple(shape), all_touched)).encode())
+    path = os.path.join(mask_cache_dir, f'{digest.hexdigest()}.npy')
+    if not os.path.exists(path):
+        mask = geometry_mask(geometries,
+                             out_shape=shape,
+                             transform=transform,
+                             all_touched=all_touched,
+                             invert=True)
+        os.makedirs(mask_cache_dir, exist_ok=True)
+        # Write to a temporary file first, so readers never see partial files
+        tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+        save_mask(tmp_path, mask)
+        os.replace(tmp_path, path)
+    return load_mask(path, shape)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(prog='masks')
+    p.add_argument('paths',
+                   help='Paths to unpacked masks (boolean .npy), they are overwritten by their packed version.',
+                   nargs='+',
+                   type=str)
+    args = p.parse_args()
+    for path in args.paths:
+        mask = np.load(path)
+        if mask.dtype != bool:
+            print(f'Skipped (not an unpacked mask):\n\t{path}')
+            continue
+        save_mask(path, mask)
+        print(f'Packed:\n\t{path}')
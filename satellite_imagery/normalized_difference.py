@@ -0,0 +1,45 @@
+'''
+Normalized Difference
+In a nutshell: Calculate (a - b) / (a + b) with as few full size temporaries as possible.
+
+NDVI, NDWI and most other indices are normalized differences of two bands. The
+naive expression
+    np.divide(a - b, a + b + eps)
+allocates three temporaries (a - b, a + b, a + b + eps) and the result. The kernel
+below writes the difference directly into the output and reuses one temporary for
+the sum, ie. it needs half of the memory traffic.
+
+Precision
+The bands are uint16 (Landsat DN values). Every uint16 value, their difference and
+their sum (< 2^24) are exactly representable in float32, so in float32 the numerator
+and denominator are exact, ie. identical to integer math. Only the division rounds:
+    |nd_float32 - nd_float64| <= 2^-24 * |nd| + 2^-52 < 6e-8   (|nd| <= 1)
+For the NDVI (clipped onto [0, 1]) this is the error bound against the former float64
+results. The NDWI is additionally scaled by its maximum and multiplied by 10, adding
+three roundings, ie. the relative error stays below 4 * 2^-24 < 2.4e-7 (absolute
+< 2.4e-6 on [0, 10]). Scaled to uint8 ('sc_'-GeoTIFF) a value in [0, 1] differs by
+at most 1 where <index * 255> is close to an integer (the cast truncates).
+(eps, the machine epsilon of float64, only matters for a + b == 0; then the result
+is 0 in both precisions.)
+    '''
+
+import numpy as np
+import numpy.typing as npt
+
+
+def normalized_difference(a: npt.NDArray,
+                          b: npt.NDArray,
+                          out: npt.NDArray = None) -> npt.NDArray:
+    """Calculate (a - b) / (a + b + eps) in the precision of :a: and :b:.
+
+    :a: First band, f.i. the near infrared for the NDVI.
+    :b: Second band, f.i. red for the NDVI.
+    :out: Preallocated output array (same shape as the bands), created if None. May be :a: or :b: if they aren't needed anymore.
+    :returns: :out: holding the normalized difference
+
+    """
+    # Sum first, <out> may be <a> or <b>
+    denominator = np.add(a, b)
+    denominator += np.finfo(float).eps
+    out = np.subtract(a, b, out=out)
+    return np.divide(out, denominator, out=out)
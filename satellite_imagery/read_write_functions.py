@@ -0,0 +1,119 @@
+"""
+Helper functions to locate, read and write the band files of a scene.
+
+A scene directory (f.i. './USGS/image_working_dir/ndvi_2022-05-15') contains one TIFF-file per band, the band is encoded in the file name, f.i. 'LC08_..._B4.TIF'.
+"""
+
+import os
+import contextlib
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
+
+
+def find_band_files(img_dir: str,
+                    band_order: tuple[str, ...]) -> tuple[str, ...]:
+    """Find the TIFF-files holding the bands specified in :band_order: (keeping the order).
+
+    :img_dir: Directory containing one TIFF-file per band.
+    :band_order: Bands to look for, f.i. ('B4', 'B5'). A file belongs to the first band of :band_order: its name contains.
+    :returns: Tuple of paths to the TIFF-files in the order of :band_order:
+
+    """
+    band_files = {}
+    for file in sorted(os.listdir(img_dir)):
+        # Skip <out>-directory, ie. only iterate over TIFF-files
+        if not file.endswith(('.tif', '.TIF')):
+            continue
+        for b in band_order:
+            if b in file:
+                band_files[b] = os.path.join(img_dir, file)
+                break
+    missing = [b for b in band_order if b not in band_files]
+    if missing:
+        raise FileNotFoundError(f"No TIFF-file for band(s) {missing} in '{img_dir}'.")
+    return tuple(band_files[b] for b in band_order)
+
+
+def create_out_dir(img_dir: str) -> str:
+    """Create the output directory ':img_dir:/out' for the produced image.
+
+    :img_dir: The directory to create an 'out' dir in. Usually, the image for processing are suited in :img_dir:.
+    :returns: Path of the created directory
+
+    """
+    out_dir = f'{img_dir}/out'
+    try:
+        os.mkdir(out_dir)
+        print(f'Created:\n\t{out_dir}')
+    except FileExistsError:  # Error occurs when <out_dir> exists; this is nothing to worry about
+        pass
+    return out_dir
+
+
+def split_windows(band_file: str,
+                  tile_size: int = None) -> list[Window]:
+    """Splits a band into windows for block wise processing.
+
+    :band_file: Path to the TIFF-file of the band.
+    :tile_size: Edge length of square tiles in pixels. If None, the internal block windows of the band are used (reading them doesn't decode any block twice).
+    :returns: List of windows covering the whole band
+
+    """
+    with rasterio.open(band_file) as src:
+        if tile_size is None:
+            return [window for _, window in src.block_windows(1)]
+        height, width = src.height, src.width
+    return [Window(col, row,
+                   min(tile_size, width - col),
+                   min(tile_size, height - row))
+            for row in range(0, height, tile_size)
+            for col in range(0, width, tile_size)]
+
+
+@contextlib.contextmanager
+def open_geotiff(path: str,
+                 meta: dict,
+                 cog: bool = False,
+                 compress: str = 'deflate',
+                 blocksize: int = 512,
+                 overview_resampling: str = 'average'):
+    """Open a GeoTIFF for writing, optionally as Cloud-Optimized GeoTIFF (COG).
+
+    Without :cog: the GeoTIFF is written with :meta: unchanged (like before). A COG is internally tiled, compressed (with predictor) and contains overviews, so viewers and tiling services only need to (range) read the tiles and resolution they display. The data is written into an uncompressed tiled temporary file first (windows may be written in any order) and converted into a COG when the context is left.
+
+    :path: Path of the GeoTIFF.
+    :meta: Meta data/profile of the GeoTIFF, f.i. the meta data of the source image.
+    :cog: Write a Cloud-Optimized GeoTIFF.
+    :compress: Compression of the COG: 'deflate', 'zstd' or 'lzw'.
+    :blocksize: Edge length of the internal tiles of the COG.
+    :overview_resampling: Resampling method of the overviews.
+    :returns: Context manager yielding the opened dataset
+
+    """
+    if not cog:
+        with rasterio.open(path, 'w', **meta) as dst:
+            yield dst
+        return
+    profile = meta.copy()
+    profile.update(driver='GTiff',
+                   tiled=True,
+                   blockxsize=blocksize,
+                   blockysize=blocksize)
+    tmp_path = f'{path}.tmp.tif'
+    try:
+        with rasterio.open(tmp_path, 'w', **profile) as dst:
+            yield dst
+        # The COG driver calculates the overviews and chooses the predictor
+        # according to the data type (horizontal differencing for integers,
+        # floating point predictor otherwise)
+        rasterio.shutil.copy(tmp_path, path,
+                             driver='COG',
+                             COMPRESS=compress.upper(),
+                             PREDICTOR='YES',
+                             BLOCKSIZE=blocksize,
+                             OVERVIEWS='AUTO',
+                             RESAMPLING=overview_resampling.upper())
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,141 @@
+"""
+Simplifying (Multi)Polygons to a vertex budget, f.i. <500 vertices for the USGS Earth Explorer.
+
+The tolerance of shapely.simplify() (Douglas-Peucker) isn't known in advance, so it is found per geometry by bisection: the largest number of vertices within the budget is reached with the smallest tolerance yielding at most <max_vertices> vertices. All geometries are bisected at once, ie. every step is one vectorized shapely.simplify() with an array of tolerances, and chunks of geometries are distributed onto a process pool.
+MultiPolygons (f.i. cities with exclaves) are simplified as a whole, no part is dropped. Vertices are counted as coordinates (shapely.get_num_coordinates()), ie. the closing vertex of every ring counts as well.
+
+Usage:
+    python simplify.py <Shapefile/GeoJSON> <out file> [--max-vertices 499] [--dissolve [<field>]]
+    python simplify.py cities-districts.geojson cities-ds.shp --dissolve city
+"""
+
+import os
+import argparse
+import shapely
+import numpy as np
+import numpy.typing as npt
+import geopandas as gpd
+from concurrent.futures import ProcessPoolExecutor
+
+# USGS Earth Explorer only accepts Polygons with <500 vertices
+USGS_MAX_VERTICES = 499
+
+
+def dissolve(gdf: gpd.GeoDataFrame,
+             by: str = None) -> gpd.GeoDataFrame:
+    """Merge the features (f.i. the districts of a city), inner borders are removed and exclaves are kept.
+
+    :gdf: The features.
+    :by: Field to group the features by (f.i. 'city'), None merges all features into one.
+    :returns: One feature per group (column :by: and the geometry)
+
+    """
+    if by is None:
+        geometry = shapely.union_all(gdf.geometry.values.to_numpy())
+        return gpd.GeoDataFrame(geometry=[geometry], crs=gdf.crs)
+    groups = gdf.groupby(by, sort=False).geometry
+    names = list(groups.groups)
+    geometries = [shapely.union_all(groups.get_group(name).values.to_numpy()) for name in names]
+    return gpd.GeoDataFrame({by: names}, geometry=geometries, crs=gdf.crs)
+
+
+def _bisect_tolerances(geometries: npt.NDArray,
+                       max_vertices: int,
+                       preserve_topology: bool = True,
+                       rtol: float = 1e-4,
+                       max_iterations: int = 64) -> npt.NDArray:
+    """Smallest tolerances (up to :rtol:) simplifying every geometry to at most :max_vertices: vertices.
+
+    :geometries: Array of shapely geometries.
+    :max_vertices: Vertex budget per geometry.
+    :preserve_topology: Passed to shapely.simplify(), keeps rings valid and every part of a MultiPolygon.
+    :rtol: Bisection stops when the interval is smaller than :rtol: times the tolerance.
+    :max_iterations: Upper bound of bisection steps.
+    :returns: float64 array of tolerances, 0 for geometries already within the budget
+
+    """
+    counts = shapely.get_num_coordinates(geometries)
+    todo = np.flatnonzero(counts > max_vertices)
+    lower = np.zeros(len(geometries))  # Too many vertices
+    upper = np.zeros(len(geometries))  # Within the budget (if reachable at all)
+    xmin, ymin, xmax, ymax = shapely.bounds(geometries[todo]).T
+    # No vertex is further away from the simplified geometry than its diagonal
+    upper[todo] = np.hypot(xmax - xmin, ymax - ymin)
+    for _ in range(max_iterations):
+        if len(todo) == 0:
+            break
+        middle = (lower[todo] + upper[todo]) / 2
+        simplified = shapely.simplify(geometries[todo], middle, preserve_topology=preserve_topology)
+        within = shapely.get_num_coordinates(simplified) <= max_vertices
+        upper[todo[within]] = middle[within]
+        lower[todo[~within]] = middle[~within]
+        todo = todo[upper[todo] - lower[todo] > rtol * upper[todo]]
+    return upper
+
+
+def simplify_to_budget(geometries: npt.NDArray,
+                       max_vertices: int = USGS_MAX_VERTICES,
+                       preserve_topology: bool = True,
+                       workers: int = 1,
+                       chunk_size: int = 64) -> tuple[npt.NDArray, npt.NDArray]:
+    """Simplify every geometry to at most :max_vertices: vertices, keeping as many vertices as possible.
+
+    If a geometry can't be simplified enough (f.i. a MultiPolygon with more than :max_vertices: / 4 parts), the simplest version is returned, check it with shapely.get_num_coordinates().
+
+    :geometries: Array of shapely (Multi)Polygons, f.i. GeoSeries.values.
+    :max_vertices: Vertex budget per geometry.
+    :preserve_topology: Passed to shapely.simplify(), keeps rings valid and every part of a MultiPolygon.
+    :workers: Number of processes, chunks of :chunk_size: geometries are bisected in parallel.
+    :chunk_size: Number of geometries per process task.
+    :returns: Simplified geometries and their tolerances
+
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if workers == 1 or len(geometries) <= chunk_size:
+        tolerances = _bisect_tolerances(geometries, max_vertices, preserve_topology)
+    else:
+        chunks = [geometries[start:start + chunk_size] for start in range(0, len(geometries), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tolerances = np.concatenate(list(executor.map(_bisect_tolerances, chunks,
+                                                          [max_vertices] * len(chunks),
+                                                          [preserve_topology] * len(chunks))))
+    simplified = shapely.simplify(geometries, tolerances, preserve_topology=preserve_topology)
+    return simplified, tolerances
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser("simplify")
+    p.add_argument("geometry_file",
+                   help="Shapefile/GeoJSON containing the (Multi)Polygons to simplify.",
+                   type=str)
+    p.add_argument("out_path",
+                   help="Path of the simplified Shapefile/GeoJSON (driver chosen by the extension).",
+                   type=str)
+    p.add_argument("--max-vertices",
+                   help="Vertex budget per feature, defaults to the limit of the USGS Earth Explorer.",
+                   default=USGS_MAX_VERTICES,
+                   type=int)
+    p.add_argument("--dissolve",
+                   help="Merge the features before simplifying, optionally grouped by a field (f.i. the city of districts).",
+                   nargs='?',
+                   const='',
+                   type=str)
+    p.add_argument("--workers",
+                   help="Number of processes, defaults to the number of CPUs.",
+                   default=os.cpu_count(),
+                   type=int)
+    args = p.parse_args()
+
+    gdf = gpd.read_file(args.geometry_file)
+    if args.dissolve is not None:
+        gdf = dissolve(gdf, args.dissolve or None)
+    original = shapely.get_num_coordinates(gdf.geometry.values.to_numpy())
+    simplified, _ = simplify_to_budget(gdf.geometry.values.to_numpy(), args.max_vertices, workers=args.workers)
+    gdf = gdf.set_geometry(simplified)
+    counts = shapely.get_num_coordinates(simplified)
+    for i in np.flatnonzero(counts > args.max_vertices):
+        print(f'Feature {i} keeps {counts[i]} vertices (too many parts for the budget).')
+    print(f'Vertices: {original.sum()} -> {counts.sum()} ({len(gdf)} features, max. {counts.max()})')
+    driver = 'GeoJSON' if args.out_path.lower().endswith(('.geojson', '.json')) else None
+    gdf.to_file(args.out_path, driver=driver)
+    print(f'Created:\n\t{args.out_path}')
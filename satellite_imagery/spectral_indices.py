@@ -0,0 +1,280 @@
+"""
+Registry of spectral indices declared as band algebra expressions.
+
+Instead of a hand-written subclass of `Index` per index, an index is declared by an expression over symbolic band names, f.i.
+    register_index('NDVI', '(NIR - RED) / (NIR + RED)')
+The symbolic names are translated into the band names of the files by a sensor mapping (s. LANDSAT8_BANDS).
+
+compile_indices() compiles one or several indices into a single IndexProgram:
+  - Common subexpressions are calculated once, f.i. NIR - RED for NDVI and SAVI (operands of + and * are sorted, ie. RED + NIR equals NIR + RED).
+  - Every band is read once, even if several indices need it.
+  - The program runs block wise (numexpr-style): All indices are calculated for a block of pixels before the next block is processed, so the temporaries are small (cache resident) and are reused as soon as they aren't needed anymore.
+Divisions add the machine epsilon of float64 to a non constant denominator (like normalized_difference()), ie. a zero denominator yields 0 instead of NaN.
+Expressions adding or subtracting constants (f.i. the soil adjustment of EVI and SAVI) assume surface reflectance and can only be compiled with a reflectance conversion (s. LANDSAT8_REFLECTANCE).
+"""
+
+import ast
+import numpy as np
+import numpy.typing as npt
+
+# Symbolic band names and the bands of Landsat 8/9 (Collection 2) in the file names
+LANDSAT8_BANDS = {'COASTAL': 'B1',
+                  'BLUE': 'B2',
+                  'GREEN': 'B3',
+                  'RED': 'B4',
+                  'NIR': 'B5',
+                  'SWIR1': 'B6',
+                  'SWIR2': 'B7'}
+# Scale and offset to convert Landsat 8/9 Collection 2 Level-2 DN values into surface reflectance
+LANDSAT8_REFLECTANCE = (2.75e-05, -0.2)
+
+# Name of the index and its expression
+INDICES: dict[str, str] = {}
+# Indices whose expression adds or subtracts a constant, ie. which are wrong on DN values
+REFLECTANCE_INDICES: set[str] = set()
+
+# Python syntax allowed in expressions and the according numpy ufuncs
+_BINARY_OPERATORS = {ast.Add: np.add,
+                     ast.Sub: np.subtract,
+                     ast.Mult: np.multiply,
+                     ast.Div: np.divide,
+                     ast.Pow: np.power}
+_FUNCTIONS = {'sqrt': np.sqrt,
+              'abs': np.absolute}
+# Operands can be swapped without changing the result
+_COMMUTATIVE = (np.add, np.multiply)
+_EPS = float(np.finfo(float).eps)
+
+
+def register_index(name: str,
+                   expression: str) -> None:
+    """Declare a spectral index by a band algebra expression.
+
+    :name: Name of the index, f.i. 'NDVI'. Used as file name of the produced images.
+    :expression: Expression over symbolic band names (s. LANDSAT8_BANDS), numbers, +, -, *, /, ** and the functions sqrt() and abs().
+    :returns: None
+
+    """
+    # Compiling validates the expression
+    _Compiler().visit_expression(expression)
+    INDICES[name] = expression
+    REFLECTANCE_INDICES.discard(name)
+    if _has_additive_constant(ast.parse(expression, mode='eval')):
+        REFLECTANCE_INDICES.add(name)
+
+
+def _has_additive_constant(tree: ast.AST) -> bool:
+    """Whether a constant is added to or subtracted from a band term, ie. the result depends on the scale of the bands."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)) \
+                and (isinstance(node.left, ast.Constant) or isinstance(node.right, ast.Constant)):
+            return True
+    return False
+
+
+class _Compiler:
+
+    """Translates expressions into a list of ufunc instructions with common subexpression elimination.
+
+    An operand is one of ('band', <name>), ('const', <value>) or ('node', <number of the instruction>).
+
+    """
+
+    def __init__(self, reflectance: tuple[float, float] = None):
+        self.reflectance = reflectance
+        # Instructions (ufunc, operands) in order of execution
+        self.instructions: list[tuple[np.ufunc, tuple]] = []
+        # K=(ufunc, operands) & V=Number of the instruction calculating it
+        self.known: dict[tuple, int] = {}
+        self.bands: list[str] = []
+
+    def visit_expression(self, expression: str) -> tuple:
+        tree = ast.parse(expression, mode='eval')
+        return self.visit(tree.body)
+
+    def visit(self, node: ast.AST) -> tuple:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return ('const', float(node.value))
+        if isinstance(node, ast.Name):
+            return self.band(node.id)
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            left, right = self.visit(node.left), self.visit(node.right)
+            if isinstance(node.op, ast.Div) and right[0] != 'const':
+                right = self.emit(np.add, (right, ('const', _EPS)))
+            return self.emit(_BINARY_OPERATORS[type(node.op)], (left, right))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return self.emit(np.negative, (self.visit(node.operand),))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.UAdd):
+            return self.visit(node.operand)
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                and node.func.id in _FUNCTIONS and len(node.args) == 1 and not node.keywords):
+            return self.emit(_FUNCTIONS[node.func.id], (self.visit(node.args[0]),))
+        raise ValueError(f"Unsupported syntax in band algebra expression: '{ast.unparse(node)}'")
+
+    def band(self, name: str) -> tuple:
+        if name not in self.bands:
+            self.bands.append(name)
+        if self.reflectance is None:
+            return ('band', name)
+        # Convert DN values into reflectance (once per band thanks to CSE)
+        scale, offset = self.reflectance
+        reflectance = self.emit(np.multiply, (('band', name), ('const', scale)))
+        return self.emit(np.add, (reflectance, ('const', offset)))
+
+    def emit(self, ufunc: np.ufunc, operands: tuple) -> tuple:
+        # Fold constant subexpressions
+        if all(kind == 'const' for kind, _ in operands):
+            return ('const', float(ufunc(*(value for _, value in operands))))
+        if ufunc in _COMMUTATIVE:
+            operands = tuple(sorted(operands, key=repr))
+        key = (ufunc, operands)
+        if key not in self.known:
+            self.known[key] = len(self.instructions)
+            self.instructions.append(key)
+        return ('node', self.known[key])
+
+
+class IndexProgram:
+
+    """Compiled band algebra of one or several indices, calculated in a single pass over the bands.
+
+    Create it with compile_indices().
+
+    """
+
+    def __init__(self,
+                 names: tuple[str, ...],
+                 reflectance: tuple[float, float] = None):
+        compiler = _Compiler(reflectance)
+        self.names = tuple(names)
+        self.results = tuple(compiler.visit_expression(INDICES[name]) for name in self.names)
+        self.instructions = tuple(compiler.instructions)
+        # Symbolic bands needed by the indices
+        self.bands = tuple(compiler.bands)
+        # Number of the instruction which reads a node for the last time,
+        # afterwards its buffer can be reused
+        self.last_use = {}
+        for i, (_, operands) in enumerate(self.instructions):
+            for kind, value in operands:
+                if kind == 'node':
+                    self.last_use[value] = i
+
+    def __call__(self,
+                 bands: dict[str, npt.NDArray],
+                 dtype: npt.DTypeLike = None,
+                 block_size: int = 2**16) -> dict[str, npt.NDArray]:
+        """Calculate all indices.
+
+        :bands: Dict with K=Symbolic band (s. self.bands) & V=NPArray. All arrays have the same shape, integer arrays (f.i. the uint16 DN values) are used without conversion.
+        :dtype: Precision of the calculation and the results, defaults to float32 for integer and float32 bands and float64 otherwise.
+        :block_size: Number of pixels calculated at once.
+        :returns: Dict with K=Name of the index & V=NPArray of the same shape as the bands
+
+        """
+        arrays = [bands[band] for band in self.bands]
+        if dtype is None:
+            dtype = np.result_type(np.float32, *(a.dtype for a in arrays))
+        shape = arrays[0].shape
+        flat_bands = {band: np.ravel(a) for band, a in zip(self.bands, arrays)}
+        outputs = {name: np.empty(shape, dtype=dtype) for name in self.names}
+        flat_outputs = {name: out.reshape(-1) for name, out in outputs.items()}
+        # Buffers for intermediate results, reused in every block
+        buffers = []
+        for start in range(0, int(np.prod(shape)), block_size):
+            block = slice(start, start + block_size)
+            self.__run({band: a[block] for band, a in flat_bands.items()},
+                       {name: out[block] for name, out in flat_outputs.items()},
+                       buffers,
+                       dtype)
+        return outputs
+
+    def __run(self,
+              bands: dict[str, npt.NDArray],
+              outputs: dict[str, npt.NDArray],
+              buffers: list[npt.NDArray],
+              dtype: np.dtype) -> None:
+        """Execute the instructions on one block of pixels and write the indices into :outputs:."""
+        size = len(next(iter(outputs.values())))
+        # Results are written directly into the output of (the first) index
+        # computed by an instruction
+        result_nodes = {}
+        for name, (kind, value) in zip(self.names, self.results):
+            if kind == 'node' and value not in result_nodes:
+                result_nodes[value] = outputs[name]
+        free = list(range(len(buffers)))
+        # K=Node & V=NPArray holding its values
+        values = {}
+        # K=Node & V=Number of the buffer
+        in_buffer = {}
+
+        def operand(kind, value):
+            if kind == 'band':
+                return bands[value]
+            if kind == 'const':
+                return value
+            return values[value]
+
+        for i, (ufunc, operands) in enumerate(self.instructions):
+            args = [operand(kind, value) for kind, value in operands]
+            # Release buffers of nodes which aren't needed anymore, the
+            # output may reuse them (ufuncs allow in-place operation)
+            for kind, value in set(operands):
+                if kind == 'node' and self.last_use[value] == i and value in in_buffer:
+                    free.append(in_buffer.pop(value))
+            if i in result_nodes:
+                out = result_nodes[i]
+            else:
+                if not free:
+                    buffers.append(np.empty(len(next(iter(bands.values()))), dtype=dtype))
+                    free.append(len(buffers) - 1)
+                in_buffer[i] = free.pop()
+                out = buffers[in_buffer[i]][:size]
+            values[i] = ufunc(*args, out=out, dtype=dtype)
+        # Indices which are a band, a constant or the result of another index
+        for name, (kind, value) in zip(self.names, self.results):
+            out = outputs[name]
+            if kind != 'node' or result_nodes[value] is not out:
+                out[...] = operand(kind, value)
+
+
+def product_name(name: str,
+                 reflectance: tuple[float, float] = None) -> str:
+    """Name of the files of a registered index, f.i. 'NDVI_SR' for 'sc_NDVI_SR.geotiff'.
+
+    The suffix tells the input ('_SR': surface reflectance, '_DN': DN values), so the files never collide with the ones of the hand-written classes of Index.py (f.i. 'sc_NDWI.geotiff' of NDWI holds the NDWI scaled by its maximum).
+
+    :name: Name of the registered index.
+    :reflectance: Conversion into reflectance the index is calculated with (s. compile_indices()).
+    :returns: '<name>_SR' or '<name>_DN'
+
+    """
+    return f"{name}_{'DN' if reflectance is None else 'SR'}"
+
+
+def compile_indices(names: tuple[str, ...],
+                    reflectance: tuple[float, float] = None) -> IndexProgram:
+    """Compile the registered indices :names: into one program.
+
+    :names: Names of registered indices, f.i. ('NDVI', 'NDWI').
+    :reflectance: Scale and offset to convert the bands into reflectance before the calculation (s. LANDSAT8_REFLECTANCE), required by the indices in REFLECTANCE_INDICES (f.i. EVI and SAVI).
+    :returns: The IndexProgram calculating all indices in one pass
+
+    """
+    unknown = [name for name in names if name not in INDICES]
+    if unknown:
+        raise KeyError(f"Unknown index/indices {unknown}, registered are {list(INDICES)}.")
+    if reflectance is None:
+        dn_unsafe = [name for name in names if name in REFLECTANCE_INDICES]
+        if dn_unsafe:
+            raise ValueError(f"The constants of {dn_unsafe} assume surface reflectance, pass a reflectance conversion (s. LANDSAT8_REFLECTANCE).")
+    return IndexProgram(names, reflectance)
+
+
+register_index('NDVI', '(NIR - RED) / (NIR + RED)')
+register_index('NDWI', '(GREEN - NIR) / (GREEN + NIR)')
+register_index('MNDWI', '(GREEN - SWIR1) / (GREEN + SWIR1)')
+register_index('NDBI', '(SWIR1 - NIR) / (SWIR1 + NIR)')
+register_index('NBR', '(NIR - SWIR2) / (NIR + SWIR2)')
+# The constants of EVI and SAVI assume surface reflectance (s. LANDSAT8_REFLECTANCE)
+register_index('EVI', '2.5 * (NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1)')
+register_index('SAVI', '1.5 * (NIR - RED) / (NIR + RED + 0.5)')
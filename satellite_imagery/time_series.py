@@ -0,0 +1,164 @@
+"""
+Windowed calculations over a time series of co-registered single channel GeoTIFFs, f.i. the 'sc_'-GeoTIFFs of the NDVI of several dates.
+
+The same window of all dates is read at once and the results are written window by window into GeoTIFFs, ie. memory depends on the window size and the number of dates, not on the size of the scenes. The calculations use the values stored in the GeoTIFFs (f.i. <NDVI * 255> of the 'sc_'-GeoTIFFs).
+"""
+
+import os
+import re
+import contextlib
+import rasterio
+import numpy as np
+import numpy.typing as npt
+from itertools import pairwise
+from read_write_functions import split_windows, open_geotiff
+
+# Bands of the GeoTIFF written by temporal_statistics()
+STATISTICS = ('mean', 'min', 'max', 'slope', 'anomaly', 'count')
+
+
+def date_from_path(path: str) -> str:
+    """Retrieve the date (YYYY-MM-DD) from a path, f.i. './USGS/image_working_dir/ndvi_2022-05-15/out/sc_NDVI.geotiff'.
+
+    :path: Path containing a date.
+    :returns: The date as string
+
+    """
+    m = re.search(r'\d{4}-\d{2}-\d{2}', path)
+    if m is None:
+        raise ValueError(f"No date (YYYY-MM-DD) in '{path}'.")
+    return m.group(0)
+
+
+def difference_dtype(dtype: npt.DTypeLike) -> np.dtype:
+    """Smallest signed data type holding the difference of two values of :dtype:, f.i. int32 for uint16 (floats are kept)."""
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return dtype
+    return np.dtype(f'int{min(dtype.itemsize * 16, 64)}')
+
+
+def _open_series(stack: contextlib.ExitStack,
+                 paths: tuple[str, ...]) -> list:
+    """Open all GeoTIFFs of a time series and check that they are co-registered."""
+    sources = [stack.enter_context(rasterio.open(path)) for path in paths]
+    first = sources[0]
+    for path, src in zip(paths, sources):
+        if src.shape != first.shape or src.transform != first.transform or src.crs != first.crs:
+            raise ValueError(f"'{path}' isn't co-registered with '{paths[0]}'.")
+    return sources
+
+
+def _read_series(sources: list,
+                 window) -> npt.NDArray:
+    """Read a window of all dates into an array of shape (dates, height, width)."""
+    return np.stack([src.read(1, window=window) for src in sources])
+
+
+def pairwise_differences(paths: tuple[str, ...],
+                         out_dir: str,
+                         prefix: str = 'difference',
+                         tile_size: int = None,
+                         cog: bool = False) -> list[str]:
+    """Calculate the differences of consecutive dates window by window.
+
+    :paths: Paths to the GeoTIFFs, chronologically from oldest to newest. The date is retrieved from the path (s. date_from_path()).
+    :out_dir: Directory to save the differences in.
+    :prefix: Prefix of the file names '<prefix>_<older date>_<newer date>.geotiff'.
+    :tile_size: Edge length of the windows, defaults to the internal blocks of the first GeoTIFF.
+    :cog: Write Cloud-Optimized GeoTIFFs, s. open_geotiff().
+    :returns: Paths of the written GeoTIFFs (newer minus older, of the data type s. difference_dtype(), f.i. int16 for uint8 and int32 for uint16 GeoTIFFs)
+
+    """
+    dates = [date_from_path(path) for path in paths]
+    out_paths = [os.path.join(out_dir, f'{prefix}_{date1}_{date2}.geotiff')
+                 for date1, date2 in pairwise(dates)]
+    with contextlib.ExitStack() as stack:
+        sources = _open_series(stack, paths)
+        meta = sources[0].meta.copy()
+        dtype = difference_dtype(np.result_type(*(src.dtypes[0] for src in sources)))
+        meta.update(count=1, dtype=str(dtype), nodata=None)
+        images = [stack.enter_context(open_geotiff(path, meta, cog))
+                  for path in out_paths]
+        for window in split_windows(paths[0], tile_size):
+            series = _read_series(sources, window).astype(dtype)
+            differences = np.diff(series, axis=0)
+            for image, difference in zip(images, differences):
+                image.write(difference, 1, window=window)
+    return out_paths
+
+
+def temporal_statistics(paths: tuple[str, ...],
+                        out_path: str,
+                        baseline: tuple[str, ...] = None,
+                        tile_size: int = None,
+                        cog: bool = False) -> str:
+    """Calculate per pixel statistics over time window by window.
+
+    Pixels equal to the nodata value of their GeoTIFF are left out, ie. every pixel is aggregated over the dates it is valid on. The bands of the written GeoTIFF (float32, nodata NaN) are, in the order of STATISTICS:
+      1. mean
+      2. min
+      3. max
+      4. slope: Trend of a linear least squares fit over the valid dates, change per day (0 if all valid dates are the same)
+      5. anomaly: Newest date minus the mean of the valid :baseline: dates
+      6. count: Number of valid dates
+    Statistics without valid values (f.i. the anomaly of a pixel which is nodata on the newest date) are NaN.
+
+    :paths: Paths to the GeoTIFFs, chronologically from oldest to newest. The date is retrieved from the path (s. date_from_path()).
+    :out_path: Path of the GeoTIFF holding the statistics.
+    :baseline: Dates (YYYY-MM-DD) of the baseline, defaults to all dates.
+    :tile_size: Edge length of the windows, defaults to the internal blocks of the first GeoTIFF.
+    :cog: Write a Cloud-Optimized GeoTIFF, s. open_geotiff().
+    :returns: Path of the written GeoTIFF
+
+    """
+    dates = [date_from_path(path) for path in paths]
+    days = np.array(dates, dtype='datetime64[D]').astype(np.float64)
+    # Centered time keeps the sums of the slope small
+    days_centered = (days - days.mean()).astype(np.float32)
+    if baseline is None:
+        baseline = dates
+    is_baseline = np.isin(dates, baseline)
+    if not is_baseline.any():
+        raise ValueError(f"None of the baseline dates {baseline} is in the time series.")
+    with contextlib.ExitStack() as stack:
+        sources = _open_series(stack, paths)
+        meta = sources[0].meta.copy()
+        meta.update(count=len(STATISTICS), dtype=rasterio.float32, nodata=np.nan)
+        image = stack.enter_context(open_geotiff(out_path, meta, cog))
+        image.descriptions = STATISTICS
+        nodata = [src.nodata for src in sources]
+        for window in split_windows(paths[0], tile_size):
+            series = _read_series(sources, window)
+            valid = np.ones(series.shape, dtype=bool)
+            for i, value in enumerate(nodata):
+                if value is not None and not np.isnan(value):
+                    valid[i] = series[i] != value
+            series = series.astype(np.float32)
+            valid &= np.isfinite(series)
+            # Invalid values don't contribute to the sums
+            series[~valid] = 0
+            statistics = np.empty((len(STATISTICS), *series.shape[1:]), dtype=np.float32)
+            count = np.sum(valid, axis=0, out=statistics[5])
+            empty = count == 0
+            weights = valid.astype(np.float32)
+            sums = np.sum(series, axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                np.divide(sums, count, out=statistics[0])
+                np.min(series, axis=0, where=valid, initial=np.inf, out=statistics[1])
+                np.max(series, axis=0, where=valid, initial=-np.inf, out=statistics[2])
+                statistics[1:3, empty] = np.nan
+                # Least squares fit over the valid dates of every pixel:
+                # (n * sum(t * y) - sum(t) * sum(y)) / (n * sum(t^2) - sum(t)^2)
+                days_sum = np.einsum('t,thw->hw', days_centered, weights)
+                denominator = count * np.einsum('t,thw->hw', days_centered**2, weights) - days_sum**2
+                numerator = count * np.einsum('t,thw->hw', days_centered, series) - days_sum * sums
+                np.divide(numerator, denominator, out=statistics[3])
+                # Only one valid date (or all the same)
+                statistics[3][denominator <= 0] = 0
+                statistics[3][empty] = np.nan
+                np.divide(np.sum(series[is_baseline], axis=0), np.sum(valid[is_baseline], axis=0), out=statistics[4])
+                np.subtract(series[-1], statistics[4], out=statistics[4])
+                statistics[4][~valid[-1]] = np.nan
+            image.write(statistics, window=window)
+    return out_path
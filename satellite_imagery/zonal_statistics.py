@@ -0,0 +1,256 @@
+"""
+Statistics of an index per zone, f.i. the mean, median and percentiles of the NDVI in every district of Munich ('munich-districts.geojson').
+
+All zones are rasterized once into a label raster (0 outside of all zones, <number of the feature> + 1 inside, overlapping zones belong to the later feature). The index is read window by window and every window is aggregated for all zones at once:
+  - count and mean by np.bincount() over the labels
+  - min, max, median and percentiles are order statistics. For 8 bit GeoTIFFs (f.i. the 'sc_'-GeoTIFFs) a histogram of 256 values per zone is accumulated (bincount() of <label * 256 + value>), otherwise the valid pixels are sorted once by zone and value.
+Hence the costs hardly depend on the number of zones. Percentiles are interpolated linearly between the closest ranks (like np.percentile()).
+The nodata value of the 'sc_'-GeoTIFFs is 0, which is a valid index value (f.i. NDVI 0 of bare soil). Pass --keep-nodata (mask_nodata=False) for them, then the zones alone define the valid pixels.
+
+Usage:
+    python zonal_statistics.py <Shapefile/GeoJSON> <GeoTIFF> [<GeoTIFF> ...] --out <CSV>
+    python zonal_statistics.py munich-districts.geojson ./USGS/image_working_dir/ndvi_*/out/sc_NDVI.geotiff --scale 255 --keep-nodata --out ndvi_districts.csv
+"""
+
+import os
+import csv
+import argparse
+import rasterio
+import numpy as np
+import numpy.typing as npt
+import geopandas as gpd
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import rasterize
+from masks import read_geometries
+from read_write_functions import split_windows
+from time_series import date_from_path
+
+# K=(Absolute path, modification time, grid, CRS, all_touched) & V=label raster
+_labels: dict[tuple, npt.NDArray] = {}
+
+
+def label_raster(geometry_file: str,
+                 transform: Affine,
+                 shape: tuple[int, int],
+                 crs: CRS = None,
+                 all_touched: bool = False) -> npt.NDArray:
+    """Rasterize all zones of a shapefile/GeoJSON into one raster (cached per grid).
+
+    :geometry_file: Path to the shapefile/GeoJSON, every feature is a zone.
+    :transform: Affine transform of the raster.
+    :shape: Shape (height, width) of the raster.
+    :crs: CRS of the raster, the geometries are transformed into it.
+    :all_touched: Include all pixels touched by a zone, not only those whose center is within.
+    :returns: Array of :shape:, 0 outside of all zones and <number of the feature> + 1 inside (uint16, uint32 for more than 65534 zones)
+
+    """
+    key = (os.path.abspath(geometry_file), os.stat(geometry_file).st_mtime_ns,
+           tuple(transform)[:6], tuple(shape), crs.to_wkt() if crs is not None else None, all_touched)
+    if key not in _labels:
+        geometries = read_geometries(geometry_file, crs)
+        dtype = np.uint16 if len(geometries) < 2**16 - 1 else np.uint32
+        shapes = [(geometry, label) for label, geometry in enumerate(geometries, start=1)
+                  if geometry is not None and not geometry.is_empty]
+        _labels[key] = rasterize(shapes,
+                                 out_shape=shape,
+                                 transform=transform,
+                                 fill=0,
+                                 all_touched=all_touched,
+                                 dtype=dtype)
+    return _labels[key]
+
+
+def zone_names(geometry_file: str,
+               name_field: str = None) -> list[str]:
+    """Names of the zones, ie. the values of :name_field: or the labels if None or missing."""
+    gdf = gpd.read_file(geometry_file, ignore_geometry=True)
+    if name_field is None or name_field not in gdf.columns:
+        return [str(label) for label in range(1, len(gdf) + 1)]
+    return [str(name) for name in gdf[name_field]]
+
+
+def _order_statistics(counts: npt.NDArray,
+                      q: float,
+                      value_at_rank) -> npt.NDArray:
+    """Percentile :q: of every zone, interpolated linearly between the closest ranks.
+
+    :counts: Number of values per zone.
+    :q: Percentile in [0, 100].
+    :value_at_rank: Function mapping (zones, ranks) to the values of these ranks within the zones.
+    :returns: float64 array, NaN for empty zones
+
+    """
+    result = np.full(len(counts), np.nan)
+    zones = np.flatnonzero(counts)
+    position = q / 100 * (counts[zones] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    lower_value = value_at_rank(zones, lower).astype(np.float64)
+    upper_value = value_at_rank(zones, upper).astype(np.float64)
+    result[zones] = lower_value + (upper_value - lower_value) * (position - lower)
+    return result
+
+
+def zonal_statistics(geotiff: str,
+                     labels: npt.NDArray,
+                     n_zones: int,
+                     percentiles: tuple[float, ...] = (10, 25, 75, 90),
+                     band: int = 1,
+                     tile_size: int = None,
+                     mask_nodata: bool = True) -> dict[str, npt.NDArray]:
+    """Calculate the statistics of all zones in one pass over :geotiff:.
+
+    Non-finite values and, if :mask_nodata:, pixels equal to the nodata value of :geotiff: are ignored.
+
+    :geotiff: Path to the GeoTIFF of the index, on the grid of :labels:.
+    :labels: Label raster, s. label_raster().
+    :n_zones: Number of zones (ie. the highest label).
+    :percentiles: Percentiles in [0, 100] besides the median.
+    :band: Number of the band in :geotiff: (starting at 1).
+    :tile_size: Edge length of the windows, defaults to the internal blocks of :geotiff:.
+    :mask_nodata: Ignore pixels equal to the nodata value. False for rasters whose nodata value is a valid value within the zones, f.i. 0 of the 'sc_'-GeoTIFFs.
+    :returns: Columns 'label', 'count', 'mean', 'min', 'p<q>', 'median', 'max' (one value per zone, NaN for zones without valid pixels)
+
+    """
+    n_labels = n_zones + 1  # Label 0 is outside of all zones
+    counts = np.zeros(n_labels, dtype=np.int64)
+    sums = np.zeros(n_labels, dtype=np.float64)
+    with rasterio.open(geotiff) as src:
+        if src.shape != labels.shape:
+            raise ValueError(f"'{geotiff}' of shape {src.shape} doesn't match the label raster of shape {labels.shape}.")
+        nodata = src.nodata if mask_nodata else None
+        dtype = np.dtype(src.dtypes[band - 1])
+        # 8 bit values: histogram of 256 values per zone, otherwise: all valid values sorted at the end
+        histogram = np.zeros(n_labels * 256, dtype=np.int64) if dtype.itemsize == 1 and dtype.kind in 'ui' else None
+        offset = 128 if dtype.kind == 'i' else 0
+        zone_values, values = [], []
+        for window in split_windows(geotiff, tile_size):
+            data = src.read(band, window=window)
+            zone = labels[window.toslices()]
+            valid = zone != 0
+            if nodata is not None:
+                valid &= data != nodata
+            if dtype.kind == 'f':
+                valid &= np.isfinite(data)
+            zone, data = zone[valid], data[valid]
+            counts += np.bincount(zone, minlength=n_labels)
+            sums += np.bincount(zone, weights=data, minlength=n_labels)
+            if histogram is not None:
+                histogram += np.bincount(zone.astype(np.int64) * 256 + (data.astype(np.int64) + offset),
+                                         minlength=n_labels * 256)
+            else:
+                zone_values.append(zone)
+                values.append(data)
+
+    if histogram is not None:
+        cumulative = histogram.reshape(n_labels, 256).cumsum(axis=1)
+
+        def value_at_rank(zones, ranks):
+            # Number of values <= a value is the cumulative histogram, the value of rank r the first exceeding r
+            return (cumulative[zones] <= ranks[:, None]).sum(axis=1) - offset
+    else:
+        zone_values, values = np.concatenate(zone_values), np.concatenate(values)
+        order = np.lexsort((values, zone_values))
+        sorted_values = values[order]
+        starts = np.cumsum(counts) - counts
+
+        def value_at_rank(zones, ranks):
+            return sorted_values[starts[zones] + ranks]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+    statistics = {'label': np.arange(n_labels),
+                  'count': counts,
+                  'mean': mean,
+                  'min': _order_statistics(counts, 0, value_at_rank)}
+    for q in sorted((*percentiles, 50)):
+        name = 'median' if q == 50 else f'p{q:g}'
+        statistics[name] = _order_statistics(counts, q, value_at_rank)
+    statistics['max'] = _order_statistics(counts, 100, value_at_rank)
+    # Drop label 0 (outside of all zones)
+    return {column: values[1:] for column, values in statistics.items()}
+
+
+def zonal_statistics_table(geometry_file: str,
+                           geotiffs: list[str],
+                           out_path: str,
+                           name_field: str = 'name',
+                           percentiles: tuple[float, ...] = (10, 25, 75, 90),
+                           scale: float = 1.,
+                           all_touched: bool = False,
+                           mask_nodata: bool = True) -> str:
+    """Calculate the statistics of all zones for every GeoTIFF and save them as CSV (one row per GeoTIFF and zone).
+
+    The label raster is rasterized once per grid, ie. once for co-registered GeoTIFFs.
+
+    :geometry_file: Path to the shapefile/GeoJSON, every feature is a zone.
+    :geotiffs: Paths to the GeoTIFFs of the index, f.i. the 'sc_'-GeoTIFFs of several dates.
+    :out_path: Path of the CSV.
+    :name_field: Field holding the name of the zones, s. zone_names().
+    :percentiles: Percentiles in [0, 100] besides the median.
+    :scale: The values are divided by :scale:, f.i. 255 for the 'sc_'-GeoTIFFs (<index * 255>). The count isn't.
+    :all_touched: Include all pixels touched by a zone, not only those whose center is within.
+    :mask_nodata: Ignore pixels equal to the nodata value, s. zonal_statistics().
+    :returns: :out_path:
+
+    """
+    names = zone_names(geometry_file, name_field)
+    with open(out_path, 'w', newline='') as f:
+        writer = None
+        for geotiff in geotiffs:
+            with rasterio.open(geotiff) as src:
+                labels = label_raster(geometry_file, src.transform, src.shape, src.crs, all_touched)
+            statistics = zonal_statistics(geotiff, labels, len(names), percentiles, mask_nodata=mask_nodata)
+            for column in statistics:
+                if column not in ('label', 'count'):
+                    statistics[column] /= scale
+            try:
+                date = date_from_path(geotiff)
+            except ValueError:
+                date = ''
+            if writer is None:
+                writer = csv.writer(f)
+                writer.writerow(['geotiff', 'date', 'zone', *statistics])
+            for i, name in enumerate(names):
+                writer.writerow([geotiff, date, name, *(values[i] for values in statistics.values())])
+    return out_path
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser("zonal_statistics")
+    p.add_argument("geometry_file",
+                   help="Shapefile/GeoJSON containing the zones, f.i. the districts of Munich.",
+                   type=str)
+    p.add_argument("geotiffs",
+                   help="GeoTIFFs of the index, f.i. the 'sc_'-GeoTIFFs of several dates.",
+                   nargs='+',
+                   type=str)
+    p.add_argument("--out",
+                   help="Path of the CSV.",
+                   default='zonal_statistics.csv',
+                   type=str)
+    p.add_argument("--name-field",
+                   help="Field holding the name of the zones, the labels are used if missing.",
+                   default='name',
+                   type=str)
+    p.add_argument("--percentiles",
+                   help="Percentiles besides the median.",
+                   nargs='*',
+                   default=[10, 25, 75, 90],
+                   type=float)
+    p.add_argument("--scale",
+                   help="Divide the values by it, f.i. 255 for the 'sc_'-GeoTIFFs.",
+                   default=1.,
+                   type=float)
+    p.add_argument("--all-touched",
+                   help="Include all pixels touched by a zone, not only those whose center is within.",
+                   action='store_true')
+    p.add_argument("--keep-nodata",
+                   help="Don't ignore pixels equal to the nodata value, f.i. 0 of the 'sc_'-GeoTIFFs is a valid index value.",
+                   action='store_true')
+    args = p.parse_args()
+
+    zonal_statistics_table(args.geometry_file, args.geotiffs, args.out, args.name_field,
+                           tuple(args.percentiles), args.scale, args.all_touched, not args.keep_nodata)
+    print(f'Created:\n\t{args.out}')